@@ -4,43 +4,84 @@ SM_UP GPU Worker Service
 """
 
 import os
+import json
+import time
 import asyncio
+import zipfile
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks
-from fastapi.responses import JSONResponse
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 import uvicorn
 from loguru import logger
 
-from core.config import settings
-from core.models import UpscaleRequest, UpscaleResponse, HealthResponse
-from core.upscaler import FluxUpscaler
-from core.monitoring import setup_monitoring
-from utils.file_handler import FileHandler
+from core.config import settings, get_batch_config
+from core.models import UpscaleRequest, UpscaleResponse, HealthResponse, ProcessingStatus, OutputPreset, ProcessingMetrics, BatchOutput, QualityTier
+from core.worker_pool import GPUWorkerPool
+from core.task_queue import TaskQueue, QueueFullError
+from core.result_cache import ResultCache
+from core.image_context import ImageContext
+from core.encoding import ImageEncoder
+from core.adapters import AdapterError, DEFAULT_ADAPTER, adapter_path, list_adapters
+from core.monitoring import setup_monitoring, StageTimer, metrics_collector
+from core.progress import format_sse
+from core.batch_pipeline import BatchItem, BatchPipeline
+from utils.file_handler import FileHandler, UploadTooLargeError
+from utils.file_response import SendfileResponse
+from utils.upload_limit import UploadLimitMiddleware, MULTIPART_OVERHEAD
+from utils.archive import ZipStream
 from utils.gpu_monitor import GPUMonitor
+from utils.storage_index import StorageJanitor
+
+
+# How often a waiting /upscale request checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# Content types accepted as a zip archive by /upscale/batch
+ARCHIVE_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed"}
 
 
 # Global instances
 upscaler = None
+encoder = None
 file_handler = None
 gpu_monitor = None
+task_queue = None
+storage_janitor = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """إدارة دورة حياة التطبيق"""
-    global upscaler, file_handler, gpu_monitor
+    global upscaler, encoder, file_handler, gpu_monitor, task_queue, storage_janitor
     
     logger.info("🚀 بدء تشغيل GPU Worker Service...")
     
     try:
+        # Start encoder processes before any inference threads exist
+        encoder = ImageEncoder()
+        encoder.start()
+        
         # Initialize components
         file_handler = FileHandler()
+        # Index managed directories once, then evict by age and size every CLEANUP_INTERVAL
+        storage_janitor = StorageJanitor(file_handler.storage)
+        await storage_janitor.start()
         gpu_monitor = GPUMonitor()
-        upscaler = FluxUpscaler()
+        # Sample GPU/system telemetry in the background so requests only read the snapshot
+        gpu_monitor.start()
+        result_cache = ResultCache() if settings.ENABLE_RESULT_CACHE else None
+        # One pipeline replica per visible GPU
+        upscaler = GPUWorkerPool(result_cache=result_cache, encoder=encoder, monitor=gpu_monitor)
         
         # Load models
         await upscaler.load_models()
         
+        # Start task queue
+        task_queue = TaskQueue(upscaler, file_handler)
+        task_queue.start()
+        
         logger.success("✅ تم تحميل جميع المكونات بنجاح")
         
         yield
@@ -50,8 +91,16 @@ async def lifespan(app: FastAPI):
         raise
     finally:
         logger.info("🔄 إيقاف GPU Worker Service...")
+        if task_queue:
+            await task_queue.stop()
+        if storage_janitor:
+            await storage_janitor.stop()
         if upscaler:
             await upscaler.cleanup()
+        if encoder:
+            encoder.shutdown()
+        if gpu_monitor:
+            gpu_monitor.stop()
 
 
 # Create FastAPI app
@@ -66,6 +115,20 @@ app = FastAPI(
 setup_monitoring(app)
 
 
+def upload_limit(path: str) -> Optional[int]:
+    """أكبر جسم طلب مقبول لكل endpoint رفع - يُقرأ من الإعدادات عند كل طلب"""
+    if path == "/upscale":
+        return settings.MAX_FILE_SIZE + MULTIPART_OVERHEAD
+    if path == "/upscale/batch":
+        batch_files = settings.MAX_BATCH_FILES * settings.MAX_FILE_SIZE
+        return max(settings.MAX_ARCHIVE_SIZE, batch_files) + MULTIPART_OVERHEAD
+    return None
+
+
+# Reject oversized uploads while they arrive, before multipart parsing spools them to disk
+app.add_middleware(UploadLimitMiddleware, limit_for=upload_limit)
+
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """فحص صحة الخدمة"""
@@ -79,51 +142,357 @@ async def health_check():
             gpu_memory_used=gpu_info["memory_used"],
             gpu_memory_total=gpu_info["memory_total"],
             system_memory_used=memory_info["used"],
-            system_memory_total=memory_info["total"]
+            system_memory_total=memory_info["total"],
+            models_loaded=upscaler.is_loaded if upscaler else False,
+            queue_size=task_queue.qsize() if task_queue else 0
         )
     except Exception as e:
         logger.error(f"Health check failed: {e}")
         raise HTTPException(status_code=503, detail="Service unhealthy")
 
 
-@app.post("/upscale", response_model=UpscaleResponse)
+@app.post("/upscale", response_model=UpscaleResponse, status_code=202)
 async def upscale_image(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    prompt: str = "high quality, detailed, sharp, professional photography"
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    prompt: str = "high quality, detailed, sharp, professional photography",
+    output_format: Optional[OutputPreset] = None,
+    adapter: Optional[str] = None,
+    quality_tier: Optional[QualityTier] = None,
+    source_task_id: Optional[str] = None,
+    wait: bool = False
 ):
-    """رفع جودة الصورة"""
+    """رفع جودة الصورة - إضافة المهمة إلى الطابور وإرجاع معرفها فوراً، أو انتظار النتيجة مع wait"""
     
-    if not upscaler:
+    if not upscaler or not task_queue:
         raise HTTPException(status_code=503, detail="Upscaler not initialized")
     
+    # Validate adapter before accepting the upload
+    validate_adapter(adapter)
+    
+    params = {"output_format": output_format, "adapter": adapter, "quality_tier": quality_tier}
+    if source_task_id:
+        if file is not None:
+            raise HTTPException(status_code=400, detail="Send either a file or source_task_id, not both")
+        response = resubmit_source(source_task_id, prompt, params)
+    else:
+        if file is None:
+            raise HTTPException(status_code=400, detail="File is required")
+        response = await submit_upload(file, prompt, params)
+    
+    if not wait:
+        return response
+    
+    # Hold the connection until the result is ready - a client that leaves cancels its job
+    result = await wait_for_task(request, response.task_id)
+    return JSONResponse(status_code=200, content=jsonable_encoder(result))
+
+
+def validate_adapter(adapter: Optional[str]):
+    """رفض المحول غير الموجود، أو غير الافتراضي عندما تكون الأوزان من لقطة مدمجة، قبل قبول المهمة"""
+    if not adapter:
+        return
+    try:
+        adapter_path(adapter)
+    except AdapterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if adapter != DEFAULT_ADAPTER and not upscaler.swappable:
+        raise HTTPException(status_code=400, detail="Adapter switching is not available when running from a baked snapshot")
+
+
+def resubmit_source(source_task_id: str, prompt: str, params: dict) -> UpscaleResponse:
+    """مهمة جديدة على صورة مهمة معاينة سابقة - لا رفع ولا تحقق ولا بصمة من جديد"""
+    try:
+        response = task_queue.resubmit(source_task_id, prompt, stage_timer=StageTimer(), **params)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    if response is None:
+        raise HTTPException(status_code=404, detail="Source input not found (only preview tasks keep their input)")
+    return response
+
+
+async def submit_upload(file: UploadFile, prompt: str, params: dict) -> UpscaleResponse:
+    """حفظ الصورة المرفوعة والتحقق منها ثم إضافتها إلى الطابور"""
+    
     # Validate file
-    if not file.content_type.startswith('image/'):
+    if not file.content_type or not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
     
+    upload = None
+    timer = StageTimer()
     try:
         logger.info(f"📥 استلام طلب معالجة صورة: {file.filename}")
         
-        # Save uploaded file
-        input_path = await file_handler.save_upload(file)
+        # Save uploaded file (streamed, hashed while writing)
+        with timer.stage("upload"):
+            upload = await file_handler.save_upload(file)
         
-        # Validate image
-        if not await file_handler.validate_image(input_path):
+        # Validate image (header only - decoding happens once, in the upscaler)
+        image = ImageContext(upload.path, content_hash=upload.content_hash, file_size=upload.size)
+        with timer.stage("validate"):
+            valid = await file_handler.validate_image(image)
+        if not valid:
             raise HTTPException(status_code=400, detail="Invalid image file")
         
-        # Process image
-        result = await upscaler.upscale_image(input_path, prompt)
-        
-        # Schedule cleanup
-        background_tasks.add_task(file_handler.cleanup_temp_files, [input_path])
+        # Queue for processing (stage timings travel with the task into its metadata)
+        response = task_queue.submit(image, prompt, stage_timer=timer, **params)
         
-        logger.success(f"✅ تم معالجة الصورة بنجاح: {result.output_path}")
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        if upload:
+            await file_handler.cleanup_temp_files([upload.path])
+        raise
+    except QueueFullError as e:
+        await file_handler.cleanup_temp_files([upload.path])
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ خطأ في استلام الصورة: {e}")
+        if upload:
+            await file_handler.cleanup_temp_files([upload.path])
+        raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+    
+    return response
+
+
+async def wait_for_task(request: Request, task_id: str) -> UpscaleResponse:
+    """انتظار نتيجة مهمة مع إلغائها إذا انقطع اتصال العميل"""
+    waiter = asyncio.ensure_future(task_queue.wait(task_id))
+    try:
+        while True:
+            done, _ = await asyncio.wait({waiter}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return waiter.result()
+            if await request.is_disconnected():
+                logger.info(f"🔌 انقطع اتصال العميل - إلغاء المهمة {task_id}")
+                return task_queue.cancel(task_id, reason="disconnected")
+    finally:
+        waiter.cancel()
+
+
+@app.post("/upscale/batch")
+async def upscale_batch(
+    files: List[UploadFile] = File(...),
+    prompt: str = "high quality, detailed, sharp, professional photography",
+    output_format: Optional[OutputPreset] = None,
+    adapter: Optional[str] = None,
+    quality_tier: Optional[QualityTier] = None,
+    output: BatchOutput = BatchOutput.MANIFEST
+):
+    """رفع جودة مجموعة صور (ملفات أو أرشيف zip) - النتائج تُبث فور اكتمالها كبيان NDJSON أو أرشيف zip"""
+    
+    if not upscaler or not file_handler or not task_queue:
+        raise HTTPException(status_code=503, detail="Upscaler not initialized")
+    
+    # Batch items share the queue capacity - refuse before accepting the uploads
+    if not task_queue.has_capacity():
+        raise HTTPException(status_code=503, detail=f"Queue is full: {task_queue.qsize()} tasks")
+    
+    validate_adapter(adapter)
+    
+    max_files = get_batch_config()["max_files"]
+    images, archives, saved = [], [], []
+    count = 0
+    try:
+        # Save every upload before streaming - the request body is consumed once the response starts
+        for file in files:
+            if is_archive_upload(file):
+                archive = await file_handler.save_upload(file, max_size=file_handler.config["max_archive_size"])
+                saved.append(archive.path)
+                try:
+                    members = await asyncio.to_thread(file_handler.list_archive, archive.path)
+                except zipfile.BadZipFile:
+                    raise HTTPException(status_code=400, detail=f"Invalid zip archive: {file.filename}")
+                archives.append(archive.path)
+                count += len(members)
+            elif file.content_type and file.content_type.startswith('image/'):
+                upload = await file_handler.save_upload(file)
+                saved.append(upload.path)
+                images.append((file.filename, upload))
+                count += 1
+            else:
+                raise HTTPException(status_code=400, detail=f"File must be an image or a zip archive: {file.filename}")
+            
+            if count > max_files:
+                raise HTTPException(status_code=413, detail=f"Too many images: more than {max_files} per batch")
         
-        return result
+        if count == 0:
+            raise HTTPException(status_code=400, detail="No images in request")
         
+    except UploadTooLargeError as e:
+        await file_handler.cleanup_temp_files(saved)
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        await file_handler.cleanup_temp_files(saved)
+        raise
     except Exception as e:
-        logger.error(f"❌ خطأ في معالجة الصورة: {e}")
+        logger.error(f"❌ خطأ في استلام الدفعة: {e}")
+        await file_handler.cleanup_temp_files(saved)
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+    
+    logger.info(f"📦 استلام دفعة من {count} صورة")
+    pipeline = BatchPipeline(upscaler, file_handler, task_queue=task_queue)
+    results = pipeline.run(
+        iter_batch_items(images, archives),
+        prompt,
+        output_format=output_format,
+        adapter=adapter,
+        quality_tier=quality_tier
+    )
+    
+    if output == BatchOutput.ARCHIVE:
+        return StreamingResponse(
+            stream_batch_archive(pipeline, results),
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="upscaled.zip"'}
+        )
+    return StreamingResponse(stream_batch_manifest(pipeline, results), media_type="application/x-ndjson")
+
+
+def is_archive_upload(file: UploadFile) -> bool:
+    """هل الملف المرفوع أرشيف zip"""
+    return file.content_type in ARCHIVE_CONTENT_TYPES or (file.filename or "").lower().endswith(".zip")
+
+
+async def iter_batch_items(images: list, archives: List[str]):
+    """عناصر الدفعة: الصور المرفوعة ثم صور الأرشيفات - كل صورة من الأرشيف تُستخرج عند الحاجة إليها فقط"""
+    index = 0
+    try:
+        for name, upload in images:
+            index += 1
+            yield BatchItem(index=index - 1, name=name, upload=upload)
+        
+        for archive_path in archives:
+            async for name, member in file_handler.extract_archive(archive_path):
+                index += 1
+                if isinstance(member, Exception):
+                    yield BatchItem(index=index - 1, name=name, error=f"Extraction failed: {member}")
+                else:
+                    yield BatchItem(index=index - 1, name=name, upload=member)
+    finally:
+        # Archives, and uploaded images never handed to the pipeline (client left early)
+        await file_handler.cleanup_temp_files([upload.path for _, upload in images[index:]] + archives)
+
+
+async def stream_batch_manifest(pipeline: BatchPipeline, results):
+    """سطر JSON لكل صورة بترتيب اكتمالها ثم سطر الملخص"""
+    try:
+        async for item in results:
+            yield json.dumps(item.to_dict(), ensure_ascii=False) + "\n"
+        yield json.dumps({"summary": pipeline.summary}) + "\n"
+    finally:
+        await results.aclose()
+
+
+async def stream_batch_archive(pipeline: BatchPipeline, results):
+    """أرشيف zip يُبث أثناء المعالجة: ملف لكل نتيجة ثم manifest.json"""
+    archive = ZipStream()
+    manifest = []
+    try:
+        async for item in results:
+            entry = item.to_dict()
+            result = item.result
+            if result and result.output_path:
+                stem = os.path.splitext(os.path.basename(item.name))[0]
+                arcname = f"{item.index:04d}_{stem}{os.path.splitext(result.output_path)[1]}"
+                entry["file"] = arcname
+                yield await asyncio.to_thread(archive.add_file, result.output_path, arcname)
+            manifest.append(entry)
+        
+        manifest_json = json.dumps({"items": manifest, "summary": pipeline.summary}, ensure_ascii=False, indent=2)
+        yield archive.add_bytes("manifest.json", manifest_json.encode())
+        yield archive.close()
+    finally:
+        await results.aclose()
+
+
+@app.get("/tasks/{task_id}", response_model=UpscaleResponse)
+async def get_task(task_id: str):
+    """حالة مهمة معالجة"""
+    task = task_queue.get(task_id) if task_queue else None
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return task
+
+
+@app.get("/tasks/{task_id}/events")
+async def task_events(task_id: str, previews: bool = False):
+    """بث تقدم مهمة (Server-Sent Events): الخطوة والوقت المتبقي ومعاينات اختيارية، ثم النتيجة"""
+    if (task_queue.get(task_id) if task_queue else None) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    return StreamingResponse(
+        stream_task_events(task_id, previews),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def stream_task_events(task_id: str, previews: bool):
+    """أحداث التقدم حتى انتهاء المهمة - العميل البطيء يستلم آخر حالة فقط (StreamingResponse يوقف البث عند انقطاعه)"""
+    progress = task_queue.progress(task_id)
+    if progress:
+        async for event, data in progress.events(previews=previews):
+            yield format_sse(event, data)
+    
+    task = task_queue.get(task_id)
+    if task:
+        yield format_sse("done", jsonable_encoder(task))
+
+
+@app.delete("/tasks/{task_id}", response_model=UpscaleResponse, status_code=202)
+async def cancel_task(task_id: str):
+    """إلغاء مهمة - المنتظرة لا تصل إلى GPU والجارية تتوقف عند خطوة الاستدلال التالية"""
+    task = task_queue.cancel(task_id) if task_queue else None
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task.status in (ProcessingStatus.COMPLETED, ProcessingStatus.FAILED):
+        raise HTTPException(status_code=409, detail=f"Task already {task.status.value}")
+    return task
+
+
+@app.get("/tasks")
+async def list_tasks(status: Optional[ProcessingStatus] = None, limit: int = 100):
+    """قائمة مهام المعالجة"""
+    if not task_queue:
+        return {"tasks": [], "queue_size": 0}
+    
+    return {
+        "tasks": task_queue.list(status=status, limit=limit),
+        "queue_size": task_queue.qsize()
+    }
+
+
+@app.api_route("/download/{filename}", methods=["GET", "HEAD"])
+async def download_result(filename: str):
+    """تحميل ملف نتيجة مع دعم ETag والطلبات الشرطية وطلبات النطاق"""
+    resolved = file_handler.resolve_download(filename) if file_handler else None
+    if resolved is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    path, stat_result = resolved
+    accel_prefix = settings.DOWNLOAD_ACCEL_PREFIX
+    return SendfileResponse(
+        path,
+        stat_result,
+        cache_control=f"public, max-age={settings.DOWNLOAD_CACHE_MAX_AGE}, immutable",
+        accel_redirect=f"{accel_prefix.rstrip('/')}/{os.path.basename(path)}" if accel_prefix else None
+    )
+
+
+@app.get("/adapters")
+async def get_adapters():
+    """محولات LoRA المتاحة والمقيمة على كل جهاز"""
+    return {
+        "available": list_adapters(),
+        "swappable": upscaler.swappable if upscaler else False,
+        "devices": [
+            {"device": device["device"], **device["adapters"]}
+            for device in (upscaler.get_device_stats() if upscaler else [])
+        ]
+    }
 
 
 @app.get("/status")
@@ -135,24 +504,53 @@ async def get_status():
             "status": "running",
             "models_loaded": upscaler.is_loaded if upscaler else False,
             "gpu_status": gpu_monitor.get_detailed_status(),
-            "queue_size": 0,  # سيتم تطويره لاحقاً
-            "processed_today": 0  # سيتم تطويره لاحقاً
+            "queue_size": task_queue.qsize() if task_queue else 0,
+            "queue": task_queue.get_stats() if task_queue else None,
+            "result_cache": upscaler.result_cache.get_stats() if upscaler and upscaler.result_cache else None,
+            "devices": upscaler.get_device_stats() if upscaler else [],
+            "models": upscaler.get_model_info() if upscaler else [],
+            "metrics": get_processing_metrics(),
+            "storage": file_handler.get_storage_stats() if file_handler else None,
+            "processed_today": metrics_collector.processed_today.value()
         }
     except Exception as e:
         logger.error(f"Status check failed: {e}")
         return {"status": "error", "message": str(e)}
 
 
+def get_processing_metrics() -> ProcessingMetrics:
+    """مقاييس المعالجة مع المتوسطات المتحركة من جامع القياسات"""
+    stats = upscaler.get_stats() if upscaler else {}
+    averages = gpu_monitor.get_averages() if gpu_monitor else {}
+    
+    return ProcessingMetrics(
+        total_processed=stats.get("total_processed", 0),
+        successful_processed=stats.get("successful_processed", 0),
+        failed_processed=stats.get("failed_processed", 0),
+        average_processing_time=stats.get("average_processing_time", 0.0),
+        gpu_utilization_avg=averages.get("gpu_utilization_avg", 0.0),
+        memory_usage_avg=averages.get("gpu_memory_percent_avg", 0.0),
+        uptime=round((time.time() - metrics_collector.start_time) / 3600, 3)
+    )
+
+
+# Prometheus exposition is served at /metrics/prometheus by setup_monitoring
 @app.get("/metrics")
 async def get_metrics():
     """مقاييس الأداء للمراقبة"""
     try:
+        summary = metrics_collector.get_processing_summary()
         return {
             "gpu_utilization": gpu_monitor.get_gpu_utilization(),
             "memory_usage": gpu_monitor.get_memory_usage(),
             "temperature": gpu_monitor.get_gpu_temperature(),
-            "processing_time_avg": 0,  # سيتم تطويره لاحقاً
-            "success_rate": 100  # سيتم تطويره لاحقاً
+            "processing_time_avg": summary["processing_time"]["mean"],
+            "processing_time_p50": summary["processing_time_recent"]["p50"],
+            "processing_time_p90": summary["processing_time_recent"]["p90"],
+            "processing_time_p99": summary["processing_time_recent"]["p99"],
+            "success_rate": summary["success_rate"],
+            "throughput_per_minute": summary["throughput_per_minute"],
+            "processed_today": summary["processed_today"]
         }
     except Exception as e:
         logger.error(f"Metrics collection failed: {e}")
@@ -0,0 +1,3 @@
+"""
+Benchmarks for GPU Worker Service
+"""
@@ -0,0 +1,45 @@
+"""
+pipeline وهمي بديل لـ Flux - زمن استدلال قابل للضبط دون GPU
+"""
+
+import time
+import importlib
+from typing import Optional
+from PIL import Image
+
+
+class FakeFluxPipeline:
+    """يحاكي FluxPipeline: يحجب خيط الاستدلال للمدة المحددة ثم يعيد الصور"""
+
+    def __init__(self, latency: float = 0.05, scale: int = 1):
+        self.latency = latency
+        self.scale = scale
+        self.calls = 0
+
+    def __call__(self, image=None, **kwargs):
+        self.calls += 1
+        images = image if isinstance(image, list) else [image]
+        time.sleep(self.latency)
+
+        if self.scale != 1:
+            images = [img.resize((img.width * self.scale, img.height * self.scale), Image.Resampling.BICUBIC)
+                      for img in images]
+        else:
+            images = [img.copy() for img in images]
+
+        class Output:
+            pass
+
+        output = Output()
+        output.images = images
+        return output
+
+
+def load_pipeline(spec: Optional[str] = None, latency: float = 0.05):
+    """إنشاء الـ pipeline الوهمي - يمكن استبداله بمسار module:Class"""
+    if not spec:
+        return FakeFluxPipeline(latency=latency)
+
+    module_name, _, class_name = spec.partition(":")
+    pipeline_cls = getattr(importlib.import_module(module_name), class_name)
+    return pipeline_cls(latency=latency)
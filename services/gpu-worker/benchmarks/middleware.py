@@ -0,0 +1,98 @@
+"""
+قياس كلفة middleware المقاييس على endpoint لا يفعل شيئاً
+
+الاستخدام (من مجلد services/gpu-worker):
+    python -m benchmarks.middleware --requests 20000
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+from typing import List, Optional
+from fastapi import FastAPI, Request
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from core.monitoring import MetricsMiddleware, MetricsCollector
+
+
+def build_app(variant: str, collector: MetricsCollector) -> FastAPI:
+    """تطبيق بـ endpoint فارغ مع الـ middleware المطلوب"""
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def noop(item_id: str):
+        return None
+
+    if variant == "asgi":
+        app.add_middleware(MetricsMiddleware, collector=collector)
+    elif variant == "base_http":
+        # الطريقة السابقة: BaseHTTPMiddleware مع تسمية بالمسار الفعلي
+        async def metrics_middleware(request: Request, call_next):
+            start_time = time.perf_counter()
+            response = await call_next(request)
+            collector.record_request(request.method, request.url.path, response.status_code,
+                                     time.perf_counter() - start_time)
+            return response
+
+        app.add_middleware(BaseHTTPMiddleware, dispatch=metrics_middleware)
+    return app
+
+
+async def drive(app: FastAPI, requests: int) -> float:
+    """استدعاء التطبيق مباشرة عبر ASGI دون شبكة - يرجع الميكروثانية لكل طلب"""
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    def scope(index: int) -> dict:
+        path = f"/items/{index}"
+        return {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+            "query_string": b"", "root_path": "", "headers": [(b"host", b"bench")],
+            "client": ("127.0.0.1", 1234), "server": ("bench", 80)
+        }
+
+    # تسخين (بناء الـ middleware stack وأول سلسلة Prometheus)
+    for index in range(200):
+        await app(scope(index), receive, send)
+
+    start = time.perf_counter()
+    for index in range(requests):
+        await app(scope(index), receive, send)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def run(requests: int) -> dict:
+    """قياس الأنواع الثلاثة"""
+    results = {}
+    for variant in ("none", "asgi", "base_http"):
+        app = build_app(variant, MetricsCollector())
+        results[variant] = round(asyncio.run(drive(app, requests)), 2)
+
+    return {
+        "us_per_request": results,
+        "asgi_overhead_us": round(results["asgi"] - results["none"], 2),
+        "base_http_overhead_us": round(results["base_http"] - results["none"], 2)
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """نقطة الدخول"""
+    parser = argparse.ArgumentParser(description="Metrics middleware overhead on a no-op endpoint")
+    parser.add_argument("--requests", type=int, default=20000, help="Requests per variant")
+    args = parser.parse_args(argv)
+
+    report = run(args.requests)
+    for variant, micros in report["us_per_request"].items():
+        print(f"{variant:<10} {micros:>8.2f} µs/request")
+    print(f"⏱️ كلفة ASGI middleware: {report['asgi_overhead_us']:.2f} µs، "
+          f"BaseHTTPMiddleware: {report['base_http_overhead_us']:.2f} µs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
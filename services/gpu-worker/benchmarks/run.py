@@ -0,0 +1,457 @@
+"""
+قياس أداء GPU Worker على CPU - مراحل المعالجة وزمن الطلب الكامل مع مقارنة بخط أساس
+
+الاستخدام (من مجلد services/gpu-worker):
+    python -m benchmarks.run
+    python -m benchmarks.run --concurrency 1,4,8 --requests 32 --latency 0.05
+    python -m benchmarks.run --update-baseline
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime
+from typing import Dict, List, Optional
+import httpx
+import torch
+from PIL import Image
+from starlette.datastructures import Headers, UploadFile
+
+from core.config import settings
+from core.encoding import ImageEncoder, get_preset
+from core.image_context import ImageContext
+from core.task_queue import TaskQueue
+from core.upscaler import FluxUpscaler
+from core.worker_pool import GPUWorkerPool
+from utils.file_handler import FileHandler
+from .fake_pipeline import load_pipeline
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+DEFAULT_OUTPUT = os.path.join(BENCHMARK_DIR, "results", "latest.json")
+
+# المقاييس التي تدخل في المقارنة بخط الأساس
+COMPARED_METRICS = ("p50_ms", "p95_ms", "throughput_rps")
+# خط الأساس لا يُقارن إلا على جهاز بنفس هذه الخصائص
+HOST_KEYS = ("machine", "cpu_model", "cpu_count")
+POLL_INTERVAL = 0.005
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+def cpu_model() -> str:
+    """اسم المعالج - platform.processor() فارغ غالباً على Linux"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or "unknown"
+
+
+def host_info() -> dict:
+    """خصائص الجهاز التي تحدد إن كانت الأزمنة قابلة للمقارنة"""
+    return {
+        "machine": platform.machine(),
+        "cpu_model": cpu_model(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def host_mismatch(current: dict, baseline: dict) -> List[str]:
+    """خصائص الجهاز المختلفة عن جهاز خط الأساس"""
+    current_host = current.get("environment", {})
+    baseline_host = baseline.get("environment", {})
+    return [key for key in HOST_KEYS if current_host.get(key) != baseline_host.get(key)]
+
+
+def summarize(samples: List[float]) -> dict:
+    """ملخص عينات زمنية بالثواني إلى ميلي ثانية"""
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return round(ordered[index] * 1000, 3)
+
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "max_ms": round(ordered[-1] * 1000, 3)
+    }
+
+
+def make_image(size: tuple) -> Image.Image:
+    """صورة بضوضاء عشوائية - ترميزها يكلف مثل صورة حقيقية وليس مثل لون واحد"""
+    return Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+
+
+def png_bytes(image: Image.Image) -> bytes:
+    """ترميز الصورة كـ PNG في الذاكرة"""
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+async def bench_ingest(file_handler: FileHandler, payload: bytes, iterations: int) -> dict:
+    """استلام الرفع: الكتابة على القرص مع حساب البصمة"""
+    samples = []
+    for _ in range(iterations):
+        upload = UploadFile(
+            io.BytesIO(payload),
+            filename="bench.png",
+            headers=Headers({"content-type": "image/png"})
+        )
+        start = time.perf_counter()
+        saved = await file_handler.save_upload(upload)
+        samples.append(time.perf_counter() - start)
+        os.unlink(saved.path)
+
+    return {**summarize(samples), "bytes": len(payload)}
+
+
+def bench_decode(path: str, iterations: int) -> dict:
+    """فك ترميز الصورة مع تصحيح الاتجاه"""
+    samples = []
+    for _ in range(iterations):
+        context = ImageContext(path)
+        start = time.perf_counter()
+        context.decode()
+        samples.append(time.perf_counter() - start)
+        context.release()
+    return summarize(samples)
+
+
+def bench_resize(upscaler: FluxUpscaler, path: str, iterations: int) -> dict:
+    """تصغير صورة أكبر من MAX_IMAGE_SIZE (بعد فك ترميزها)"""
+    samples = []
+    for _ in range(iterations):
+        context = ImageContext(path)
+        context.decode()
+        start = time.perf_counter()
+        upscaler._load_input(context)
+        samples.append(time.perf_counter() - start)
+        context.release()
+    return summarize(samples)
+
+
+def bench_encode(image: Image.Image, presets: List[str], iterations: int) -> Dict[str, dict]:
+    """الترميز في الذاكرة لكل إعداد"""
+    results = {}
+    for name in presets:
+        preset = get_preset(name)
+        samples = []
+        size = 0
+        for _ in range(iterations):
+            buffer = io.BytesIO()
+            start = time.perf_counter()
+            image.save(buffer, preset.format, **preset.params)
+            samples.append(time.perf_counter() - start)
+            size = buffer.tell()
+        results[name] = {**summarize(samples), "bytes": size}
+    return results
+
+
+async def bench_save(encoder: ImageEncoder, image: Image.Image, presets: List[str],
+                     directory: str, iterations: int) -> Dict[str, dict]:
+    """الحفظ عبر ImageEncoder كما في المعالج (ترميز + كتابة خارج حلقة الأحداث)"""
+    results = {}
+    for name in presets:
+        preset = get_preset(name)
+        samples = []
+        for index in range(iterations):
+            path = os.path.join(directory, f"bench_{name}_{index}{preset.extension}")
+            start = time.perf_counter()
+            await encoder.encode(image, path, preset)
+            samples.append(time.perf_counter() - start)
+            os.unlink(path)
+        results[name] = summarize(samples)
+    return results
+
+
+async def bench_e2e(client: httpx.AsyncClient, payload: bytes, concurrency: int, requests: int,
+                    poll_timeout: float = 120.0) -> dict:
+    """زمن الطلب الكامل: POST /upscale ثم متابعة /tasks/{id} حتى انتهاء المهمة أو انقضاء مهلة المتابعة"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+    timeouts = 0
+
+    async def one_request():
+        nonlocal failures, timeouts
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(
+                "/upscale",
+                files={"file": ("bench.png", payload, "image/png")}
+            )
+            if response.status_code != 202:
+                failures += 1
+                return
+
+            task_id = response.json()["task_id"]
+            deadline = time.perf_counter() + poll_timeout
+            while True:
+                status = (await client.get(f"/tasks/{task_id}")).json()["status"]
+                if status in TERMINAL_STATUSES:
+                    break
+                if time.perf_counter() >= deadline:
+                    # مهمة عالقة تُحسب فشلاً بدلاً من تعليق القياس كله
+                    timeouts += 1
+                    failures += 1
+                    return
+                await asyncio.sleep(POLL_INTERVAL)
+
+            if status != "completed":
+                failures += 1
+                return
+            # الأزمنة والإنتاجية للمهام المكتملة فقط
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one_request() for _ in range(requests)])
+    wall = time.perf_counter() - start
+
+    return {
+        # بدون أي مهمة مكتملة لا يوجد زمن يُقاس - المقارنة تتخطى الأزمنة الغائبة وتكشف الإنتاجية الصفرية
+        **(summarize(latencies) if latencies else {"n": 0}),
+        "concurrency": concurrency,
+        "requests": requests,
+        "failures": failures,
+        "timeouts": timeouts,
+        "throughput_rps": round(len(latencies) / wall, 3)
+    }
+
+
+def configure(directory: str, args):
+    """توجيه المجلدات إلى مجلد مؤقت وضبط الإعدادات للقياس"""
+    settings.UPLOAD_DIR = os.path.join(directory, "uploads")
+    settings.RESULT_DIR = os.path.join(directory, "results")
+    settings.TEMP_DIR = os.path.join(directory, "temp")
+    settings.MAX_IMAGE_SIZE = args.max_image_size
+    settings.MAX_FILE_SIZE = max(settings.MAX_FILE_SIZE, 64 * 1024 * 1024)
+
+
+def build_worker(args, encoder: ImageEncoder) -> GPUWorkerPool:
+    """مجمع بنسخة CPU واحدة أو أكثر تعمل بالـ pipeline الوهمي"""
+
+    def factory(device):
+        upscaler = FluxUpscaler(encoder=encoder, device="cpu")
+        upscaler.pipeline = load_pipeline(args.pipeline, latency=args.latency)
+        upscaler.is_loaded = True
+        return upscaler
+
+    return GPUWorkerPool(devices=[f"cpu:{index}" for index in range(args.replicas)], factory=factory)
+
+
+async def run(args) -> dict:
+    """تشغيل كل القياسات"""
+    import app as app_module
+
+    with tempfile.TemporaryDirectory(prefix="gpu-worker-bench-") as directory:
+        configure(directory, args)
+
+        # عمليات الترميز تُنشأ قبل أي خيط استدلال كما في lifespan
+        encoder = ImageEncoder(workers=args.encode_workers)
+        encoder.start()
+        file_handler = FileHandler()
+        pool = build_worker(args, encoder)
+
+        image = make_image((args.image_size, args.image_size))
+        payload = png_bytes(image)
+        input_path = os.path.join(directory, "input.png")
+        with open(input_path, "wb") as f:
+            f.write(payload)
+
+        large_path = os.path.join(directory, "large.png")
+        make_image((args.max_image_size * 3 // 2, args.max_image_size)).save(large_path, "PNG", compress_level=1)
+
+        presets = [preset.strip() for preset in args.presets.split(",") if preset.strip()]
+        iterations = args.iterations
+        resize_upscaler = pool.replicas[0].upscaler
+        resize_upscaler.processing_config = {**resize_upscaler.processing_config, "enable_tiling": False}
+
+        # الحالة العامة للتطبيق تُستعاد بعد القياس
+        original = {name: getattr(app_module, name) for name in ("upscaler", "file_handler", "encoder", "task_queue")}
+
+        try:
+            stages = {
+                "ingest": await bench_ingest(file_handler, payload, iterations),
+                "decode": bench_decode(input_path, iterations),
+                "resize": bench_resize(resize_upscaler, large_path, max(1, iterations // 4)),
+                "encode": bench_encode(image, presets, iterations),
+                "save": await bench_save(encoder, image, presets, directory, iterations)
+            }
+
+            task_queue = TaskQueue(pool, file_handler)
+            app_module.upscaler = pool
+            app_module.file_handler = file_handler
+            app_module.encoder = encoder
+            app_module.task_queue = task_queue
+            task_queue.start()
+
+            e2e = {}
+            transport = httpx.ASGITransport(app=app_module.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for concurrency in args.concurrency:
+                    e2e[f"c{concurrency}"] = await bench_e2e(
+                        client, payload, concurrency, args.requests, poll_timeout=args.poll_timeout
+                    )
+
+            await task_queue.stop()
+        finally:
+            for name, value in original.items():
+                setattr(app_module, name, value)
+            await pool.cleanup()
+            encoder.shutdown()
+
+    return {
+        "created_at": datetime.now().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            **host_info()
+        },
+        "config": {
+            "latency": args.latency,
+            "replicas": args.replicas,
+            "image_size": args.image_size,
+            "max_image_size": args.max_image_size,
+            "requests": args.requests,
+            "iterations": iterations,
+            "encode_workers": args.encode_workers,
+            "presets": presets
+        },
+        "stages": stages,
+        "e2e": e2e
+    }
+
+
+def flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    """تسطيح النتائج إلى مفاتيح مثل stages.decode.p50_ms"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        elif key in COMPARED_METRICS and isinstance(value, (int, float)):
+            flat[path] = value
+    return flat
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[dict]:
+    """مقارنة النتائج بخط الأساس - الأزمنة الأعلى أو الإنتاجية الأقل من الحد تعتبر تراجعاً"""
+    current_flat = flatten({"stages": current.get("stages", {}), "e2e": current.get("e2e", {})})
+    baseline_flat = flatten({"stages": baseline.get("stages", {}), "e2e": baseline.get("e2e", {})})
+
+    report = []
+    for metric, expected in sorted(baseline_flat.items()):
+        if metric not in current_flat or not expected:
+            continue
+
+        actual = current_flat[metric]
+        change = (actual - expected) / expected
+        higher_is_better = metric.endswith("throughput_rps")
+        regression = change < -tolerance if higher_is_better else change > tolerance
+
+        report.append({
+            "metric": metric,
+            "baseline": expected,
+            "current": actual,
+            "change_pct": round(change * 100, 1),
+            "regression": regression
+        })
+    return report
+
+
+def print_report(report: List[dict]):
+    """طباعة جدول المقارنة"""
+    width = max((len(row["metric"]) for row in report), default=10)
+    for row in report:
+        marker = "❌" if row["regression"] else "✅"
+        print(f"{marker} {row['metric']:<{width}}  {row['baseline']:>10.3f} → {row['current']:>10.3f}  ({row['change_pct']:+.1f}%)")
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    """معاملات سطر الأوامر"""
+    parser = argparse.ArgumentParser(description="GPU worker CPU benchmarks")
+    parser.add_argument("--concurrency", default="1,4,8",
+                        type=lambda value: [int(item) for item in value.split(",")],
+                        help="Comma-separated concurrency levels for end-to-end requests")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level")
+    parser.add_argument("--iterations", type=int, default=20, help="Iterations per stage benchmark")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake pipeline latency in seconds")
+    parser.add_argument("--pipeline", default=None, help="Alternative fake pipeline as module:Class")
+    parser.add_argument("--poll-timeout", type=float, default=120.0,
+                        help="Seconds to poll one end-to-end task before counting it as failed")
+    parser.add_argument("--replicas", type=int, default=1, help="Fake devices in the worker pool")
+    parser.add_argument("--image-size", type=int, default=512, help="Input image edge in pixels")
+    parser.add_argument("--max-image-size", type=int, default=1024, help="MAX_IMAGE_SIZE for the resize stage")
+    parser.add_argument("--presets", default="png_fast,png,webp,jpeg", help="Encoding presets to measure")
+    parser.add_argument("--encode-workers", type=int, default=0, help="Encoder processes (0 encodes on a thread)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to write the JSON results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Allowed relative slowdown before flagging")
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--force-compare", action="store_true",
+                        help="Compare even when the baseline was recorded on a different host")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """نقطة الدخول - يرجع 1 عند وجود تراجع في الأداء"""
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📊 النتائج: {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"📌 تم تحديث خط الأساس: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("⚠️ لا يوجد خط أساس للمقارنة - استخدم --update-baseline لحفظ هذه النتائج")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    mismatch = host_mismatch(results, baseline)
+    if mismatch and not args.force_compare:
+        print(f"⚠️ خط الأساس مسجل على جهاز مختلف ({', '.join(mismatch)}) - تم تخطي المقارنة، "
+              f"أعد توليده على هذا الجهاز بـ --update-baseline")
+        return 0
+
+    report = compare(results, baseline, args.tolerance)
+    results["comparison"] = report
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print_report(report)
+    regressions = [row for row in report if row["regression"]]
+    if regressions:
+        print(f"❌ {len(regressions)} تراجع في الأداء (الحد المسموح {args.tolerance:.0%})")
+        return 1
+
+    print("✅ لا يوجد تراجع في الأداء")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,7 +2,7 @@
 Core module for GPU Worker Service
 """
 
-from .config import settings, get_model_config, get_processing_config, get_file_config
+from .config import settings, get_model_config, get_processing_config, get_file_config, get_queue_config, get_encoding_config, get_memory_config, get_telemetry_config, get_storage_config, get_batch_config, get_tier_config
 from .models import (
     UpscaleRequest,
     UpscaleResponse,
@@ -12,7 +12,10 @@ from .models import (
     ModelInfo,
     ServiceStatus,
     ProcessingStatus,
-    ImageFormat
+    ImageFormat,
+    OutputPreset,
+    QualityTier,
+    BatchOutput
 )
 
 __all__ = [
@@ -20,6 +23,13 @@ __all__ = [
     "get_model_config",
     "get_processing_config", 
     "get_file_config",
+    "get_queue_config",
+    "get_encoding_config",
+    "get_memory_config",
+    "get_telemetry_config",
+    "get_storage_config",
+    "get_batch_config",
+    "get_tier_config",
     "UpscaleRequest",
     "UpscaleResponse",
     "HealthResponse",
@@ -28,5 +38,8 @@ __all__ = [
     "ModelInfo",
     "ServiceStatus",
     "ProcessingStatus",
-    "ImageFormat"
+    "ImageFormat",
+    "OutputPreset",
+    "QualityTier",
+    "BatchOutput"
 ]
@@ -0,0 +1,182 @@
+"""
+إدارة محولات LoRA - المحول الافتراضي مدمج في الأوزان، والبقية في ذاكرة LRU محدودة
+"""
+
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional
+from loguru import logger
+
+from .config import get_model_config
+from .monitoring import record_adapter_swap
+
+
+DEFAULT_ADAPTER = "default"
+ADAPTER_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+
+class AdapterError(ValueError):
+    """محول غير موجود أو غير قابل للتفعيل"""
+
+
+def adapter_path(name: str, config: Optional[dict] = None) -> str:
+    """مسار ملف المحول - الأسماء مقيدة حتى لا تخرج عن مجلد المحولات"""
+    config = config or get_model_config()
+    if name == DEFAULT_ADAPTER:
+        return config["lora_path"]
+
+    if not ADAPTER_NAME_PATTERN.match(name) or ".." in name:
+        raise AdapterError(f"اسم محول غير صالح: {name}")
+
+    path = os.path.join(config["adapters_dir"], f"{name}.safetensors")
+    if not os.path.isfile(path):
+        raise AdapterError(f"المحول غير موجود: {name}")
+    return path
+
+
+def list_adapters(config: Optional[dict] = None) -> List[str]:
+    """أسماء المحولات المتاحة على القرص"""
+    config = config or get_model_config()
+    names = [DEFAULT_ADAPTER] if os.path.exists(config["lora_path"]) else []
+
+    adapters_dir = config["adapters_dir"]
+    if os.path.isdir(adapters_dir):
+        names.extend(sorted(
+            filename[:-len(".safetensors")]
+            for filename in os.listdir(adapters_dir)
+            if filename.endswith(".safetensors")
+        ))
+    return names
+
+
+class AdapterManager:
+    """تبديل محولات LoRA على pipeline واحد دون إعادة تحميل الموديل الأساسي
+
+    يُستدعى activate من خيط الاستدلال فقط، قبل تشغيل الـ pipeline مباشرة.
+    """
+
+    def __init__(self, max_loaded: Optional[int] = None, config: Optional[dict] = None):
+        self.config = config or get_model_config()
+        self.max_loaded = self.config["max_loaded_adapters"] if max_loaded is None else max_loaded
+
+        self.pipeline = None
+        self.has_default = False
+        self.baked = False
+        self.active = DEFAULT_ADAPTER
+        self.fused = False
+
+        # المحولات الإضافية المحملة بترتيب آخر استخدام (الافتراضي مثبت خارجها)
+        self._resident: "OrderedDict[str, str]" = OrderedDict()
+        self.swaps = 0
+        self.total_swap_time = 0.0
+        self.last_swap_time: Optional[float] = None
+
+    def attach(self, pipeline, baked: bool = False):
+        """ربط الـ pipeline وتحميل المحول الافتراضي ودمجه في الأوزان"""
+        self.pipeline = pipeline
+        self.baked = baked
+        self._resident.clear()
+        self.active = DEFAULT_ADAPTER
+        self.fused = False
+        self.has_default = False
+
+        if baked:
+            # اللقطة المدمجة تحتوي المحول الافتراضي داخل الأوزان مسبقاً
+            logger.info("🔗 المحول الافتراضي مدمج في اللقطة - تبديل المحولات غير متاح")
+            return
+
+        lora_path = self.config["lora_path"]
+        if not os.path.exists(lora_path):
+            logger.warning(f"LoRA غير موجود في: {lora_path}")
+            return
+
+        logger.info(f"تحميل LoRA من: {lora_path}")
+        pipeline.load_lora_weights(lora_path, adapter_name=DEFAULT_ADAPTER)
+        pipeline.fuse_lora(adapter_names=[DEFAULT_ADAPTER])
+        self.has_default = True
+        self.fused = True
+        logger.info("🔗 تم دمج المحول الافتراضي في أوزان الموديل")
+
+    @property
+    def swappable(self) -> bool:
+        """هل يمكن تفعيل محول غير الافتراضي - اللقطة المدمجة لا تسمح بذلك"""
+        return not self.baked
+
+    def resolve(self, name: Optional[str]) -> str:
+        """التحقق من اسم المحول المطلوب وإرجاع الاسم النهائي"""
+        name = name or DEFAULT_ADAPTER
+        if name == DEFAULT_ADAPTER:
+            return name
+
+        if not self.swappable:
+            raise AdapterError("تبديل المحولات غير متاح عند التشغيل من لقطة مدمجة")
+        adapter_path(name, self.config)
+        return name
+
+    def activate(self, name: Optional[str]):
+        """تفعيل محول قبل الاستدلال - يحمّله عند الحاجة ويطرد الأقدم استخداماً"""
+        name = self.resolve(name)
+        if self.pipeline is None or name == self.active:
+            if name in self._resident:
+                self._resident.move_to_end(name)
+            return
+
+        start_time = time.perf_counter()
+        pipeline = self.pipeline
+
+        if self.fused:
+            pipeline.unfuse_lora()
+            self.fused = False
+
+        if name == DEFAULT_ADAPTER and not self.has_default:
+            # الموديل الأساسي بدون أي محول
+            pipeline.disable_lora()
+        else:
+            if name != DEFAULT_ADAPTER:
+                self._ensure_loaded(name)
+            pipeline.enable_lora()
+            pipeline.set_adapters([name])
+            if name == DEFAULT_ADAPTER:
+                pipeline.fuse_lora(adapter_names=[DEFAULT_ADAPTER])
+                self.fused = True
+
+        self.active = name
+        duration = time.perf_counter() - start_time
+        self.swaps += 1
+        self.total_swap_time += duration
+        self.last_swap_time = duration
+        record_adapter_swap(duration)
+
+        logger.info(f"🔀 تم التبديل إلى المحول {name} خلال {duration * 1000:.0f}ms")
+
+    def _ensure_loaded(self, name: str):
+        """تحميل محول إضافي إلى الذاكرة مع احترام حد LRU"""
+        if name in self._resident:
+            self._resident.move_to_end(name)
+            return
+
+        while self._resident and len(self._resident) >= max(1, self.max_loaded):
+            evicted, _ = self._resident.popitem(last=False)
+            self.pipeline.delete_adapters([evicted])
+            logger.info(f"🗑️ تم إخراج المحول {evicted} من الذاكرة")
+
+        path = adapter_path(name, self.config)
+        self.pipeline.load_lora_weights(path, adapter_name=name)
+        self._resident[name] = path
+
+    def get_stats(self) -> dict:
+        """المحول النشط والمحولات المقيمة وزمن التبديل"""
+        resident = ([DEFAULT_ADAPTER] if self.has_default else []) + list(self._resident)
+        return {
+            "active": self.active,
+            "fused": self.fused,
+            "baked": self.baked,
+            "swappable": self.swappable,
+            "resident": resident,
+            "max_loaded": self.max_loaded,
+            "swaps": self.swaps,
+            "last_swap_ms": round(self.last_swap_time * 1000, 1) if self.last_swap_time is not None else None,
+            "average_swap_ms": round(self.total_swap_time / self.swaps * 1000, 1) if self.swaps else None
+        }
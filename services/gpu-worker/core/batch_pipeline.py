@@ -0,0 +1,224 @@
+"""
+خط المعالجة الدفعية - تحضير الصور ومعالجتها وإنهاؤها بمراحل متداخلة تصل بينها طوابير محدودة
+"""
+
+import time
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from PIL import Image
+from loguru import logger
+
+from .config import get_batch_config
+from .models import UpscaleResponse, ProcessingStatus
+from .image_context import ImageContext
+from .cancellation import CancellationToken
+from .monitoring import StageTimer
+
+
+# حقول النتيجة التي تظهر في بيان الدفعة
+MANIFEST_FIELDS = {
+    "task_id", "status", "download_url", "processing_time", "original_size",
+    "output_size", "file_size", "error_message", "metadata"
+}
+
+
+@dataclass
+class BatchItem:
+    """صورة واحدة في طلب دفعي"""
+    index: int
+    name: str
+    # SavedUpload: المسار والبصمة والحجم
+    upload: Optional[Any] = None
+    error: Optional[str] = None
+    context: Optional[ImageContext] = None
+    prepared: Optional[Tuple[Image.Image, Tuple[int, int]]] = None
+    timer: StageTimer = field(default_factory=StageTimer)
+    result: Optional[UpscaleResponse] = None
+    # مهلة العنصر تبدأ عند دخوله الخط
+    token: Optional[CancellationToken] = None
+    # يشغل مكاناً في طابور المهام حتى ينتهي
+    admitted: bool = False
+
+    @property
+    def status(self) -> ProcessingStatus:
+        """حالة العنصر"""
+        return self.result.status if self.result else ProcessingStatus.FAILED
+
+    def to_dict(self) -> dict:
+        """إدخال العنصر في بيان الدفعة"""
+        entry = {"index": self.index, "name": self.name}
+        if self.result is None:
+            entry.update(status=ProcessingStatus.FAILED.value, error_message=self.error)
+        else:
+            entry.update(self.result.model_dump(mode="json", include=MANIFEST_FIELDS))
+        return entry
+
+
+class BatchPipeline:
+    """ثلاث مراحل: تحضير على CPU ثم استدلال على GPU ثم إنهاء - تعمل معاً على صور مختلفة"""
+
+    def __init__(self, upscaler, file_handler=None, config: Optional[dict] = None, task_queue=None):
+        self.upscaler = upscaler
+        self.file_handler = file_handler
+        self.config = config or get_batch_config()
+        # كل عنصر في الخط يُحسب ضمن سعة الطابور حتى لا تزاحم الدفعة الطلبات الأخرى بلا حد
+        self.task_queue = task_queue
+        self.summary: Dict[str, Any] = {status.value: 0 for status in ProcessingStatus}
+        self.summary.update(total=0, duration=0.0)
+
+    async def run(
+        self,
+        items: AsyncIterator[BatchItem],
+        prompt: str,
+        **params
+    ) -> AsyncIterator[BatchItem]:
+        """معالجة العناصر وإرجاعها بترتيب اكتمالها - إغلاق المولد يلغي ما تبقى"""
+        depth = max(1, self.config["depth"])
+        # الطابوران المحدودان يحدان عدد الصور المفكوكة في الذاكرة ويوقفان التحضير إذا تأخر المستهلك
+        prepared: asyncio.Queue = asyncio.Queue(maxsize=depth)
+        finished: asyncio.Queue = asyncio.Queue(maxsize=depth)
+        # عاملان لكل نسخة GPU: ترميز صورة وحفظها يتداخل مع استدلال التالية
+        workers = 2 * max(1, getattr(self.upscaler, "replica_count", 1))
+        pending: Dict[int, BatchItem] = {}
+        start_time = time.perf_counter()
+        completed = False
+
+        tasks = [asyncio.create_task(
+            self._prepare(items, prepared, workers, pending, params.get("quality_tier"))
+        )]
+        tasks += [
+            asyncio.create_task(self._infer(prepared, finished, prompt, params))
+            for _ in range(workers)
+        ]
+
+        try:
+            remaining = workers
+            while remaining:
+                item = await finished.get()
+                if item is None:
+                    remaining -= 1
+                    continue
+                yield await self._finalize(item, pending)
+
+            await asyncio.gather(*tasks)
+            completed = True
+        finally:
+            if not completed:
+                for item in pending.values():
+                    if item.token:
+                        item.token.cancel("disconnected")
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+            # العناصر التي لم تكتمل (انقطاع العميل أو خطأ في المصدر): أماكنها في الطابور وملفاتها
+            for item in pending.values():
+                await self._release(item)
+            if self.file_handler and pending:
+                await self.file_handler.cleanup_temp_files(
+                    [item.upload.path for item in pending.values() if item.upload]
+                )
+            self.summary["duration"] = round(time.perf_counter() - start_time, 3)
+            logger.info(f"📦 انتهت الدفعة: {self.summary}")
+
+    async def _prepare(
+        self,
+        items: AsyncIterator[BatchItem],
+        prepared: asyncio.Queue,
+        workers: int,
+        pending: dict,
+        quality_tier: Optional[str] = None
+    ):
+        """المرحلة الأولى: التحقق من الصورة وفك ترميزها وتصغيرها بينما تُعالج السابقة"""
+        error = None
+        try:
+            async for item in items:
+                pending[item.index] = item
+                if self.task_queue:
+                    await self.task_queue.reserve()
+                    item.admitted = True
+                item.token = CancellationToken(timeout=self.config.get("processing_timeout"))
+                if item.error is None:
+                    await self._prepare_item(item, quality_tier)
+                await prepared.put(item)
+        except Exception as e:
+            logger.error(f"❌ خطأ في قراءة عناصر الدفعة: {e}")
+            error = e
+        finally:
+            # إغلاق المصدر (مثل الأرشيف) حتى عند الإلغاء
+            aclose = getattr(items, "aclose", None)
+            if aclose:
+                await aclose()
+
+        # إشارة الانتهاء لكل عامل استدلال
+        for _ in range(workers):
+            await prepared.put(None)
+        if error:
+            raise error
+
+    async def _prepare_item(self, item: BatchItem, quality_tier: Optional[str] = None):
+        """تحضير عنصر واحد - الأخطاء تُسجل في العنصر ولا توقف الدفعة"""
+        upload = item.upload
+        item.context = ImageContext(upload.path, content_hash=upload.content_hash, file_size=upload.size)
+
+        if self.file_handler and not await self.file_handler.validate_image(item.context):
+            item.error = "Invalid image file"
+            return
+
+        try:
+            # التصغير إلى حد دقة مستوى الجودة نفسه الذي يستخدمه الاستدلال
+            item.prepared = await self.upscaler.prepare_input(item.context, item.timer, quality_tier)
+        except Exception as e:
+            item.error = f"Invalid image file: {e}"
+
+    async def _infer(
+        self,
+        prepared: asyncio.Queue,
+        finished: asyncio.Queue,
+        prompt: str,
+        params: dict
+    ):
+        """المرحلة الثانية: الاستدلال - الصورة التالية جاهزة دائماً في الطابور"""
+        while (item := await prepared.get()) is not None:
+            if item.error is None:
+                try:
+                    item.result = await self.upscaler.upscale_image(
+                        item.context,
+                        prompt,
+                        stage_timer=item.timer,
+                        cancel_token=item.token,
+                        prepared=item.prepared,
+                        **params
+                    )
+                except Exception as e:
+                    item.error = str(e)
+                finally:
+                    item.prepared = None
+            await finished.put(item)
+
+        await finished.put(None)
+
+    async def _finalize(self, item: BatchItem, pending: dict) -> BatchItem:
+        """المرحلة الثالثة: تسجيل النتيجة ورابطها وحذف ملف الإدخال"""
+        result = item.result
+        if self.file_handler:
+            if result and result.output_path:
+                self.file_handler.track_file(result.output_path, result.file_size)
+                item.result = result.model_copy(update={
+                    "download_url": await self.file_handler.create_download_url(result.output_path)
+                })
+            if item.upload:
+                await self.file_handler.cleanup_temp_files([item.upload.path])
+
+        pending.pop(item.index, None)
+        await self._release(item)
+        self.summary["total"] += 1
+        self.summary[item.status.value] += 1
+        return item
+
+    async def _release(self, item: BatchItem):
+        """تحرير مكان العنصر في طابور المهام"""
+        if item.admitted:
+            item.admitted = False
+            await self.task_queue.release()
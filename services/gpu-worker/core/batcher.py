@@ -0,0 +1,95 @@
+"""
+مُجمِّع الدفعات - دمج الطلبات المتوافقة في استدعاء pipeline واحد
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+from loguru import logger
+
+from .monitoring import record_batch_size
+
+
+@dataclass
+class _PendingRequest:
+    """طلب ينتظر دفعته"""
+    params: dict
+    future: asyncio.Future
+
+
+class MicroBatcher:
+    """يجمع الطلبات ذات المفتاح نفسه لمدة نافذة قصيرة ثم يشغلها كدفعة واحدة"""
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[dict]], Awaitable[List[Any]]],
+        max_batch_size: int = 1,
+        window_ms: float = 10.0
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = max(0.0, window_ms) / 1000
+
+        self._pending: Dict[Hashable, List[_PendingRequest]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._running: set = set()
+
+    @property
+    def enabled(self) -> bool:
+        """هل التجميع مفعل"""
+        return self.max_batch_size > 1
+
+    async def submit(self, key: Hashable, params: dict) -> Any:
+        """إضافة طلب وانتظار نتيجته الخاصة من الدفعة"""
+        if not self.enabled:
+            record_batch_size(1)
+            return (await self.run_batch([params]))[0]
+
+        loop = asyncio.get_running_loop()
+        request = _PendingRequest(params=params, future=loop.create_future())
+
+        group = self._pending.setdefault(key, [])
+        group.append(request)
+
+        if len(group) >= self.max_batch_size:
+            self._flush(key)
+        elif len(group) == 1:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+
+        return await request.future
+
+    def pending_count(self) -> int:
+        """عدد الطلبات التي تنتظر دفعتها"""
+        return sum(len(group) for group in self._pending.values())
+
+    def _flush(self, key: Hashable):
+        """إرسال الدفعة الحالية للمفتاح"""
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+
+        group = self._pending.pop(key, None)
+        if not group:
+            return
+
+        task = asyncio.create_task(self._run(group))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, group: List[_PendingRequest]):
+        """تشغيل دفعة وتوزيع النتائج على أصحابها"""
+        record_batch_size(len(group))
+        if len(group) > 1:
+            logger.info(f"📦 تشغيل دفعة من {len(group)} طلب")
+
+        try:
+            results = await self.run_batch([request.params for request in group])
+        except Exception as e:
+            for request in group:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        for request, result in zip(group, results):
+            if not request.future.done():
+                request.future.set_result(result)
@@ -0,0 +1,91 @@
+"""
+إلغاء المهام - مهلة لكل مهمة وإيقاف الاستدلال بين الخطوات عند انتهائها أو إلغائها
+"""
+
+import time
+import threading
+from typing import Callable, List, Optional
+
+
+# أسباب الإيقاف: تسميات مقياس المهام الملغاة ورسائل الخطأ
+CANCEL_REASONS = {
+    "deadline": "تجاوزت المهمة المهلة المحددة (PROCESSING_TIMEOUT)",
+    "cancelled": "تم إلغاء المهمة",
+    "disconnected": "انقطع اتصال العميل"
+}
+
+
+class JobCancelled(Exception):
+    """أوقفت المهمة قبل اكتمالها"""
+
+    def __init__(self, reason: str = "cancelled", saved_seconds: float = 0.0):
+        super().__init__(CANCEL_REASONS.get(reason, reason))
+        self.reason = reason
+        self.saved_seconds = saved_seconds
+
+
+class CancellationToken:
+    """حالة إلغاء مهمة واحدة - تُقرأ من خيط الاستدلال وتُكتب من حلقة الأحداث"""
+
+    def __init__(self, timeout: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self.deadline = clock() + timeout if timeout else None
+        self._reason: Optional[str] = None
+        self._event = threading.Event()
+
+    def start(self, timeout: Optional[float] = None):
+        """بدء المهلة من الآن - عند سحب المهمة من الطابور لا عند قبولها"""
+        self.deadline = self._clock() + timeout if timeout else None
+
+    def cancel(self, reason: str = "cancelled"):
+        """طلب إيقاف المهمة - أول سبب هو المعتمد"""
+        if not self._event.is_set():
+            self._reason = reason
+            self._event.set()
+
+    @property
+    def reason(self) -> Optional[str]:
+        """سبب الإيقاف، أو None إذا كانت المهمة ما زالت مطلوبة"""
+        if not self._event.is_set() and self.deadline is not None and self._clock() >= self.deadline:
+            self.cancel("deadline")
+        return self._reason
+
+    @property
+    def cancelled(self) -> bool:
+        """هل يجب إيقاف المهمة"""
+        return self.reason is not None
+
+    def remaining(self) -> Optional[float]:
+        """الثواني المتبقية حتى المهلة"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - self._clock())
+
+    def check(self):
+        """رفع JobCancelled إذا انتهت المهلة أو أُلغيت المهمة"""
+        reason = self.reason
+        if reason is not None:
+            raise JobCancelled(reason)
+
+
+class StepGuard:
+    """callback_on_step_end للـ pipeline: يوقف الاستدلال بين الخطوات عندما تُلغى كل مهام الاستدعاء"""
+
+    def __init__(self, tokens: List[CancellationToken], total_steps: int, clock: Callable[[], float] = time.perf_counter):
+        self.tokens = tokens
+        self.total_steps = total_steps
+        self._clock = clock
+        self.started = clock()
+        self.steps_done = 0
+
+    def __call__(self, pipeline, step: int, timestep, callback_kwargs: dict) -> dict:
+        self.steps_done = step + 1
+
+        # في الدفعة يستمر الاستدعاء ما دامت مهمة واحدة مطلوبة
+        reasons = [token.reason for token in self.tokens]
+        if all(reasons):
+            total = getattr(pipeline, "num_timesteps", None) or self.total_steps
+            per_step = (self._clock() - self.started) / self.steps_done
+            raise JobCancelled(reasons[0], saved_seconds=per_step * max(0, total - self.steps_done))
+
+        return callback_kwargs
@@ -20,29 +20,85 @@ class Settings(BaseSettings):
     MODEL_PATH: str = Field(default="/app/models", description="Path to models directory")
     FLUX_MODEL_NAME: str = Field(default="black-forest-labs/FLUX.1-dev", description="Flux model name")
     LORA_MODEL_PATH: str = Field(default="/app/models/lora_upscaler.safetensors", description="LoRA model path")
+    LORA_ADAPTERS_DIR: str = Field(default="/app/models/adapters", description="Extra LoRA adapters selectable per request (<name>.safetensors)")
+    MAX_LOADED_ADAPTERS: int = Field(default=4, description="Extra adapters kept resident per pipeline (LRU)")
+    MODEL_SNAPSHOT_PATH: str = Field(default="/app/models/snapshot", description="Pre-fused snapshot written by `python -m core.snapshot bake` (used when present)")
+    MODEL_DTYPE: str = Field(default="bfloat16", description="Torch dtype for model weights")
     
     # Processing settings
     MAX_IMAGE_SIZE: int = Field(default=2048, description="Maximum image dimension")
     MAX_FILE_SIZE: int = Field(default=10 * 1024 * 1024, description="Maximum file size in bytes (10MB)")
+    UPLOAD_CHUNK_SIZE: int = Field(default=1024 * 1024, description="Chunk size for streaming uploads to disk (1MB)")
+    MAX_ARCHIVE_SIZE: int = Field(default=1024 * 1024 * 1024, description="Maximum zip archive size for batch uploads in bytes (1GB)")
     SUPPORTED_FORMATS: list = Field(default=["JPEG", "PNG", "WEBP"], description="Supported image formats")
+    ENABLE_TILING: bool = Field(default=True, description="Process images larger than MAX_IMAGE_SIZE in tiles instead of downscaling")
+    TILE_SIZE: int = Field(default=1024, description="Tile edge length in pixels")
+    TILE_OVERLAP: int = Field(default=128, description="Overlap between neighbouring tiles in pixels")
+    TILE_BATCH_SIZE: int = Field(default=1, description="Number of tiles per pipeline call")
+    PROGRESS_PREVIEW_INTERVAL: int = Field(default=5, description="Decode a low-resolution latent preview every N steps for clients streaming progress with previews (0 disables)")
     
     # GPU settings
     CUDA_DEVICE: str = Field(default="0", description="CUDA device ID")
+    GPU_DEVICES: str = Field(default="", description="Comma-separated CUDA device IDs for the worker pool (empty uses every visible GPU)")
     MAX_BATCH_SIZE: int = Field(default=1, description="Maximum batch size")
-    ENABLE_MEMORY_EFFICIENT: bool = Field(default=True, description="Enable memory efficient attention")
+    BATCH_WINDOW_MS: float = Field(default=10.0, description="How long to wait for compatible requests before running a batch (ms)")
+    RESOLUTION_BUCKET: int = Field(default=64, description="Image dimensions are rounded to this multiple when batching")
+    ENABLE_MEMORY_EFFICIENT: bool = Field(default=True, description="Let the memory planner offload when the model does not fit (False keeps it fully resident)")
+    MEMORY_STRATEGY: str = Field(default="auto", description="auto, resident, model_offload or sequential_offload")
+    MEMORY_HEADROOM_GB: float = Field(default=1.5, description="VRAM kept free for the CUDA context and fragmentation")
+    ACTIVATION_GB_PER_MEGAPIXEL: float = Field(default=3.0, description="Initial estimate of working memory per output megapixel (refined from measured peaks)")
+    VAE_TILING_MEGAPIXELS: float = Field(default=2.0, description="Decode outputs larger than this in VAE tiles")
+    MEMORY_PROMOTE_AFTER_JOBS: int = Field(default=20, description="Consecutive jobs below the memory limit required before moving back up after an OOM or near-limit step-down")
+    MAX_INFLIGHT_JOBS: int = Field(default=1, description="Maximum jobs submitted to the inference executor at once")
     
     # File paths
     UPLOAD_DIR: str = Field(default="/app/data/uploads", description="Upload directory")
     RESULT_DIR: str = Field(default="/app/data/results", description="Results directory")
     TEMP_DIR: str = Field(default="/app/data/temp", description="Temporary directory")
     
+    # Result cache
+    ENABLE_RESULT_CACHE: bool = Field(default=True, description="Reuse results for identical input and parameters")
+    RESULT_CACHE_DIR: str = Field(default="/app/data/cache", description="Result cache directory")
+    RESULT_CACHE_MAX_BYTES: int = Field(default=5 * 1024 ** 3, description="Result cache disk budget in bytes (5GB)")
+    
+    # Downloads
+    DOWNLOAD_CACHE_MAX_AGE: int = Field(default=86400, description="Cache-Control max-age for downloaded results in seconds")
+    DOWNLOAD_ACCEL_PREFIX: str = Field(default="", description="Internal location for X-Accel-Redirect when behind nginx (empty serves directly)")
+    
     # Processing timeouts
-    PROCESSING_TIMEOUT: int = Field(default=300, description="Processing timeout in seconds")
+    PROCESSING_TIMEOUT: int = Field(default=300, description="Deadline for a job from the moment a worker takes it to its result, in seconds (0 disables)")
     CLEANUP_INTERVAL: int = Field(default=3600, description="Cleanup interval in seconds")
     
+    # Storage janitor (0 disables the limit)
+    UPLOAD_MAX_AGE_HOURS: float = Field(default=24, description="Delete orphaned uploads older than this")
+    RESULT_MAX_AGE_HOURS: float = Field(default=72, description="Delete results older than this")
+    TEMP_MAX_AGE_HOURS: float = Field(default=24, description="Delete temporary files older than this")
+    UPLOAD_DIR_MAX_BYTES: int = Field(default=10 * 1024 ** 3, description="Upload directory disk budget in bytes (10GB)")
+    RESULT_DIR_MAX_BYTES: int = Field(default=50 * 1024 ** 3, description="Result directory disk budget in bytes (50GB)")
+    TEMP_DIR_MAX_BYTES: int = Field(default=5 * 1024 ** 3, description="Temporary directory disk budget in bytes (5GB)")
+    STORAGE_RECONCILE_INTERVAL: int = Field(default=6 * 3600, description="Seconds between checks of the storage index against disk")
+    
+    # Output encoding
+    OUTPUT_PRESET: str = Field(default="png", description="Default output encoding preset")
+    PNG_COMPRESS_LEVEL: int = Field(default=3, description="zlib level for the png preset (0-9)")
+    WEBP_QUALITY: int = Field(default=90, description="Quality for the lossy webp preset")
+    JPEG_QUALITY: int = Field(default=92, description="Quality for the jpeg preset")
+    ENCODE_WORKERS: int = Field(default=2, description="Encoder processes (0 encodes on a thread instead)")
+    
+    # Task queue
+    MAX_QUEUE_SIZE: int = Field(default=100, description="Maximum number of pending tasks")
+    QUEUE_WORKERS: int = Field(default=2, description="Number of queue worker loops (2 lets encoding overlap the next GPU job)")
+    TASK_HISTORY_SIZE: int = Field(default=1000, description="Number of finished tasks kept for status queries")
+    
+    # Batch uploads
+    MAX_BATCH_FILES: int = Field(default=500, description="Maximum images per /upscale/batch request (files plus archive members)")
+    BATCH_PIPELINE_DEPTH: int = Field(default=4, description="Decoded images buffered ahead of inference, and results buffered for the response, in a batch")
+    
     # Monitoring
     ENABLE_METRICS: bool = Field(default=True, description="Enable metrics collection")
     METRICS_PORT: int = Field(default=8001, description="Metrics port")
+    TELEMETRY_INTERVAL: float = Field(default=5.0, description="Seconds between background GPU/system telemetry samples")
+    TELEMETRY_HISTORY_SIZE: int = Field(default=120, description="Telemetry samples kept for rolling averages")
     
     # Logging
     LOG_LEVEL: str = Field(default="INFO", description="Log level")
@@ -65,6 +121,16 @@ class Settings(BaseSettings):
     NUM_INFERENCE_STEPS: int = Field(default=20, description="Number of inference steps")
     GUIDANCE_SCALE: float = Field(default=7.5, description="Guidance scale")
     STRENGTH: float = Field(default=0.8, description="Denoising strength")
+    PROMPT_CACHE_SIZE: int = Field(default=32, description="Number of encoded prompts kept in memory (0 disables)")
+    
+    # Quality tiers (standard uses the generation parameters above)
+    DEFAULT_QUALITY_TIER: str = Field(default="standard", description="Tier used when a request does not name one (preview, standard or max)")
+    PREVIEW_INFERENCE_STEPS: int = Field(default=8, description="Inference steps for the preview tier")
+    PREVIEW_STRENGTH: float = Field(default=0.6, description="Denoising strength for the preview tier (img2img runs steps x strength denoising steps)")
+    PREVIEW_MAX_IMAGE_SIZE: int = Field(default=768, description="Maximum image dimension for the preview tier (larger inputs are downscaled, never tiled)")
+    PREVIEW_OUTPUT_PRESET: str = Field(default="jpeg", description="Output encoding preset for the preview tier")
+    MAX_TIER_INFERENCE_STEPS: int = Field(default=40, description="Inference steps for the max tier")
+    MAX_TIER_OUTPUT_PRESET: str = Field(default="png", description="Output encoding preset for the max tier")
     
     class Config:
         env_file = ".env"
@@ -80,8 +146,32 @@ def get_model_config() -> dict:
     return {
         "flux_model": settings.FLUX_MODEL_NAME,
         "lora_path": settings.LORA_MODEL_PATH,
+        "adapters_dir": settings.LORA_ADAPTERS_DIR,
+        "max_loaded_adapters": settings.MAX_LOADED_ADAPTERS,
+        "snapshot_path": settings.MODEL_SNAPSHOT_PATH,
+        "dtype": settings.MODEL_DTYPE,
         "device": f"cuda:{settings.CUDA_DEVICE}",
+        "gpu_devices": [device.strip() for device in settings.GPU_DEVICES.split(",") if device.strip()],
+        "enable_memory_efficient": settings.ENABLE_MEMORY_EFFICIENT,
+        "max_batch_size": settings.MAX_BATCH_SIZE,
+        "batch_window_ms": settings.BATCH_WINDOW_MS,
+        "resolution_bucket": settings.RESOLUTION_BUCKET,
+        "max_inflight_jobs": settings.MAX_INFLIGHT_JOBS
+    }
+
+
+def get_memory_config() -> dict:
+    """إعدادات تخطيط الذاكرة"""
+    gigabyte = 1024 ** 3
+    return {
         "enable_memory_efficient": settings.ENABLE_MEMORY_EFFICIENT,
+        "strategy": settings.MEMORY_STRATEGY,
+        "headroom_bytes": int(settings.MEMORY_HEADROOM_GB * gigabyte),
+        "activation_bytes_per_megapixel": int(settings.ACTIVATION_GB_PER_MEGAPIXEL * gigabyte),
+        "vae_tiling_megapixels": settings.VAE_TILING_MEGAPIXELS,
+        "promote_after_jobs": settings.MEMORY_PROMOTE_AFTER_JOBS,
+        # أكبر صورة تصل إلى الـ pipeline في استدعاء واحد
+        "max_megapixels": settings.MAX_IMAGE_SIZE ** 2 / 1e6,
         "max_batch_size": settings.MAX_BATCH_SIZE
     }
 
@@ -93,7 +183,114 @@ def get_processing_config() -> dict:
         "guidance_scale": settings.GUIDANCE_SCALE,
         "strength": settings.STRENGTH,
         "default_prompt": settings.DEFAULT_UPSCALE_PROMPT,
-        "negative_prompt": settings.NEGATIVE_PROMPT
+        "negative_prompt": settings.NEGATIVE_PROMPT,
+        "prompt_cache_size": settings.PROMPT_CACHE_SIZE,
+        "enable_tiling": settings.ENABLE_TILING,
+        "tile_size": settings.TILE_SIZE,
+        "tile_overlap": settings.TILE_OVERLAP,
+        "tile_batch_size": settings.TILE_BATCH_SIZE,
+        "preview_interval": settings.PROGRESS_PREVIEW_INTERVAL
+    }
+
+
+def get_tier_config() -> dict:
+    """إعدادات مستويات الجودة - None يعني القيمة الافتراضية من إعدادات المعالجة والترميز"""
+    return {
+        "default_tier": settings.DEFAULT_QUALITY_TIER,
+        "tiers": {
+            "preview": {
+                "num_inference_steps": settings.PREVIEW_INFERENCE_STEPS,
+                "strength": settings.PREVIEW_STRENGTH,
+                "max_image_size": settings.PREVIEW_MAX_IMAGE_SIZE,
+                "output_format": settings.PREVIEW_OUTPUT_PRESET,
+                "tiling": False,
+                # يحتفظ الطابور بملف الإدخال حتى يُعاد استخدامه لطلب بجودة أعلى
+                "retain_input": True
+            },
+            "standard": {
+                "num_inference_steps": None,
+                "strength": None,
+                "max_image_size": settings.MAX_IMAGE_SIZE,
+                "output_format": None,
+                "tiling": True,
+                "retain_input": False
+            },
+            "max": {
+                "num_inference_steps": settings.MAX_TIER_INFERENCE_STEPS,
+                "strength": None,
+                "max_image_size": settings.MAX_IMAGE_SIZE,
+                "output_format": settings.MAX_TIER_OUTPUT_PRESET,
+                "tiling": True,
+                "retain_input": False
+            }
+        }
+    }
+
+
+def get_encoding_config() -> dict:
+    """إعدادات ترميز الصور الناتجة"""
+    return {
+        "default_preset": settings.OUTPUT_PRESET,
+        "png_compress_level": settings.PNG_COMPRESS_LEVEL,
+        "webp_quality": settings.WEBP_QUALITY,
+        "jpeg_quality": settings.JPEG_QUALITY,
+        "encode_workers": settings.ENCODE_WORKERS
+    }
+
+
+def get_queue_config() -> dict:
+    """إعدادات طابور المهام"""
+    return {
+        "max_queue_size": settings.MAX_QUEUE_SIZE,
+        # عدد العمال لا يقل عن حجم الدفعة حتى يجد المُجمِّع طلبات متزامنة
+        "num_workers": max(settings.QUEUE_WORKERS, settings.MAX_BATCH_SIZE),
+        "history_size": settings.TASK_HISTORY_SIZE,
+        # مهلة كل مهمة من لحظة قبولها (0 = بلا مهلة)
+        "processing_timeout": settings.PROCESSING_TIMEOUT
+    }
+
+
+def get_batch_config() -> dict:
+    """إعدادات الطلبات الدفعية"""
+    return {
+        "max_files": settings.MAX_BATCH_FILES,
+        "depth": settings.BATCH_PIPELINE_DEPTH,
+        # مهلة كل صورة من لحظة دخولها الخط، كمهام الطابور
+        "processing_timeout": settings.PROCESSING_TIMEOUT
+    }
+
+
+def get_storage_config() -> dict:
+    """إعدادات منظف التخزين لكل مجلد مُدار"""
+    hour = 3600
+    return {
+        "cleanup_interval": settings.CLEANUP_INTERVAL,
+        "reconcile_interval": settings.STORAGE_RECONCILE_INTERVAL,
+        "directories": {
+            "uploads": {
+                "path": settings.UPLOAD_DIR,
+                "max_age_seconds": settings.UPLOAD_MAX_AGE_HOURS * hour,
+                "max_bytes": settings.UPLOAD_DIR_MAX_BYTES
+            },
+            "results": {
+                "path": settings.RESULT_DIR,
+                "max_age_seconds": settings.RESULT_MAX_AGE_HOURS * hour,
+                "max_bytes": settings.RESULT_DIR_MAX_BYTES
+            },
+            "temp": {
+                "path": settings.TEMP_DIR,
+                "max_age_seconds": settings.TEMP_MAX_AGE_HOURS * hour,
+                "max_bytes": settings.TEMP_DIR_MAX_BYTES
+            }
+        }
+    }
+
+
+def get_telemetry_config() -> dict:
+    """إعدادات جامع القياسات"""
+    return {
+        "interval": settings.TELEMETRY_INTERVAL,
+        "history_size": settings.TELEMETRY_HISTORY_SIZE
     }
 
 
@@ -103,7 +300,14 @@ def get_file_config() -> dict:
         "upload_dir": settings.UPLOAD_DIR,
         "result_dir": settings.RESULT_DIR,
         "temp_dir": settings.TEMP_DIR,
+        "enable_result_cache": settings.ENABLE_RESULT_CACHE,
+        "result_cache_dir": settings.RESULT_CACHE_DIR,
+        "result_cache_max_bytes": settings.RESULT_CACHE_MAX_BYTES,
+        "download_cache_max_age": settings.DOWNLOAD_CACHE_MAX_AGE,
+        "download_accel_prefix": settings.DOWNLOAD_ACCEL_PREFIX,
         "max_file_size": settings.MAX_FILE_SIZE,
+        "upload_chunk_size": settings.UPLOAD_CHUNK_SIZE,
+        "max_archive_size": settings.MAX_ARCHIVE_SIZE,
         "max_image_size": settings.MAX_IMAGE_SIZE,
         "supported_formats": settings.SUPPORTED_FORMATS
     }
@@ -0,0 +1,144 @@
+"""
+ترميز الصور الناتجة - إعدادات سريعة للصيغ وتشغيل الترميز خارج حلقة الأحداث
+"""
+
+import io
+import time
+import asyncio
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+from PIL import Image
+from loguru import logger
+
+from .config import get_encoding_config
+
+
+# أنماط تُنقل بايتاتها الخام عبر ذاكرة مشتركة - غيرها (مثل P بلوحة ألوان) يُنقل عبر pickle كما هو
+SHARED_MODES = ("RGB", "RGBA", "L")
+
+
+@dataclass(frozen=True)
+class EncodingPreset:
+    """صيغة الحفظ ومعاملاتها"""
+    name: str
+    format: str
+    extension: str
+    params: dict = field(default_factory=dict)
+
+
+def get_preset(name: Optional[str] = None, config: Optional[dict] = None) -> EncodingPreset:
+    """الحصول على إعداد ترميز بالاسم (أو الافتراضي للنشر)"""
+    config = config or get_encoding_config()
+    name = name or config["default_preset"]
+
+    presets = {
+        "png_fast": EncodingPreset("png_fast", "PNG", ".png", {"compress_level": 1}),
+        "png": EncodingPreset("png", "PNG", ".png", {"compress_level": config["png_compress_level"]}),
+        "png_small": EncodingPreset("png_small", "PNG", ".png", {"compress_level": 9}),
+        "webp": EncodingPreset("webp", "WEBP", ".webp", {"quality": config["webp_quality"], "method": 4}),
+        "webp_lossless": EncodingPreset("webp_lossless", "WEBP", ".webp", {"lossless": True, "quality": 0, "method": 0}),
+        "jpeg": EncodingPreset("jpeg", "JPEG", ".jpg", {"quality": config["jpeg_quality"]}),
+        "jpeg_high": EncodingPreset("jpeg_high", "JPEG", ".jpg", {"quality": 97, "subsampling": 0}),
+    }
+
+    if name not in presets:
+        raise ValueError(f"إعداد ترميز غير معروف: {name}")
+    return presets[name]
+
+
+def encode_to_file(image: Image.Image, output_path: str, image_format: str, params: dict) -> dict:
+    """ترميز الصورة وحفظها - دالة على مستوى الوحدة لتعمل داخل عمليات منفصلة"""
+    # الترميز في الذاكرة ثم الكتابة حتى يُقاس زمن كل منهما على حدة
+    start_time = time.perf_counter()
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **params)
+    encode_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with open(output_path, "wb") as f:
+        f.write(buffer.getbuffer())
+
+    return {
+        "encode_time": encode_time,
+        "write_time": time.perf_counter() - start_time,
+        "output_bytes": buffer.tell()
+    }
+
+
+def encode_shared(name: str, mode: str, size: tuple, output_path: str, image_format: str, params: dict) -> dict:
+    """ترميز صورة من ذاكرة مشتركة أنشأتها العملية الرئيسية - البكسلات لا تمر عبر pickle والأنبوب"""
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        image = Image.frombuffer(mode, size, memory.buf, "raw", mode, 0, 1)
+        info = encode_to_file(image, output_path, image_format, params)
+        # الصورة قد تشير إلى الذاكرة المشتركة - تُحرر قبل إغلاقها
+        del image
+        return info
+    finally:
+        memory.close()
+
+
+class ImageEncoder:
+    """مجمع عمليات لترميز الصور بالتوازي مع مهمة GPU التالية"""
+
+    def __init__(self, workers: Optional[int] = None):
+        config = get_encoding_config()
+        self.workers = config["encode_workers"] if workers is None else workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        """إنشاء العمليات مبكراً
+
+        forkserver وليس fork: العمليات تتفرع من خادم نظيف لا من عملية هيأت CUDA أو NVML،
+        فلا ترث حالة CUDA أو أقفال خيوط الاستدلال أياً كان وقت الإنشاء.
+        """
+        if self.workers <= 0 or self._pool is not None:
+            return
+
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("forkserver")
+        )
+        # إجبار المجمع على إنشاء كل العمليات الآن
+        self._pool.submit(int).result()
+        logger.info(f"🖼️ تم تشغيل {self.workers} عملية لترميز الصور")
+
+    async def encode(self, image: Image.Image, output_path: str, preset: EncodingPreset) -> dict:
+        """ترميز الصورة وإرجاع الوقت والحجم"""
+        if self._pool is None:
+            info = await asyncio.to_thread(encode_to_file, image, output_path, preset.format, preset.params)
+        elif image.mode not in SHARED_MODES:
+            loop = asyncio.get_running_loop()
+            info = await loop.run_in_executor(
+                self._pool, encode_to_file, image, output_path, preset.format, preset.params
+            )
+        else:
+            info = await self._encode_shared(image, output_path, preset)
+
+        return {"preset": preset.name, "format": preset.format, **info}
+
+    async def _encode_shared(self, image: Image.Image, output_path: str, preset: EncodingPreset) -> dict:
+        """نسخ البكسلات مرة واحدة إلى ذاكرة مشتركة وإرسال اسمها فقط إلى عملية الترميز"""
+        data = image.tobytes()
+        memory = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        try:
+            memory.buf[:len(data)] = data
+            del data
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._pool, encode_shared, memory.name, image.mode, image.size,
+                output_path, preset.format, preset.params
+            )
+        finally:
+            memory.close()
+            memory.unlink()
+
+    def shutdown(self):
+        """إيقاف عمليات الترميز"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+            logger.info("🖼️ تم إيقاف عمليات الترميز")
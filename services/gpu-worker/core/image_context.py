@@ -0,0 +1,82 @@
+"""
+سياق صورة الطلب - قراءة الترويسة عند الحاجة وفك ترميز الصورة مرة واحدة فقط
+"""
+
+import threading
+from typing import Optional, Tuple
+from PIL import Image, ImageOps
+
+
+class ImageContext:
+    """يرافق الصورة من التحقق إلى المعالجة حتى لا تُفتح وتُفك أكثر من مرة"""
+
+    def __init__(self, path: str, content_hash: Optional[str] = None, file_size: Optional[int] = None):
+        self.path = path
+        self.content_hash = content_hash
+        self.file_size = file_size
+
+        self._format: Optional[str] = None
+        self._mode: Optional[str] = None
+        self._size: Optional[Tuple[int, int]] = None
+        self._image: Optional[Image.Image] = None
+        self._lock = threading.Lock()
+
+    def _read_header(self):
+        """قراءة الصيغة والأبعاد من الترويسة فقط دون فك البكسلات"""
+        if self._format is None:
+            with Image.open(self.path) as img:
+                self._format = img.format
+                self._mode = img.mode
+                self._size = img.size
+
+    @property
+    def format(self) -> Optional[str]:
+        """صيغة الصورة"""
+        self._read_header()
+        return self._format
+
+    @property
+    def mode(self) -> Optional[str]:
+        """نمط الألوان الأصلي"""
+        self._read_header()
+        return self._mode
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """أبعاد الصورة (بعد تصحيح الاتجاه إذا فُكّت)"""
+        if self._image is not None:
+            return self._image.size
+        self._read_header()
+        return self._size
+
+    @property
+    def is_decoded(self) -> bool:
+        """هل تم فك ترميز الصورة"""
+        return self._image is not None
+
+    def decode(self) -> Image.Image:
+        """فك ترميز الصورة إلى RGB مرة واحدة ثم إعادة استخدامها"""
+        with self._lock:
+            if self._image is None:
+                self._read_header()
+                img = Image.open(self.path)
+                img.load()
+                # تصحيح الاتجاه والتحويل دون نسخ إضافية للبكسلات
+                ImageOps.exif_transpose(img, in_place=True)
+                self._image = img if img.mode == "RGB" else img.convert("RGB")
+            return self._image
+
+    def release(self):
+        """تحرير البكسلات المفكوكة بعد انتهاء المعالجة"""
+        self._image = None
+
+    def info(self) -> dict:
+        """معلومات الصورة دون فك ترميزها"""
+        width, height = self.size
+        return {
+            "format": self.format,
+            "mode": self.mode,
+            "size": (width, height),
+            "width": width,
+            "height": height
+        }
@@ -0,0 +1,39 @@
+"""
+منفذ الاستدلال - تشغيل عمليات GPU على خيط مخصص بعيداً عن حلقة الأحداث
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from loguru import logger
+
+
+class InferenceExecutor:
+    """منفذ بخيط واحد لعمليات GPU مع حد لعدد المهام الجارية"""
+
+    def __init__(self, max_inflight: int = 1, name: str = "inference"):
+        self.max_inflight = max(1, max_inflight)
+        self.inflight = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._semaphore = asyncio.Semaphore(self.max_inflight)
+
+        logger.info(f"🧵 تم إنشاء منفذ الاستدلال (الحد الأقصى للمهام الجارية: {self.max_inflight})")
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """تشغيل دالة متزامنة على خيط الاستدلال دون حجب حلقة الأحداث"""
+        async with self._semaphore:
+            self.inflight += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self._executor,
+                    functools.partial(fn, *args, **kwargs)
+                )
+            finally:
+                self.inflight -= 1
+
+    def shutdown(self, wait: bool = True):
+        """إيقاف المنفذ"""
+        self._executor.shutdown(wait=wait)
+        logger.info("🧵 تم إيقاف منفذ الاستدلال")
@@ -0,0 +1,265 @@
+"""
+مخطط الذاكرة - اختيار طريقة تشغيل الموديل حسب ذاكرة GPU والنظام المتاحة
+"""
+
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+import torch
+from loguru import logger
+
+from .config import get_memory_config
+
+
+RESIDENT = "resident"
+MODEL_OFFLOAD = "model_offload"
+SEQUENTIAL_OFFLOAD = "sequential_offload"
+
+# من الأسرع إلى الأقل استهلاكاً للذاكرة
+STRATEGIES = (RESIDENT, MODEL_OFFLOAD, SEQUENTIAL_OFFLOAD)
+
+# نسبة من ميزانية الذاكرة تعتبر قريبة من نفادها
+NEAR_LIMIT_RATIO = 0.95
+
+
+@dataclass
+class MemoryPlan:
+    """الطريقة المختارة وسببها والتقديرات التي بُنيت عليها"""
+    strategy: str
+    vae_tiling: bool
+    vae_slicing: bool
+    reason: str
+    estimates: Dict[str, int] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        """تمثيل قابل للعرض في /status"""
+        return asdict(self)
+
+
+def component_sizes(pipeline) -> Dict[str, int]:
+    """حجم أوزان كل مكون بالبايت"""
+    components = getattr(pipeline, "components", {}) or {}
+    return {
+        name: sum(param.numel() * param.element_size() for param in module.parameters())
+        for name, module in components.items()
+        if isinstance(module, torch.nn.Module)
+    }
+
+
+class MemoryPlanner:
+    """يختار بين التحميل الكامل وتفريغ الموديل إلى الذاكرة الرئيسية، ويعيد التخطيط من القياسات الفعلية"""
+
+    def __init__(self, device: str, monitor=None, config: Optional[dict] = None):
+        self.device = device
+        # مراقب الخدمة المشترك - بدونه تُقرأ الذاكرة مباشرة دون إنشاء جامع قياسات لكل مخطط
+        self.monitor = monitor
+        self.config = config or get_memory_config()
+
+        self.sizes: Dict[str, int] = {}
+        self.budget = 0
+        self.host_available = 0
+        self.activation_per_megapixel = self.config["activation_bytes_per_megapixel"]
+        self.measured = False
+        self.plan: Optional[MemoryPlan] = None
+        self.history: List[dict] = []
+        self.peak_bytes = 0
+        # أدنى طريقة مسموحة بعد نفاد الذاكرة أو الاقتراب منه - لا ترتفع إلا بعد مهام متتالية هادئة
+        self.floor: Optional[str] = None
+        self.calm_jobs = 0
+
+    def _weights_on_gpu(self, strategy: str) -> int:
+        """الأوزان الموجودة على GPU في ذروة الاستدلال لكل طريقة"""
+        if strategy == RESIDENT:
+            return sum(self.sizes.values())
+        if strategy == MODEL_OFFLOAD:
+            # مكون واحد فقط على GPU في أي لحظة - الأكبر هو الـ transformer
+            return max(self.sizes.values(), default=0)
+        return 0
+
+    def _estimate_peak(self, strategy: str) -> int:
+        """الذروة المتوقعة لأكبر استدعاء ممكن"""
+        megapixels = self.config["max_megapixels"] * max(1, self.config["max_batch_size"])
+        return self._weights_on_gpu(strategy) + int(self.activation_per_megapixel * megapixels)
+
+    def initialize(self, sizes: Dict[str, int]) -> MemoryPlan:
+        """قراءة الذاكرة المتاحة عند الإقلاع (قبل نقل الأوزان) ووضع الخطة الأولى"""
+        self.sizes = dict(sizes)
+        if self.monitor is None:
+            from utils.gpu_monitor import free_memory
+            memory = free_memory(self.device)
+        else:
+            memory = self.monitor.get_free_memory(self.device)
+        self.budget = max(0, memory["gpu_free"] - self.config["headroom_bytes"])
+        self.host_available = memory["host_available"]
+
+        self.plan = self._choose("تخطيط أولي")
+        return self.plan
+
+    def _choose(self, trigger: str, floor: Optional[str] = None) -> MemoryPlan:
+        """اختيار أسرع طريقة تتسع لها الذاكرة"""
+        total_weights = sum(self.sizes.values())
+        estimates = {
+            "weights_bytes": total_weights,
+            "largest_component_bytes": max(self.sizes.values(), default=0),
+            "activation_bytes_per_megapixel": int(self.activation_per_megapixel),
+            "gpu_budget_bytes": self.budget,
+            "host_available_bytes": self.host_available
+        }
+
+        forced = self.config["strategy"]
+        if not self.config["enable_memory_efficient"]:
+            forced = RESIDENT
+
+        candidates = STRATEGIES[STRATEGIES.index(floor):] if floor else STRATEGIES
+        if forced in STRATEGIES:
+            strategy = forced
+            reason = f"{trigger}: الطريقة محددة في الإعدادات ({forced})"
+        else:
+            strategy = None
+            for candidate in candidates:
+                peak = self._estimate_peak(candidate)
+                # التفريغ يتطلب أن تتسع الذاكرة الرئيسية للأوزان
+                host_ok = candidate == RESIDENT or self.host_available >= total_weights
+                if peak <= self.budget and host_ok:
+                    strategy = candidate
+                    reason = (
+                        f"{trigger}: الذروة المتوقعة {peak / 1024 ** 3:.1f}GB "
+                        f"ضمن ميزانية GPU {self.budget / 1024 ** 3:.1f}GB"
+                    )
+                    break
+
+            if strategy is None:
+                strategy = SEQUENTIAL_OFFLOAD
+                reason = f"{trigger}: لا توجد طريقة تتسع للذاكرة المتاحة - التفريغ التسلسلي هو الأقل استهلاكاً"
+
+        megapixels = self.config["max_megapixels"]
+        vae_tiling = (megapixels > self.config["vae_tiling_megapixels"]
+                      or self._estimate_peak(strategy) > self.budget)
+        vae_slicing = self.config["max_batch_size"] > 1
+
+        estimates["expected_peak_bytes"] = self._estimate_peak(strategy)
+        return MemoryPlan(strategy, vae_tiling, vae_slicing, reason, estimates)
+
+    def apply(self, pipeline, previous: Optional[MemoryPlan] = None):
+        """تطبيق الخطة على الـ pipeline"""
+        plan = self.plan
+        if previous is None or previous.strategy != plan.strategy:
+            if previous and previous.strategy != RESIDENT:
+                pipeline.remove_all_hooks()
+
+            if plan.strategy == RESIDENT:
+                pipeline.to(self.device)
+            else:
+                if previous and previous.strategy == RESIDENT:
+                    pipeline.to("cpu")
+                if plan.strategy == MODEL_OFFLOAD:
+                    pipeline.enable_model_cpu_offload(device=self.device)
+                else:
+                    pipeline.enable_sequential_cpu_offload(device=self.device)
+
+        vae = getattr(pipeline, "vae", None)
+        if vae is not None:
+            if plan.vae_tiling:
+                vae.enable_tiling()
+            else:
+                vae.disable_tiling()
+
+            if plan.vae_slicing:
+                vae.enable_slicing()
+            else:
+                vae.disable_slicing()
+
+        self.history.append({"strategy": plan.strategy, "reason": plan.reason})
+        logger.info(
+            f"🧠 خطة الذاكرة على {self.device}: {plan.strategy} "
+            f"(VAE tiling={plan.vae_tiling}, slicing={plan.vae_slicing}) - {plan.reason}"
+        )
+
+    def before_job(self):
+        """تصفير عداد الذروة قبل الاستدلال"""
+        if torch.cuda.is_available() and self.device.startswith("cuda"):
+            torch.cuda.reset_peak_memory_stats(self.device)
+
+    def after_job(self, pipeline, megapixels: float, peak_bytes: Optional[int] = None) -> bool:
+        """مقارنة الذروة الفعلية بالتقدير وإعادة التخطيط إذا كان التقدير خاطئاً"""
+        if peak_bytes is None:
+            if not (torch.cuda.is_available() and self.device.startswith("cuda")):
+                return False
+            peak_bytes = torch.cuda.max_memory_allocated(self.device)
+
+        if self.plan is None or megapixels <= 0:
+            return False
+
+        self.peak_bytes = max(self.peak_bytes, peak_bytes)
+        activation = max(0, peak_bytes - self._weights_on_gpu(self.plan.strategy)) / megapixels
+
+        # أول قياس يستبدل التقدير المبدئي، وبعده نحتفظ بالأكبر
+        self.activation_per_megapixel = (
+            max(self.activation_per_megapixel, activation) if self.measured else activation
+        )
+        self.measured = True
+
+        if peak_bytes >= self.budget * NEAR_LIMIT_RATIO:
+            self.calm_jobs = 0
+            if self._next_strategy() is None:
+                return False
+            return self._step_down(pipeline, "الذروة الفعلية قريبة من نفاد الذاكرة")
+
+        self._relax_floor()
+        return self._replan(pipeline, "إعادة التخطيط من الذروة المقاسة", floor=self.floor)
+
+    def handle_oom(self, pipeline) -> bool:
+        """الانتقال إلى طريقة أقل استهلاكاً بعد نفاد الذاكرة - يرجع False إذا لم يبق ما هو أقل"""
+        if self.plan is None or self._next_strategy() is None:
+            return False
+
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return self._step_down(pipeline, "نفاد ذاكرة GPU أثناء الاستدلال")
+
+    def _step_down(self, pipeline, trigger: str) -> bool:
+        """النزول إلى الطريقة التالية وتثبيتها حداً أدنى"""
+        self.floor = self._next_strategy()
+        self.calm_jobs = 0
+        return self._replan(pipeline, trigger, floor=self.floor)
+
+    def _relax_floor(self):
+        """رفع الحد الأدنى درجة واحدة بعد عدد كافٍ من المهام المتتالية البعيدة عن حد الذاكرة"""
+        if self.floor is None:
+            return
+
+        self.calm_jobs += 1
+        if self.calm_jobs < self.config.get("promote_after_jobs", 20):
+            return
+
+        index = STRATEGIES.index(self.floor)
+        # الحد الأدنى RESIDENT يعني عدم وجود حد
+        self.floor = STRATEGIES[index - 1] if index > 1 else None
+        self.calm_jobs = 0
+
+    def _next_strategy(self) -> Optional[str]:
+        """الطريقة الأقل استهلاكاً التالية"""
+        index = STRATEGIES.index(self.plan.strategy)
+        return STRATEGIES[index + 1] if index + 1 < len(STRATEGIES) else None
+
+    def _replan(self, pipeline, trigger: str, floor: Optional[str] = None) -> bool:
+        """تطبيق خطة جديدة إذا تغيرت الطريقة"""
+        new_plan = self._choose(trigger, floor=floor)
+        if (new_plan.strategy, new_plan.vae_tiling) == (self.plan.strategy, self.plan.vae_tiling):
+            self.plan.estimates = new_plan.estimates
+            return False
+
+        previous, self.plan = self.plan, new_plan
+        self.apply(pipeline, previous)
+        logger.warning(f"🔁 تغيرت خطة الذاكرة على {self.device}: {previous.strategy} ← {new_plan.strategy}")
+        return True
+
+    def get_stats(self) -> dict:
+        """الخطة الحالية وسجل التغييرات"""
+        return {
+            "plan": self.plan.to_dict() if self.plan else None,
+            "measured": self.measured,
+            "peak_bytes": self.peak_bytes,
+            "floor": self.floor,
+            "replans": max(0, len(self.history) - 1),
+            "history": self.history[-10:]
+        }
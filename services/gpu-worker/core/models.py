@@ -14,6 +14,7 @@ class ProcessingStatus(str, Enum):
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 
 class ImageFormat(str, Enum):
@@ -23,6 +24,30 @@ class ImageFormat(str, Enum):
     WEBP = "WEBP"
 
 
+class OutputPreset(str, Enum):
+    """إعدادات ترميز الصورة الناتجة"""
+    PNG_FAST = "png_fast"
+    PNG = "png"
+    PNG_SMALL = "png_small"
+    WEBP = "webp"
+    WEBP_LOSSLESS = "webp_lossless"
+    JPEG = "jpeg"
+    JPEG_HIGH = "jpeg_high"
+
+
+class QualityTier(str, Enum):
+    """مستويات الجودة: معاينة سريعة، أو المعاملات الافتراضية، أو أقصى جودة"""
+    PREVIEW = "preview"
+    STANDARD = "standard"
+    MAX = "max"
+
+
+class BatchOutput(str, Enum):
+    """شكل نتائج الطلب الدفعي"""
+    MANIFEST = "manifest"
+    ARCHIVE = "archive"
+
+
 class UpscaleRequest(BaseModel):
     """طلب رفع جودة الصورة"""
     
@@ -60,6 +85,23 @@ class UpscaleRequest(BaseModel):
         description="البذرة للتكرار",
         ge=0
     )
+    output_format: Optional[OutputPreset] = Field(
+        default=None,
+        description="ترميز الصورة الناتجة (الافتراضي من OUTPUT_PRESET)"
+    )
+    adapter: Optional[str] = Field(
+        default=None,
+        description="محول LoRA من LORA_ADAPTERS_DIR (الافتراضي: LORA_MODEL_PATH المدمج)",
+        max_length=100
+    )
+    quality_tier: Optional[QualityTier] = Field(
+        default=None,
+        description="مستوى الجودة: الخطوات والقوة وحد الدقة والترميز (الافتراضي من DEFAULT_QUALITY_TIER)"
+    )
+    source_task_id: Optional[str] = Field(
+        default=None,
+        description="إعادة استخدام صورة مهمة معاينة سابقة بدلاً من رفعها مجدداً"
+    )
     
     @validator('prompt')
     def validate_prompt(cls, v):
@@ -108,7 +150,7 @@ class ProcessingMetrics(BaseModel):
     failed_processed: int = Field(default=0, description="الصور الفاشلة")
     average_processing_time: float = Field(default=0.0, description="متوسط وقت المعالجة")
     gpu_utilization_avg: float = Field(default=0.0, description="متوسط استخدام GPU")
-    memory_usage_avg: float = Field(default=0.0, description="متوسط استخدام الذاكرة")
+    memory_usage_avg: float = Field(default=0.0, description="متوسط نسبة استخدام ذاكرة GPU")
     uptime: float = Field(default=0.0, description="وقت التشغيل بالساعات")
     last_reset: datetime = Field(default_factory=datetime.now, description="آخر إعادة تعيين")
 
@@ -129,8 +171,10 @@ class ModelInfo(BaseModel):
     name: str = Field(description="اسم الموديل")
     version: str = Field(description="إصدار الموديل")
     size: Optional[str] = Field(default=None, description="حجم الموديل")
+    source: Optional[str] = Field(default=None, description="مصدر الأوزان (snapshot / hub)")
     loaded: bool = Field(description="حالة التحميل")
     load_time: Optional[float] = Field(default=None, description="وقت التحميل")
+    load_time_breakdown: Optional[Dict[str, float]] = Field(default=None, description="وقت تحميل كل مكون بالثواني")
     memory_usage: Optional[float] = Field(default=None, description="استخدام الذاكرة")
 
 
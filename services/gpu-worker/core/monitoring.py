@@ -3,12 +3,17 @@
 """
 
 import time
-from typing import Dict
-from fastapi import FastAPI, Request
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+from fastapi import FastAPI
 from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
 from fastapi.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from loguru import logger
 
+from .stats import QuantileSketch, RollingQuantileSketch, WindowedCounter, DailyCounter
+
 
 # Prometheus metrics
 REQUEST_COUNT = Counter(
@@ -28,6 +33,13 @@ PROCESSING_TIME = Histogram(
     'Image processing time in seconds'
 )
 
+TIER_LATENCY = Histogram(
+    'gpu_worker_tier_latency_seconds',
+    'Image processing time in seconds by quality tier',
+    ['tier'],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+)
+
 ACTIVE_REQUESTS = Gauge(
     'gpu_worker_active_requests',
     'Number of active requests'
@@ -35,12 +47,86 @@ ACTIVE_REQUESTS = Gauge(
 
 GPU_MEMORY_USAGE = Gauge(
     'gpu_worker_gpu_memory_usage_bytes',
-    'GPU memory usage in bytes'
+    'GPU memory usage in bytes',
+    ['device']
 )
 
 GPU_UTILIZATION = Gauge(
     'gpu_worker_gpu_utilization_percent',
-    'GPU utilization percentage'
+    'GPU utilization percentage',
+    ['device']
+)
+
+BATCH_SIZE = Histogram(
+    'gpu_worker_batch_size',
+    'Number of images per pipeline call',
+    buckets=(1, 2, 4, 8, 16, 32)
+)
+
+CACHE_REQUESTS = Counter(
+    'gpu_worker_cache_requests_total',
+    'Cache lookups by cache and result',
+    ['cache', 'result']
+)
+
+DEVICE_INFLIGHT = Gauge(
+    'gpu_worker_device_inflight_jobs',
+    'Jobs dispatched to a device replica and not yet finished',
+    ['device']
+)
+
+DEVICE_JOBS = Counter(
+    'gpu_worker_device_jobs_total',
+    'Jobs finished per device replica (success, failed or cancelled)',
+    ['device', 'status']
+)
+
+DEVICE_SERVICE_TIME = Histogram(
+    'gpu_worker_device_service_seconds',
+    'Job service time per device replica',
+    ['device']
+)
+
+ADAPTER_SWAP_TIME = Histogram(
+    'gpu_worker_adapter_swap_seconds',
+    'Time to switch the active LoRA adapter',
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+
+STAGE_DURATION = Histogram(
+    'gpu_worker_stage_duration_seconds',
+    'Duration of each request pipeline stage in seconds',
+    ['stage'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+
+STORAGE_FILES = Gauge(
+    'gpu_worker_storage_files',
+    'Files in a managed directory',
+    ['directory']
+)
+
+STORAGE_BYTES = Gauge(
+    'gpu_worker_storage_bytes',
+    'Bytes used by a managed directory',
+    ['directory']
+)
+
+STORAGE_DRIFT = Counter(
+    'gpu_worker_storage_reconcile_drift_files_total',
+    'Files found out of sync with the storage index when reconciling against disk',
+    ['directory']
+)
+
+JOBS_CANCELLED = Counter(
+    'gpu_worker_jobs_cancelled_total',
+    'Jobs stopped before completion by reason (deadline, cancelled, disconnected)',
+    ['reason']
+)
+
+GPU_SECONDS_SAVED = Counter(
+    'gpu_worker_gpu_seconds_saved_total',
+    'Estimated GPU time not spent because inference was stopped between steps'
 )
 
 IMAGES_PROCESSED = Counter(
@@ -56,46 +142,142 @@ class MetricsCollector:
     def __init__(self):
         self.start_time = time.time()
         self.request_count = 0
-        self.processing_times = []
+        self._request_series: Dict[Tuple[str, str, int], tuple] = {}
+        # نسب مئوية لكل وقت التشغيل ولآخر 5-10 دقائق بذاكرة ثابتة
+        self.processing_time_sketch = QuantileSketch()
+        self.recent_processing_time = RollingQuantileSketch(window_seconds=300)
+        self.recent_processing_times = deque(maxlen=10)
+        # نجاح وفشل بخانات دقيقة لآخر ساعة
+        self.succeeded = WindowedCounter(bucket_seconds=60, buckets=60)
+        self.failed = WindowedCounter(bucket_seconds=60, buckets=60)
+        self.processed_today = DailyCounter()
+        self.cache_stats: Dict[str, Dict[str, int]] = {}
         
     def record_request(self, method: str, endpoint: str, status: int, duration: float):
         """تسجيل طلب"""
-        REQUEST_COUNT.labels(method=method, endpoint=endpoint, status=status).inc()
-        REQUEST_DURATION.labels(method=method, endpoint=endpoint).observe(duration)
+        # البحث عن السلاسل بالتسميات مرة واحدة لكل مجموعة تسميات
+        key = (method, endpoint, status)
+        series = self._request_series.get(key)
+        if series is None:
+            series = (
+                REQUEST_COUNT.labels(method=method, endpoint=endpoint, status=status),
+                REQUEST_DURATION.labels(method=method, endpoint=endpoint)
+            )
+            self._request_series[key] = series
+        
+        series[0].inc()
+        series[1].observe(duration)
         self.request_count += 1
     
     def record_processing_time(self, duration: float):
         """تسجيل وقت المعالجة"""
         PROCESSING_TIME.observe(duration)
-        self.processing_times.append(duration)
-        
-        # الاحتفاظ بآخر 100 قياس فقط
-        if len(self.processing_times) > 100:
-            self.processing_times = self.processing_times[-100:]
+        self.processing_time_sketch.add(duration)
+        self.recent_processing_time.add(duration)
+        self.recent_processing_times.append(duration)
     
     def record_image_processed(self, success: bool):
         """تسجيل معالجة صورة"""
         status = "success" if success else "failed"
         IMAGES_PROCESSED.labels(status=status).inc()
+        (self.succeeded if success else self.failed).add()
+        self.processed_today.add()
+    
+    def get_processing_summary(self, window_seconds: float = 3600) -> Dict:
+        """النسب المئوية لوقت المعالجة ونسبة النجاح والإنتاجية لآخر نافذة زمنية"""
+        succeeded = self.succeeded.total(window_seconds)
+        failed = self.failed.total(window_seconds)
+        processed = succeeded + failed
+        
+        return {
+            "processing_time": self.processing_time_sketch.summary(),
+            "processing_time_recent": self.recent_processing_time.snapshot().summary(),
+            "window_seconds": window_seconds,
+            "processed": processed,
+            "failed": failed,
+            # بدون مهام في النافذة لا توجد حالات فشل
+            "success_rate": round(succeeded / processed * 100, 2) if processed else 100.0,
+            "throughput_per_minute": round(processed / (window_seconds / 60), 3),
+            "processed_today": self.processed_today.value()
+        }
+    
+    def record_cache_request(self, cache: str, hit: bool):
+        """تسجيل بحث في ذاكرة تخزين مؤقت"""
+        result = "hit" if hit else "miss"
+        CACHE_REQUESTS.labels(cache=cache, result=result).inc()
+        
+        stats = self.cache_stats.setdefault(cache, {"hits": 0, "misses": 0})
+        stats["hits" if hit else "misses"] += 1
+    
+    def get_cache_stats(self) -> Dict:
+        """إحصائيات ذاكرات التخزين المؤقت مع نسبة الإصابة"""
+        summary = {}
+        for cache, stats in self.cache_stats.items():
+            total = stats["hits"] + stats["misses"]
+            summary[cache] = {
+                **stats,
+                "hit_rate": round(stats["hits"] / total * 100, 1) if total else 0.0
+            }
+        return summary
+    
+    def record_stage_time(self, stage: str, duration: float):
+        """تسجيل زمن مرحلة من مراحل الطلب"""
+        STAGE_DURATION.labels(stage=stage).observe(duration)
+    
+    def record_batch_size(self, size: int):
+        """تسجيل حجم دفعة"""
+        BATCH_SIZE.observe(size)
+    
+    def set_device_inflight(self, device: str, count: int):
+        """تحديث عدد المهام الجارية على جهاز"""
+        DEVICE_INFLIGHT.labels(device=device).set(count)
+    
+    def record_device_job(self, device: str, status: str, duration: float):
+        """تسجيل مهمة منتهية على جهاز - status: success أو failed أو cancelled"""
+        DEVICE_JOBS.labels(device=device, status=status).inc()
+        DEVICE_SERVICE_TIME.labels(device=device).observe(duration)
+    
+    def record_adapter_swap(self, duration: float):
+        """تسجيل زمن تبديل محول LoRA"""
+        ADAPTER_SWAP_TIME.observe(duration)
     
-    def update_gpu_metrics(self, memory_usage: float, utilization: float):
-        """تحديث مقاييس GPU"""
-        GPU_MEMORY_USAGE.set(memory_usage)
-        GPU_UTILIZATION.set(utilization)
+    def set_storage_usage(self, directory: str, file_count: int, total_bytes: int):
+        """تحديث عدد الملفات وحجمها لمجلد مُدار"""
+        STORAGE_FILES.labels(directory=directory).set(file_count)
+        STORAGE_BYTES.labels(directory=directory).set(total_bytes)
+    
+    def record_storage_drift(self, directory: str, files: int):
+        """تسجيل فرق بين الفهرس والقرص"""
+        STORAGE_DRIFT.labels(directory=directory).inc(files)
+    
+    def record_tier_latency(self, tier: str, duration: float):
+        """تسجيل وقت المعالجة لمستوى جودة"""
+        TIER_LATENCY.labels(tier=tier).observe(duration)
+    
+    def record_job_cancelled(self, reason: str):
+        """تسجيل مهمة أوقفت قبل اكتمالها"""
+        JOBS_CANCELLED.labels(reason=reason).inc()
+    
+    def record_gpu_seconds_saved(self, seconds: float):
+        """تسجيل وقت GPU الموفر بإيقاف الاستدلال"""
+        GPU_SECONDS_SAVED.inc(max(0.0, seconds))
+    
+    def update_gpu_metrics(self, device: str, memory_usage: float, utilization: float):
+        """تحديث مقاييس جهاز GPU واحد"""
+        GPU_MEMORY_USAGE.labels(device=device).set(memory_usage)
+        GPU_UTILIZATION.labels(device=device).set(utilization)
     
     def get_summary(self) -> Dict:
         """ملخص المقاييس"""
         uptime = time.time() - self.start_time
-        avg_processing_time = (
-            sum(self.processing_times) / len(self.processing_times)
-            if self.processing_times else 0
-        )
         
         return {
             "uptime_seconds": uptime,
             "total_requests": self.request_count,
-            "average_processing_time": avg_processing_time,
-            "recent_processing_times": self.processing_times[-10:] if self.processing_times else []
+            "average_processing_time": self.processing_time_sketch.mean,
+            "recent_processing_times": list(self.recent_processing_times),
+            **self.get_processing_summary(),
+            "caches": self.get_cache_stats()
         }
 
 
@@ -103,52 +285,79 @@ class MetricsCollector:
 metrics_collector = MetricsCollector()
 
 
-async def metrics_middleware(request: Request, call_next):
-    """Middleware لتسجيل المقاييس"""
-    start_time = time.time()
+class StageTimer:
+    """زمن كل مرحلة في طلب واحد - يُسجل في Prometheus ويُرفق بنتيجة الطلب"""
     
-    # زيادة عداد الطلبات النشطة
-    ACTIVE_REQUESTS.inc()
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
     
-    try:
-        response = await call_next(request)
-        
-        # حساب مدة الطلب
-        duration = time.time() - start_time
+    @contextmanager
+    def stage(self, name: str):
+        """قياس مرحلة"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+    
+    def record(self, name: str, duration: float):
+        """تسجيل زمن مرحلة مقاس مسبقاً"""
+        self.stages[name] = round(self.stages.get(name, 0.0) + duration, 4)
+        metrics_collector.record_stage_time(name, duration)
+    
+    def to_dict(self) -> Dict[str, float]:
+        """الأزمنة بالثواني بترتيب المراحل"""
+        return dict(self.stages)
+
+
+class MetricsMiddleware:
+    """Middleware بصيغة ASGI مباشرة لتسجيل المقاييس - دون مهمة إضافية لكل طلب كما في BaseHTTPMiddleware"""
+    
+    # المسارات غير المطابقة لأي route تُجمع في تسمية واحدة حتى لا تتضخم سلاسل Prometheus
+    UNMATCHED = "unmatched"
+    
+    def __init__(self, app: ASGIApp, collector: Optional["MetricsCollector"] = None):
+        self.app = app
+        self.collector = collector or metrics_collector
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
-        # تسجيل المقاييس
-        metrics_collector.record_request(
-            method=request.method,
-            endpoint=request.url.path,
-            status=response.status_code,
-            duration=duration
-        )
+        start_time = time.perf_counter()
+        status_code = 500
         
-        return response
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
         
-    except Exception as e:
-        # تسجيل الأخطاء
-        duration = time.time() - start_time
-        metrics_collector.record_request(
-            method=request.method,
-            endpoint=request.url.path,
-            status=500,
-            duration=duration
-        )
-        raise
-    
-    finally:
-        # تقليل عداد الطلبات النشطة
-        ACTIVE_REQUESTS.dec()
+        # زيادة عداد الطلبات النشطة
+        ACTIVE_REQUESTS.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            ACTIVE_REQUESTS.dec()
+            # الـ router يضيف الـ route المطابق إلى scope - التسمية بقالب المسار وليس المسار الفعلي
+            route = scope.get("route")
+            self.collector.record_request(
+                method=scope["method"],
+                endpoint=getattr(route, "path", None) or self.UNMATCHED,
+                status=status_code,
+                duration=time.perf_counter() - start_time
+            )
 
 
 def setup_monitoring(app: FastAPI):
     """إعداد نظام المراقبة"""
     
     # إضافة middleware
-    app.middleware("http")(metrics_middleware)
+    app.add_middleware(MetricsMiddleware)
     
-    @app.get("/metrics")
+    # /metrics نفسه يبقى JSON في التطبيق لعملائه الحاليين
+    @app.get("/metrics/prometheus")
     async def get_prometheus_metrics():
         """Prometheus metrics endpoint"""
         return Response(
@@ -174,6 +383,61 @@ def record_image_processed(success: bool):
     metrics_collector.record_image_processed(success)
 
 
-def update_gpu_metrics(memory_usage: float, utilization: float):
-    """تحديث مقاييس GPU (للاستخدام الخارجي)"""
-    metrics_collector.update_gpu_metrics(memory_usage, utilization)
+def record_stage_time(stage: str, duration: float):
+    """تسجيل زمن مرحلة من مراحل الطلب (للاستخدام الخارجي)"""
+    metrics_collector.record_stage_time(stage, duration)
+
+
+def record_cache_request(cache: str, hit: bool):
+    """تسجيل بحث في ذاكرة تخزين مؤقت (للاستخدام الخارجي)"""
+    metrics_collector.record_cache_request(cache, hit)
+
+
+def record_batch_size(size: int):
+    """تسجيل حجم دفعة (للاستخدام الخارجي)"""
+    metrics_collector.record_batch_size(size)
+
+
+def set_device_inflight(device: str, count: int):
+    """تحديث عدد المهام الجارية على جهاز (للاستخدام الخارجي)"""
+    metrics_collector.set_device_inflight(device, count)
+
+
+def record_device_job(device: str, status: str, duration: float):
+    """تسجيل مهمة منتهية على جهاز (للاستخدام الخارجي)"""
+    metrics_collector.record_device_job(device, status, duration)
+
+
+def record_adapter_swap(duration: float):
+    """تسجيل زمن تبديل محول LoRA (للاستخدام الخارجي)"""
+    metrics_collector.record_adapter_swap(duration)
+
+
+def set_storage_usage(directory: str, file_count: int, total_bytes: int):
+    """تحديث عدد الملفات وحجمها لمجلد مُدار (للاستخدام الخارجي)"""
+    metrics_collector.set_storage_usage(directory, file_count, total_bytes)
+
+
+def record_storage_drift(directory: str, files: int):
+    """تسجيل فرق بين الفهرس والقرص (للاستخدام الخارجي)"""
+    metrics_collector.record_storage_drift(directory, files)
+
+
+def record_tier_latency(tier: str, duration: float):
+    """تسجيل وقت المعالجة لمستوى جودة (للاستخدام الخارجي)"""
+    metrics_collector.record_tier_latency(tier, duration)
+
+
+def record_job_cancelled(reason: str):
+    """تسجيل مهمة أوقفت قبل اكتمالها (للاستخدام الخارجي)"""
+    metrics_collector.record_job_cancelled(reason)
+
+
+def record_gpu_seconds_saved(seconds: float):
+    """تسجيل وقت GPU الموفر بإيقاف الاستدلال (للاستخدام الخارجي)"""
+    metrics_collector.record_gpu_seconds_saved(seconds)
+
+
+def update_gpu_metrics(device: str, memory_usage: float, utilization: float):
+    """تحديث مقاييس جهاز GPU واحد (للاستخدام الخارجي)"""
+    metrics_collector.update_gpu_metrics(device, memory_usage, utilization)
@@ -0,0 +1,216 @@
+"""
+تقدم المهام - خطوات الاستدلال ووقتها المتبقي ومعاينات منخفضة الدقة للبث عبر Server-Sent Events
+"""
+
+import io
+import json
+import time
+import base64
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+import numpy as np
+import torch
+from PIL import Image
+
+
+# فاصل رسائل الإبقاء على الاتصال أثناء انتظار المهمة في الطابور
+KEEPALIVE_SECONDS = 15.0
+
+# إسقاط خطي تقريبي لقنوات latents Flux الست عشرة إلى RGB - بديل رخيص عن فك ترميز VAE
+FLUX_LATENT_RGB_FACTORS = torch.tensor([
+    [-0.0346, 0.0244, 0.0681],
+    [0.0034, 0.0210, 0.0687],
+    [0.0275, -0.0668, -0.0433],
+    [-0.0174, 0.0160, 0.0617],
+    [0.0859, 0.0721, 0.0329],
+    [0.0004, 0.0383, 0.0115],
+    [0.0405, 0.0861, 0.0915],
+    [-0.0236, -0.0185, -0.0259],
+    [-0.0245, 0.0250, 0.1180],
+    [0.1008, 0.0755, -0.0421],
+    [-0.0515, 0.0201, 0.0011],
+    [0.0428, -0.0012, -0.0036],
+    [0.0817, 0.0765, 0.0749],
+    [-0.1264, -0.0522, -0.1103],
+    [-0.0280, -0.0881, -0.0499],
+    [-0.1262, -0.0982, -0.0778]
+])
+FLUX_LATENT_RGB_BIAS = torch.tensor([-0.0329, -0.0718, -0.0851])
+
+# كل موضع في latents Flux المعبأة يغطي 16×16 بكسل: ضغط VAE 8× ثم رقعة 2×2
+FLUX_PATCH_PIXELS = 16
+
+
+def latent_preview(latents: torch.Tensor, image_size: Tuple[int, int]) -> Optional[np.ndarray]:
+    """معاينات RGB (صورة لكل عنصر في الدفعة) بدقة 1/16 من latents معبأة - None إذا لم يتطابق الشكل"""
+    width, height = image_size
+    rows, cols = height // FLUX_PATCH_PIXELS, width // FLUX_PATCH_PIXELS
+    channels = FLUX_LATENT_RGB_FACTORS.shape[0]
+    if latents.ndim != 3 or latents.shape[1] != rows * cols or latents.shape[2] != channels * 4:
+        return None
+
+    # متوسط رقعة 2×2 لكل قناة ثم الإسقاط إلى RGB
+    grid = latents.reshape(latents.shape[0], rows, cols, channels, 4).mean(dim=-1).float()
+    rgb = grid @ FLUX_LATENT_RGB_FACTORS.to(grid.device) + FLUX_LATENT_RGB_BIAS.to(grid.device)
+    return ((rgb.clamp(-1, 1) + 1) * 127.5).to(torch.uint8).cpu().numpy()
+
+
+def encode_preview(pixels: np.ndarray) -> str:
+    """ترميز المعاينة كـ data URL بصيغة JPEG"""
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=70)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def format_sse(event: str, data: Any) -> str:
+    """رسالة Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class TaskProgress:
+    """آخر حالة لتقدم مهمة - يكتبها خيط الاستدلال دون انتظار ويقرؤها المشتركون من حلقة الأحداث"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed = asyncio.Event()
+        self._notify_pending = False
+        self.state: Dict[str, Any] = {"status": "pending"}
+        self.version = 0
+        self.preview: Optional[Tuple[int, np.ndarray]] = None
+        self.preview_version = 0
+        self.preview_subscribers = 0
+
+    def bind(self):
+        """ربط الحالة بحلقة الأحداث الحالية حتى تصل التحديثات من الخيوط الأخرى"""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+
+    @property
+    def wants_previews(self) -> bool:
+        """هل يوجد مشترك طلب المعاينات"""
+        return self.preview_subscribers > 0
+
+    @property
+    def finished(self) -> bool:
+        """هل انتهت المهمة"""
+        return bool(self.state.get("finished"))
+
+    def update(self, **fields):
+        """دمج حقول في الحالة - التحديثات المتتالية قبل أن يقرأها المشتركون تُدمج في تنبيه واحد"""
+        with self._lock:
+            self.state = {**self.state, **fields}
+            self.version += 1
+            self._schedule_notify()
+
+    def set_preview(self, step: int, pixels: np.ndarray):
+        """استبدال آخر معاينة"""
+        with self._lock:
+            self.preview = (step, pixels)
+            self.preview_version += 1
+            self._schedule_notify()
+
+    def finish(self, status: str):
+        """إعلان انتهاء المهمة للمشتركين"""
+        self.update(status=status, finished=True)
+
+    def _schedule_notify(self):
+        """جدولة تنبيه واحد على حلقة الأحداث - يُستدعى والقفل محجوز"""
+        if self._notify_pending or self._loop is None:
+            return
+        self._notify_pending = True
+        try:
+            self._loop.call_soon_threadsafe(self._notify)
+        except RuntimeError:
+            # الحلقة مغلقة (إيقاف الخدمة)
+            self._notify_pending = False
+
+    def _notify(self):
+        """إيقاظ كل المشتركين الحاليين - على حلقة الأحداث"""
+        with self._lock:
+            self._notify_pending = False
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def events(
+        self,
+        previews: bool = False,
+        keepalive: float = KEEPALIVE_SECONDS
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """أحداث التقدم حتى انتهاء المهمة - المشترك البطيء يرى آخر حالة فقط"""
+        self.bind()
+        if previews:
+            self.preview_subscribers += 1
+
+        seen, seen_preview = -1, 0
+        try:
+            while True:
+                changed = self._changed
+                with self._lock:
+                    version, state = self.version, self.state
+                    preview_version, preview = self.preview_version, self.preview
+
+                if version != seen:
+                    seen = version
+                    yield "progress", state
+                if previews and preview and preview_version != seen_preview:
+                    seen_preview = preview_version
+                    yield "preview", {"step": preview[0], "image": encode_preview(preview[1])}
+                if state.get("finished"):
+                    return
+
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield "ping", {}
+        finally:
+            if previews:
+                self.preview_subscribers -= 1
+
+
+class StepReporter:
+    """callback_on_step_end للـ pipeline: ينشر الخطوة والوقت المتبقي ومعاينة كل preview_interval خطوة"""
+
+    def __init__(
+        self,
+        progresses: List[Optional[TaskProgress]],
+        total_steps: int,
+        image_size: Tuple[int, int],
+        preview_interval: int = 0,
+        clock: Callable[[], float] = time.perf_counter
+    ):
+        self.progresses = progresses
+        self.total_steps = total_steps
+        self.image_size = image_size
+        self.preview_interval = preview_interval
+        self._clock = clock
+        self.started = clock()
+
+    def __call__(self, pipeline, step: int, timestep, callback_kwargs: dict) -> dict:
+        done = step + 1
+        total = getattr(pipeline, "num_timesteps", None) or self.total_steps
+        elapsed = self._clock() - self.started
+        eta = elapsed / done * max(0, total - done)
+
+        for progress in self.progresses:
+            if progress:
+                progress.update(step=done, total_steps=total, eta=round(eta, 2))
+
+        if self.preview_interval and (done % self.preview_interval == 0 or done == total):
+            self._publish_previews(done, callback_kwargs.get("latents"))
+
+        return callback_kwargs
+
+    def _publish_previews(self, step: int, latents: Optional[torch.Tensor]):
+        """حساب المعاينات فقط إذا طلبها مشترك"""
+        wanted = [(index, progress) for index, progress in enumerate(self.progresses)
+                  if progress and progress.wants_previews]
+        if not wanted or latents is None:
+            return
+
+        pixels = latent_preview(latents, self.image_size)
+        if pixels is None:
+            return
+        for index, progress in wanted:
+            progress.set_preview(step, pixels[index])
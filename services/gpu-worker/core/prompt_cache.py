@@ -0,0 +1,63 @@
+"""
+ذاكرة تضمينات النصوص - تجنب تشغيل CLIP و T5 لنفس الـ prompt في كل طلب
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Tuple
+import torch
+from loguru import logger
+
+from .monitoring import record_cache_request
+
+
+Embeddings = Tuple[torch.Tensor, torch.Tensor]
+
+
+class PromptEmbeddingCache:
+    """ذاكرة LRU محدودة لتضمينات الـ prompt، مفتاحها النص وهوية الموديل/LoRA"""
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Embeddings]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """هل الذاكرة مفعلة"""
+        return self.max_entries > 0
+
+    def get_or_encode(self, key: Hashable, encode: Callable[[], Embeddings]) -> Embeddings:
+        """إرجاع التضمينات المخزنة أو حسابها وتخزينها (على CPU)"""
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+
+        if cached is not None:
+            record_cache_request("prompt", hit=True)
+            return cached
+
+        record_cache_request("prompt", hit=False)
+        prompt_embeds, pooled_prompt_embeds = encode()
+        cached = (prompt_embeds.detach().to("cpu"), pooled_prompt_embeds.detach().to("cpu"))
+
+        with self._lock:
+            self._entries[key] = cached
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                logger.debug(f"🗑️ إخلاء تضمينات prompt: {evicted}")
+
+        return cached
+
+    def clear(self):
+        """مسح الذاكرة (عند تغيير الموديل أو LoRA)"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        """إحصائيات الذاكرة"""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries
+        }
@@ -0,0 +1,31 @@
+"""
+مستويات الجودة - جدول يربط كل مستوى بالخطوات والقوة وحد الدقة والترميز
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+from .config import get_tier_config
+
+
+@dataclass(frozen=True)
+class QualityProfile:
+    """معاملات مستوى جودة - None يعني القيمة الافتراضية للخدمة"""
+    name: str
+    num_inference_steps: Optional[int]
+    strength: Optional[float]
+    max_image_size: int
+    output_format: Optional[str]
+    # الصور الأكبر من max_image_size تُعالج بالبلاطات بدلاً من تصغيرها
+    tiling: bool
+    retain_input: bool
+
+
+def get_tier(name: Optional[str] = None, config: Optional[dict] = None) -> QualityProfile:
+    """الحصول على مستوى جودة بالاسم (أو الافتراضي للنشر)"""
+    config = config or get_tier_config()
+    name = getattr(name, "value", name) or config["default_tier"]
+
+    if name not in config["tiers"]:
+        raise ValueError(f"مستوى جودة غير معروف: {name}")
+    return QualityProfile(name=name, **config["tiers"][name])
@@ -0,0 +1,176 @@
+"""
+ذاكرة النتائج - إعادة استخدام النتائج لنفس الصورة ونفس معاملات التوليد
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+from loguru import logger
+
+from .config import get_file_config
+from .models import UpscaleResponse
+from .monitoring import record_cache_request
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path: str) -> str:
+    """بصمة SHA-256 لمحتوى الملف"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(source: Path, destination: Path):
+    """ربط صلب للملف إن أمكن وإلا نسخه"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class ResultCache:
+    """ذاكرة نتائج معنونة بالمحتوى على القرص مع إخلاء LRU ضمن ميزانية حجم"""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        config = get_file_config()
+        self.cache_dir = Path(cache_dir or config["result_cache_dir"])
+        self.max_bytes = max_bytes if max_bytes is not None else config["result_cache_max_bytes"]
+
+        # key -> (اسم ملف النتيجة، الحجم بالبايت)، الأقدم استخداماً أولاً
+        self._index: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+
+        logger.info(
+            f"🗃️ تم تهيئة ذاكرة النتائج: {len(self._index)} عنصر، "
+            f"{self.total_bytes / (1024 * 1024):.1f}MB من {self.max_bytes / (1024 * 1024):.0f}MB"
+        )
+
+    @staticmethod
+    def make_key(content_hash: str, params: dict) -> str:
+        """مفتاح الذاكرة: بصمة المحتوى مع كل معاملات التوليد"""
+        payload = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(f"{content_hash}:{payload}".encode()).hexdigest()
+
+    def get(self, key: str, destination: Path) -> Optional[UpscaleResponse]:
+        """البحث عن نتيجة ونسخها إلى destination عند الإصابة"""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None:
+                self._index.move_to_end(key)
+
+        if entry is None:
+            record_cache_request("result", hit=False)
+            return None
+
+        output_file = self.cache_dir / entry[0]
+        try:
+            response = UpscaleResponse.model_validate_json(self._meta_path(key).read_text())
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            link_or_copy(output_file, destination)
+            # آخر استخدام يُسجل على ملف metadata الخاص بالذاكرة - ملف النتيجة قد يكون مربوطاً
+            # بنسخة في مجلد النتائج، وتحديث وقته يغير عمر تلك النسخة عند الإخلاء بالعمر
+            os.utime(self._meta_path(key))
+        except (OSError, ValueError) as e:
+            logger.warning(f"عنصر تالف في ذاكرة النتائج {key}: {e}")
+            self._remove(key)
+            record_cache_request("result", hit=False)
+            return None
+
+        record_cache_request("result", hit=True)
+        return response
+
+    def put(self, key: str, response: UpscaleResponse):
+        """تخزين نتيجة مكتملة"""
+        if not response.output_path or key in self._index:
+            return
+
+        source = Path(response.output_path)
+        output_name = f"{key}{source.suffix}"
+        output_file = self.cache_dir / output_name
+
+        try:
+            link_or_copy(source, output_file)
+            self._meta_path(key).write_text(response.model_dump_json())
+            size = output_file.stat().st_size
+        except OSError as e:
+            logger.warning(f"تعذر تخزين النتيجة في الذاكرة: {e}")
+            return
+
+        with self._lock:
+            self._index[key] = (output_name, size)
+            self.total_bytes += size
+
+        self._evict()
+
+    def get_stats(self) -> dict:
+        """إحصائيات الذاكرة"""
+        return {
+            "entries": len(self._index),
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes
+        }
+
+    def _evict(self):
+        """إخلاء الأقدم استخداماً حتى العودة ضمن الميزانية"""
+        while True:
+            with self._lock:
+                if self.total_bytes <= self.max_bytes or not self._index:
+                    return
+                key = next(iter(self._index))
+            self._remove(key)
+            logger.debug(f"🗑️ إخلاء من ذاكرة النتائج: {key}")
+
+    def _remove(self, key: str):
+        """حذف عنصر من الفهرس والقرص"""
+        with self._lock:
+            entry = self._index.pop(key, None)
+            if entry is None:
+                return
+            self.total_bytes -= entry[1]
+
+        for path in (self.cache_dir / entry[0], self._meta_path(key)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _meta_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def _load_index(self):
+        """بناء الفهرس من القرص مرة واحدة عند التشغيل، مرتباً بآخر استخدام"""
+        # قراءة المجلد مرة واحدة وتجميع الملفات حسب المفتاح
+        metas = {}
+        outputs = {}
+        for path in self.cache_dir.iterdir():
+            if path.suffix == ".json":
+                metas[path.stem] = path
+            else:
+                outputs.setdefault(path.stem, path)
+
+        entries = []
+        for key, meta in metas.items():
+            output = outputs.get(key)
+            if output is None:
+                meta.unlink()
+                continue
+            entries.append((meta.stat().st_mtime, key, output.name, output.stat().st_size))
+
+        for _, key, output_name, size in sorted(entries):
+            self._index[key] = (output_name, size)
+            self.total_bytes += size
+
+        self._evict()
@@ -0,0 +1,171 @@
+"""
+لقطة الموديل المدمجة - تجهيز Flux + LoRA مرة واحدة ثم التحميل منها مباشرة عند الإقلاع
+
+الاستخدام:
+    python -m core.snapshot bake [--output PATH] [--model NAME] [--lora PATH] [--dtype bfloat16]
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import importlib
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+import torch
+from loguru import logger
+
+from .config import get_model_config
+
+
+MANIFEST_NAME = "snapshot.json"
+MODEL_INDEX_NAME = "model_index.json"
+
+
+def resolve_dtype(name: str) -> torch.dtype:
+    """تحويل اسم النوع إلى torch.dtype"""
+    dtype = getattr(torch, name, None)
+    if not isinstance(dtype, torch.dtype):
+        raise ValueError(f"نوع بيانات غير معروف: {name}")
+    return dtype
+
+
+def read_manifest(snapshot_path: str) -> Optional[dict]:
+    """قراءة بيان اللقطة إن وجد"""
+    path = os.path.join(snapshot_path, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ بيان لقطة تالف في {path}: {e}")
+        return None
+
+
+def find_snapshot(config: Optional[dict] = None) -> Optional[dict]:
+    """بيان اللقطة إذا كانت مطابقة للموديل و LoRA ونوع البيانات المطلوبة"""
+    config = config or get_model_config()
+    manifest = read_manifest(config["snapshot_path"])
+    if manifest is None:
+        return None
+
+    expected = {"model": config["flux_model"], "lora": config["lora_path"], "dtype": config["dtype"]}
+    mismatched = [key for key, value in expected.items() if manifest.get(key) != value]
+    if mismatched:
+        logger.warning(f"⚠️ اللقطة في {config['snapshot_path']} لا تطابق الإعدادات ({', '.join(mismatched)}) - سيتم تجاهلها")
+        return None
+
+    return manifest
+
+
+def write_snapshot(pipeline, output_dir: str, manifest: dict) -> dict:
+    """حفظ الـ pipeline كـ safetensors مع البيان - الكتابة في مجلد مؤقت ثم استبداله دفعة واحدة"""
+    staging_dir = f"{output_dir.rstrip(os.sep)}.tmp"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    pipeline.save_pretrained(staging_dir, safe_serialization=True)
+
+    manifest = {**manifest, "created_at": datetime.now().isoformat()}
+    with open(os.path.join(staging_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(staging_dir, output_dir)
+    return manifest
+
+
+def bake(
+    output_dir: Optional[str] = None,
+    model_name: Optional[str] = None,
+    lora_path: Optional[str] = None,
+    dtype: Optional[str] = None
+) -> dict:
+    """تحميل Flux ودمج LoRA في أوزان الـ transformer ثم حفظ لقطة جاهزة للإقلاع السريع"""
+    from diffusers import FluxPipeline
+
+    config = get_model_config()
+    output_dir = output_dir or config["snapshot_path"]
+    model_name = model_name or config["flux_model"]
+    lora_path = lora_path or config["lora_path"]
+    dtype = dtype or config["dtype"]
+
+    start_time = time.perf_counter()
+    logger.info(f"📥 تحميل {model_name} ({dtype})...")
+    pipeline = FluxPipeline.from_pretrained(model_name, torch_dtype=resolve_dtype(dtype))
+
+    lora_fused = os.path.exists(lora_path)
+    if lora_fused:
+        logger.info(f"🔗 دمج LoRA من: {lora_path}")
+        pipeline.load_lora_weights(lora_path)
+        pipeline.fuse_lora()
+        pipeline.unload_lora_weights()
+    else:
+        logger.warning(f"LoRA غير موجود في: {lora_path} - سيتم حفظ الموديل الأساسي فقط")
+
+    manifest = write_snapshot(pipeline, output_dir, {
+        "model": model_name,
+        "lora": lora_path,
+        "lora_fused": lora_fused,
+        "dtype": dtype
+    })
+
+    logger.success(f"✅ تم حفظ اللقطة في {output_dir} خلال {time.perf_counter() - start_time:.1f} ثانية")
+    return manifest
+
+
+def load_components(snapshot_path: str, dtype: torch.dtype) -> Tuple[dict, Dict[str, float]]:
+    """تحميل مكونات اللقطة واحداً تلو الآخر مع قياس وقت كل مكون
+
+    أوزان safetensors تُقرأ عبر memory-map مع low_cpu_mem_usage، فلا تُنسخ
+    إلى الذاكرة قبل نقلها إلى الجهاز.
+    """
+    with open(os.path.join(snapshot_path, MODEL_INDEX_NAME)) as f:
+        model_index = json.load(f)
+
+    components = {}
+    breakdown = {}
+    for name, spec in model_index.items():
+        if name.startswith("_") or not isinstance(spec, list) or spec[0] is None:
+            continue
+
+        library, class_name = spec
+        component_cls = getattr(importlib.import_module(library), class_name)
+        component_path = os.path.join(snapshot_path, name)
+
+        start_time = time.perf_counter()
+        if issubclass(component_cls, torch.nn.Module):
+            components[name] = component_cls.from_pretrained(
+                component_path,
+                torch_dtype=dtype,
+                use_safetensors=True,
+                low_cpu_mem_usage=True
+            )
+        else:
+            # tokenizers و schedulers
+            components[name] = component_cls.from_pretrained(component_path)
+        breakdown[name] = round(time.perf_counter() - start_time, 3)
+
+    return components, breakdown
+
+
+def main():
+    """نقطة الدخول لسطر الأوامر"""
+    parser = argparse.ArgumentParser(description="Flux model snapshot tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bake_parser = subparsers.add_parser("bake", help="Fuse the LoRA and write a safetensors snapshot")
+    bake_parser.add_argument("--output", help="Snapshot directory (default: MODEL_SNAPSHOT_PATH)")
+    bake_parser.add_argument("--model", help="Base model (default: FLUX_MODEL_NAME)")
+    bake_parser.add_argument("--lora", help="LoRA weights (default: LORA_MODEL_PATH)")
+    bake_parser.add_argument("--dtype", help="Weights dtype (default: MODEL_DTYPE)")
+
+    args = parser.parse_args()
+    if args.command == "bake":
+        bake(output_dir=args.output, model_name=args.model, lora_path=args.lora, dtype=args.dtype)
+
+
+if __name__ == "__main__":
+    main()
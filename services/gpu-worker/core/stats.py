@@ -0,0 +1,196 @@
+"""
+إحصائيات متدفقة بذاكرة ثابتة - نسب مئوية تقريبية وعدادات بنوافذ زمنية
+"""
+
+import math
+import time
+from datetime import date
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+class QuantileSketch:
+    """مدرج لوغاريتمي بعدد خانات ثابت: التسجيل O(1) والخطأ النسبي للنسب المئوية محدود بـ relative_accuracy"""
+
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 1e-4, max_value: float = 1e4):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self.max_value = max_value
+        self.offset = self._raw_index(min_value)
+        self.buckets = [0] * (self._raw_index(max_value) - self.offset + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _raw_index(self, value: float) -> int:
+        """رقم الخانة اللوغاريتمية للقيمة"""
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def add(self, value: float):
+        """تسجيل قيمة"""
+        clamped = min(max(value, self.min_value), self.max_value)
+        self.buckets[self._raw_index(clamped) - self.offset] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "QuantileSketch"):
+        """دمج مدرج آخر بالإعدادات نفسها"""
+        for index, count in enumerate(other.buckets):
+            if count:
+                self.buckets[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def clear(self):
+        """تصفير المدرج"""
+        self.buckets = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def quantile(self, q: float) -> float:
+        """القيمة التقريبية عند النسبة q (بين 0 و 1)"""
+        if not self.count:
+            return 0.0
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen > rank:
+                # منتصف الخانة بالمعنى النسبي
+                value = 2 * self.gamma ** (index + self.offset) / (1 + self.gamma)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        """المتوسط الدقيق"""
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self, quantiles: Iterable[float] = (0.5, 0.9, 0.99)) -> Dict[str, float]:
+        """العدد والمتوسط والنسب المئوية"""
+        result = {
+            "count": self.count,
+            "mean": round(self.mean, 4),
+            "min": round(self.min, 4) if self.count else 0.0,
+            "max": round(self.max, 4)
+        }
+        for q in quantiles:
+            result[f"p{round(q * 100):g}"] = round(self.quantile(q), 4)
+        return result
+
+
+class RollingQuantileSketch:
+    """نسب مئوية لآخر نافذة زمنية: مدرجان يتناوبان كل window_seconds"""
+
+    def __init__(self, window_seconds: float = 300, clock: Callable[[], float] = time.monotonic, **sketch_args):
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self.current = QuantileSketch(**sketch_args)
+        self.previous = QuantileSketch(**sketch_args)
+        self.window_start = clock()
+
+    def _rotate(self):
+        """بدء نافذة جديدة عند انتهاء الحالية"""
+        now = self.clock()
+        elapsed = now - self.window_start
+        if elapsed < self.window_seconds:
+            return
+
+        if elapsed < 2 * self.window_seconds:
+            self.previous, self.current = self.current, self.previous
+            self.window_start += self.window_seconds
+        else:
+            # لا تسجيل خلال نافذتين كاملتين
+            self.previous.clear()
+            self.window_start = now
+        self.current.clear()
+
+    def add(self, value: float):
+        """تسجيل قيمة"""
+        self._rotate()
+        self.current.add(value)
+
+    def snapshot(self) -> QuantileSketch:
+        """مدرج يغطي بين نافذة ونافذتين من آخر القيم"""
+        self._rotate()
+        merged = QuantileSketch(
+            relative_accuracy=self.current.relative_accuracy,
+            min_value=self.current.min_value,
+            max_value=self.current.max_value
+        )
+        merged.merge(self.previous)
+        merged.merge(self.current)
+        return merged
+
+
+class WindowedCounter:
+    """عدادات في حلقة خانات زمنية ثابتة - التسجيل O(1) والمجموع على آخر N ثانية"""
+
+    def __init__(self, bucket_seconds: float = 60, buckets: int = 60, clock: Callable[[], float] = time.time):
+        self.bucket_seconds = bucket_seconds
+        self.clock = clock
+        self.counts: List[int] = [0] * buckets
+        self.epochs: List[int] = [-1] * buckets
+
+    def add(self, amount: int = 1):
+        """إضافة إلى الخانة الحالية"""
+        epoch = int(self.clock() // self.bucket_seconds)
+        index = epoch % len(self.counts)
+        if self.epochs[index] != epoch:
+            self.epochs[index] = epoch
+            self.counts[index] = 0
+        self.counts[index] += amount
+
+    def total(self, seconds: Optional[float] = None) -> int:
+        """المجموع على آخر seconds ثانية (أو كل الحلقة)"""
+        current = int(self.clock() // self.bucket_seconds)
+        span = len(self.counts) if seconds is None else max(1, math.ceil(seconds / self.bucket_seconds))
+        span = min(span, len(self.counts))
+        return sum(
+            count for epoch, count in zip(self.epochs, self.counts)
+            if current - span < epoch <= current
+        )
+
+    @property
+    def window_seconds(self) -> float:
+        """المدة التي تغطيها الحلقة"""
+        return self.bucket_seconds * len(self.counts)
+
+
+class DailyCounter:
+    """عداد يبدأ من الصفر كل يوم (بالتوقيت المحلي)"""
+
+    def __init__(self, today: Callable[[], date] = date.today):
+        self.today = today
+        self.day = today()
+        self.count = 0
+
+    def add(self, amount: int = 1):
+        """إضافة إلى عداد اليوم"""
+        self._roll()
+        self.count += amount
+
+    def value(self) -> int:
+        """عدد اليوم"""
+        self._roll()
+        return self.count
+
+    def _roll(self):
+        """تصفير العداد عند تغير اليوم"""
+        day = self.today()
+        if day != self.day:
+            self.day = day
+            self.count = 0
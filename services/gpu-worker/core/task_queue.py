@@ -0,0 +1,349 @@
+"""
+طابور المهام - معالجة الصور في الخلفية بدلاً من إبقاء اتصال HTTP مفتوحاً
+"""
+
+import os
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+from loguru import logger
+
+from .config import get_queue_config
+from .models import UpscaleResponse, ProcessingStatus
+from .image_context import ImageContext
+from .cancellation import CancellationToken, JobCancelled
+from .progress import TaskProgress
+from .quality import get_tier
+from .monitoring import record_job_cancelled
+
+
+class QueueFullError(Exception):
+    """الطابور ممتلئ"""
+
+
+@dataclass
+class QueuedJob:
+    """مهمة في الطابور"""
+    task_id: str
+    image: Union[str, ImageContext]
+    prompt: str
+    params: Dict[str, Any] = field(default_factory=dict)
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    token: CancellationToken = field(default_factory=CancellationToken)
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+    progress: TaskProgress = field(default_factory=TaskProgress)
+    # سحبها عامل من الطابور - الإلغاء بعدها لا يحرر مكاناً
+    dequeued: bool = False
+    # مهمة معاينة: يُحتفظ بالإدخال لطلب لاحق بجودة أعلى
+    retain_input: bool = False
+    # False إذا كان الإدخال ملك مهمة معاينة سابقة فلا يُحذف بعد المعالجة
+    owns_input: bool = True
+
+    @property
+    def input_path(self) -> str:
+        """مسار ملف الإدخال"""
+        return self.image.path if isinstance(self.image, ImageContext) else self.image
+
+
+class TaskQueue:
+    """طابور مهام داخل العملية مع حلقات عمل تستهلكه عبر FluxUpscaler"""
+
+    def __init__(self, upscaler, file_handler=None, config: Optional[dict] = None):
+        self.upscaler = upscaler
+        self.file_handler = file_handler
+        self.config = config or get_queue_config()
+
+        # السعة يحكمها has_capacity لأن المهام الملغاة تبقى في asyncio.Queue حتى يسحبها عامل
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: "OrderedDict[str, UpscaleResponse]" = OrderedDict()
+        # المهام المنتظرة والجارية - يمكن إلغاؤها
+        self._jobs: Dict[str, QueuedJob] = {}
+        # مهام أُلغيت وهي تنتظر - ما زالت في asyncio.Queue لكنها لا تشغل مكاناً
+        self._withdrawn: Set[str] = set()
+        # مدخلات مهام المعاينة المنتهية (السياق والبذرة) - تُنسى مع سجل المهمة والمنظف يحذف ملفاتها
+        self._inputs: Dict[str, Tuple[ImageContext, Optional[int]]] = {}
+        # عدد المهام المنتظرة أو الجارية على كل إدخال محتفظ به - محمي من المنظف ما دام أكبر من صفر
+        self._holds: Dict[str, int] = {}
+        self._workers: List[asyncio.Task] = []
+        # أماكن محجوزة لعناصر تُعالج خارج الطابور (الطلبات الدفعية) - تُحسب ضمن max_queue_size
+        self._reserved = 0
+        self._capacity = asyncio.Condition()
+
+        logger.info(f"📋 تم إنشاء طابور المهام (الحد الأقصى: {self.config['max_queue_size']})")
+
+    def start(self):
+        """تشغيل حلقات العمل"""
+        if self._workers:
+            return
+
+        # عمال لكل نسخة GPU حتى تبقى كل الأجهزة مشغولة
+        replicas = getattr(self.upscaler, "replica_count", 1)
+        for i in range(max(1, self.config["num_workers"]) * replicas):
+            self._workers.append(asyncio.create_task(self._worker_loop(i)))
+
+        logger.info(f"▶️ تم تشغيل {len(self._workers)} عامل للطابور")
+
+    async def stop(self):
+        """إيقاف حلقات العمل"""
+        for worker in self._workers:
+            worker.cancel()
+
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("⏹️ تم إيقاف عمال الطابور")
+
+    def submit(
+        self,
+        image: Union[str, ImageContext],
+        prompt: str,
+        owns_input: bool = True,
+        **params
+    ) -> UpscaleResponse:
+        """إضافة مهمة إلى الطابور وإرجاع حالتها فوراً"""
+        task_id = str(uuid.uuid4())
+        if not self.has_capacity():
+            raise QueueFullError(f"الطابور ممتلئ: {self.qsize()} مهمة")
+
+        job = QueuedJob(
+            task_id=task_id,
+            image=image,
+            prompt=prompt,
+            params=params,
+            retain_input=get_tier(params.get("quality_tier")).retain_input,
+            owns_input=owns_input
+        )
+
+        self._queue.put_nowait(job)
+
+        response = UpscaleResponse(task_id=task_id, status=ProcessingStatus.PENDING)
+        self._tasks[task_id] = response
+        self._jobs[task_id] = job
+        self._prune_history()
+
+        logger.info(f"📥 تمت إضافة المهمة {task_id} إلى الطابور (الحجم: {self.qsize()})")
+        return response
+
+    def resubmit(self, source_task_id: str, prompt: str, **params) -> Optional[UpscaleResponse]:
+        """مهمة جديدة على إدخال مهمة معاينة سابقة - دون رفع أو بصمة جديدة، وبالبذرة نفسها حتى تطابق المعاينة"""
+        source = self._inputs.get(source_task_id)
+        if source is None or not os.path.exists(source[0].path):
+            self._inputs.pop(source_task_id, None)
+            return None
+
+        context, seed = source
+        if params.get("seed") is None:
+            params["seed"] = seed
+        image = ImageContext(context.path, content_hash=context.content_hash, file_size=context.file_size)
+        response = self.submit(image, prompt, owns_input=False, **params)
+
+        # لا يحذفه المنظف أثناء انتظار المهمة أو فك ترميزه
+        self._holds[context.path] = self._holds.get(context.path, 0) + 1
+        if self.file_handler:
+            self.file_handler.storage.pin(context.path)
+        return response
+
+    def has_capacity(self) -> bool:
+        """هل يوجد مكان لمهمة جديدة"""
+        return self.qsize() < self.config["max_queue_size"]
+
+    async def reserve(self):
+        """انتظار مكان في الطابور لعنصر يُعالج خارجه حتى لا يتجاوز الحمل الكلي max_queue_size"""
+        async with self._capacity:
+            await self._capacity.wait_for(self.has_capacity)
+            self._reserved += 1
+
+    async def release(self):
+        """تحرير مكان محجوز بعد انتهاء العنصر"""
+        self._reserved = max(0, self._reserved - 1)
+        await self._notify_capacity()
+
+    async def _notify_capacity(self):
+        """إيقاظ من ينتظر مكاناً في الطابور"""
+        async with self._capacity:
+            self._capacity.notify_all()
+
+    def get(self, task_id: str) -> Optional[UpscaleResponse]:
+        """حالة مهمة واحدة"""
+        return self._tasks.get(task_id)
+
+    def cancel(self, task_id: str, reason: str = "cancelled") -> Optional[UpscaleResponse]:
+        """إلغاء مهمة منتظرة أو جارية - الجارية تتوقف عند خطوة الاستدلال التالية"""
+        job = self._jobs.get(task_id)
+        if job is None:
+            return self._tasks.get(task_id)
+
+        job.token.cancel(reason)
+        if self._tasks[task_id].status == ProcessingStatus.PENDING:
+            self._update(task_id, status=ProcessingStatus.CANCELLED, completed_at=datetime.now(),
+                         error_message=str(JobCancelled(reason)))
+            job.progress.finish(ProcessingStatus.CANCELLED.value)
+            if not job.dequeued:
+                self._withdraw(task_id)
+
+        logger.info(f"⏹️ طلب إلغاء المهمة {task_id} ({reason})")
+        return self._tasks[task_id]
+
+    def _withdraw(self, task_id: str):
+        """تحرير مكان مهمة ملغاة ما زالت في الطابور - العامل يتخطاها عند سحبها"""
+        self._withdrawn.add(task_id)
+        try:
+            asyncio.get_running_loop().create_task(self._notify_capacity())
+        except RuntimeError:
+            pass
+
+    def progress(self, task_id: str) -> Optional[TaskProgress]:
+        """تقدم مهمة منتظرة أو جارية"""
+        job = self._jobs.get(task_id)
+        return job.progress if job else None
+
+    async def wait(self, task_id: str) -> Optional[UpscaleResponse]:
+        """انتظار انتهاء مهمة"""
+        job = self._jobs.get(task_id)
+        if job:
+            await job.done.wait()
+        return self._tasks.get(task_id)
+
+    def list(self, status: Optional[ProcessingStatus] = None, limit: int = 100) -> List[UpscaleResponse]:
+        """قائمة المهام من الأحدث إلى الأقدم"""
+        tasks = []
+        for response in reversed(self._tasks.values()):
+            if status is None or response.status == status:
+                tasks.append(response)
+                if len(tasks) >= limit:
+                    break
+        return tasks
+
+    def qsize(self) -> int:
+        """عدد المهام المنتظرة (دون الملغاة) مع الأماكن المحجوزة للطلبات الدفعية"""
+        return self._queue.qsize() - len(self._withdrawn) + self._reserved
+
+    def get_stats(self) -> dict:
+        """إحصائيات الطابور"""
+        counts = {status.value: 0 for status in ProcessingStatus}
+        for response in self._tasks.values():
+            counts[response.status.value] += 1
+
+        return {
+            "queue_size": self.qsize(),
+            "max_queue_size": self.config["max_queue_size"],
+            "reserved": self._reserved,
+            "workers": len(self._workers),
+            "tasks": counts,
+            "retained_inputs": len(self._inputs)
+        }
+
+    async def _worker_loop(self, worker_id: int):
+        """حلقة عمل تستهلك المهام من الطابور"""
+        while True:
+            job = await self._queue.get()
+            job.dequeued = True
+            self._withdrawn.discard(job.task_id)
+            await self._notify_capacity()
+            try:
+                await self._process(job)
+            except Exception as e:
+                logger.error(f"❌ خطأ غير متوقع في العامل {worker_id}: {e}")
+            finally:
+                task = self._tasks.get(job.task_id)
+                job.progress.finish(task.status.value if task else ProcessingStatus.FAILED.value)
+                self._jobs.pop(job.task_id, None)
+                job.done.set()
+                self._queue.task_done()
+
+    async def _process(self, job: QueuedJob):
+        """معالجة مهمة واحدة"""
+        # زمن الانتظار في الطابور كمرحلة من مراحل الطلب
+        stage_timer = job.params.get("stage_timer")
+        if stage_timer:
+            stage_timer.record("queue", time.perf_counter() - job.enqueued_at)
+
+        job.progress.bind()
+        try:
+            # مهمة أُلغيت أثناء الانتظار لا تصل إلى GPU
+            job.token.check()
+            # المهلة تبدأ الآن - الانتظار في الطابور يحده MAX_QUEUE_SIZE لا PROCESSING_TIMEOUT
+            job.token.start(self.config.get("processing_timeout"))
+            self._update(job.task_id, status=ProcessingStatus.PROCESSING)
+            job.progress.update(status=ProcessingStatus.PROCESSING.value)
+
+            result = await self.upscaler.upscale_image(
+                job.image,
+                job.prompt,
+                task_id=job.task_id,
+                cancel_token=job.token,
+                progress=job.progress,
+                **job.params
+            )
+        except JobCancelled as e:
+            record_job_cancelled(e.reason)
+            logger.info(f"⏹️ تم تخطي المهمة {job.task_id} قبل بدئها: {e}")
+            result = self._tasks[job.task_id].model_copy(update={
+                "status": ProcessingStatus.CANCELLED,
+                "completed_at": self._tasks[job.task_id].completed_at or datetime.now(),
+                "error_message": str(e)
+            })
+        except Exception as e:
+            logger.error(f"❌ فشل في معالجة المهمة {job.task_id}: {e}")
+            result = self._tasks[job.task_id].model_copy(update={
+                "status": ProcessingStatus.FAILED,
+                "completed_at": datetime.now(),
+                "error_message": str(e)
+            })
+        else:
+            update = {
+                "created_at": self._tasks[job.task_id].created_at,
+                "completed_at": result.completed_at or datetime.now()
+            }
+            if self.file_handler and result.output_path:
+                self.file_handler.track_file(result.output_path, result.file_size)
+                update["download_url"] = await self.file_handler.create_download_url(result.output_path)
+            result = result.model_copy(update=update)
+        finally:
+            await self._release_input(job)
+
+        self._tasks[job.task_id] = result
+
+    async def _release_input(self, job: QueuedJob):
+        """حذف ملف الإدخال - أو الاحتفاظ به إذا كانت المهمة معاينة"""
+        path = job.input_path
+        if not job.owns_input:
+            remaining = self._holds.get(path, 1) - 1
+            if remaining > 0:
+                self._holds[path] = remaining
+            else:
+                self._holds.pop(path, None)
+
+        if job.retain_input:
+            context = job.image if isinstance(job.image, ImageContext) else ImageContext(job.image)
+            self._inputs[job.task_id] = (context, job.params.get("seed"))
+        elif job.owns_input:
+            if self.file_handler:
+                await self.file_handler.cleanup_temp_files([path])
+            return
+
+        # لم يعد قيد الاستخدام: المنظف يحذفه بعد UPLOAD_MAX_AGE_HOURS إذا لم يُطلب
+        if self.file_handler and path not in self._holds:
+            self.file_handler.storage.unpin(path)
+
+    def _update(self, task_id: str, **fields):
+        """تحديث حقول مهمة"""
+        if task_id in self._tasks:
+            self._tasks[task_id] = self._tasks[task_id].model_copy(update=fields)
+
+    def _prune_history(self):
+        """حذف أقدم المهام المنتهية عند تجاوز حد السجل"""
+        history_size = self.config["history_size"]
+        if len(self._tasks) <= history_size:
+            return
+
+        finished = (ProcessingStatus.COMPLETED, ProcessingStatus.FAILED, ProcessingStatus.CANCELLED)
+        for task_id in list(self._tasks.keys()):
+            if len(self._tasks) <= history_size:
+                break
+            if self._tasks[task_id].status in finished and task_id not in self._jobs:
+                del self._tasks[task_id]
+                self._inputs.pop(task_id, None)
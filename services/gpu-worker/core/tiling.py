@@ -0,0 +1,128 @@
+"""
+المعالجة بالبلاطات - تقسيم الصور الكبيرة إلى بلاطات متداخلة ودمجها بدون حواف ظاهرة
+"""
+
+from typing import List, Tuple
+import numpy as np
+from PIL import Image
+
+
+Box = Tuple[int, int, int, int]
+
+
+def _axis_positions(length: int, tile: int, stride: int) -> List[int]:
+    """مواضع بداية البلاطات على محور واحد"""
+    if length <= tile:
+        return [0]
+
+    positions = list(range(0, length - tile, stride))
+    positions.append(length - tile)
+    return positions
+
+
+def plan_tiles(size: Tuple[int, int], tile_size: int, overlap: int) -> List[Box]:
+    """حساب مربعات البلاطات (left, top, right, bottom) التي تغطي الصورة كاملة"""
+    if overlap >= tile_size:
+        raise ValueError(f"التداخل ({overlap}) يجب أن يكون أصغر من حجم البلاطة ({tile_size})")
+
+    width, height = size
+    stride = tile_size - overlap
+    tile_w = min(tile_size, width)
+    tile_h = min(tile_size, height)
+
+    return [
+        (left, top, left + tile_w, top + tile_h)
+        for top in _axis_positions(height, tile_size, stride)
+        for left in _axis_positions(width, tile_size, stride)
+    ]
+
+
+def _ramp(length: int, overlap: int, fade_start: bool, fade_end: bool) -> np.ndarray:
+    """أوزان خطية على محور واحد تتلاشى داخل منطقة التداخل"""
+    weights = np.ones(length, dtype=np.float32)
+    fade = min(overlap, length // 2)
+    if fade <= 0:
+        return weights
+
+    ramp = (np.arange(fade, dtype=np.float32) + 1) / (fade + 1)
+    if fade_start:
+        weights[:fade] = ramp
+    if fade_end:
+        weights[-fade:] = ramp[::-1]
+    return weights
+
+
+class TileBlender:
+    """يجمع البلاطات المعالجة بأوزان متدرجة ثم يطبعها في صورة واحدة
+
+    البلاطات تصل صفاً بعد صف (ترتيب plan_tiles)، فالأسطر التي فوق أول بلاطة جديدة اكتملت:
+    تُطبع إلى الصورة النهائية (uint8) ولا يبقى بدقة float32 إلا شريط بارتفاع بلاطة تقريباً.
+    """
+
+    def __init__(self, size: Tuple[int, int], overlap: int, scale: float = 1.0):
+        self.scale = scale
+        self.overlap = int(round(overlap * scale))
+        self.size = (int(round(size[0] * scale)), int(round(size[1] * scale)))
+
+        width, height = self.size
+        self._output = np.zeros((height, width, 3), dtype=np.uint8)
+        # أول سطر في الصورة لم يُطبع بعد - يقابل السطر 0 في الشريط
+        self._band_top = 0
+        self._canvas = np.zeros((0, width, 3), dtype=np.float32)
+        self._weights = np.zeros((0, width, 1), dtype=np.float32)
+
+    def add(self, box: Box, tile: Image.Image):
+        """إضافة بلاطة معالجة في موضعها"""
+        left, top, right, bottom = (int(round(v * self.scale)) for v in box)
+        width, height = right - left, bottom - top
+
+        if top < self._band_top:
+            raise ValueError("البلاطات يجب أن تُضاف صفاً بعد صف بترتيب plan_tiles")
+        self._flush(top)
+        self._reserve(bottom)
+
+        if tile.size != (width, height):
+            tile = tile.resize((width, height), Image.Resampling.LANCZOS)
+
+        # لا تلاشي على حواف الصورة الخارجية
+        weight_x = _ramp(width, self.overlap, left > 0, right < self.size[0])
+        weight_y = _ramp(height, self.overlap, top > 0, bottom < self.size[1])
+        weight = (weight_y[:, None] * weight_x[None, :])[..., None]
+
+        pixels = np.asarray(tile.convert("RGB"), dtype=np.float32)
+        rows = slice(top - self._band_top, bottom - self._band_top)
+        self._canvas[rows, left:right] += pixels * weight
+        self._weights[rows, left:right] += weight
+
+    def _reserve(self, bottom: int):
+        """توسيع الشريط ليصل إلى السطر bottom"""
+        missing = bottom - self._band_top - len(self._canvas)
+        if missing <= 0:
+            return
+
+        width = self.size[0]
+        self._canvas = np.concatenate([self._canvas, np.zeros((missing, width, 3), dtype=np.float32)])
+        self._weights = np.concatenate([self._weights, np.zeros((missing, width, 1), dtype=np.float32)])
+
+    def _flush(self, until: int):
+        """طباعة الأسطر المكتملة قبل until وإزاحة الشريط"""
+        rows = min(until, self.size[1]) - self._band_top
+        if rows <= 0:
+            return
+
+        done = min(rows, len(self._canvas))
+        if done:
+            blended = self._canvas[:done] / np.maximum(self._weights[:done], 1e-6)
+            self._output[self._band_top:self._band_top + done] = np.clip(np.rint(blended), 0, 255)
+
+            # إعادة استخدام الذاكرة نفسها للأسطر القادمة
+            self._canvas[:-done] = self._canvas[done:].copy()
+            self._weights[:-done] = self._weights[done:].copy()
+            self._canvas[-done:] = 0
+            self._weights[-done:] = 0
+        self._band_top += rows
+
+    def result(self) -> Image.Image:
+        """الصورة النهائية بعد الدمج"""
+        self._flush(self.size[1])
+        return Image.fromarray(self._output, "RGB")
@@ -2,31 +2,84 @@
 Flux Upscaler - معالج رفع جودة الصور
 """
 
-import os
 import time
 import uuid
 import asyncio
-from typing import Optional, Tuple
+from datetime import datetime
+from typing import Dict, Optional, Tuple, Union
 from pathlib import Path
 import torch
 from PIL import Image
 from loguru import logger
 from diffusers import FluxPipeline
-from diffusers.utils import load_image
 
 from .config import settings, get_model_config, get_processing_config
-from .models import UpscaleResponse, ProcessingStatus
+from .models import UpscaleResponse, ProcessingStatus, ModelInfo
+from .inference_executor import InferenceExecutor
+from .batcher import MicroBatcher
+from .tiling import plan_tiles, TileBlender
+from .result_cache import ResultCache, hash_file
+from .prompt_cache import PromptEmbeddingCache
+from .image_context import ImageContext
+from .encoding import ImageEncoder, EncodingPreset, get_preset
+from .quality import QualityProfile, get_tier
+from .snapshot import find_snapshot, load_components, resolve_dtype
+from .adapters import AdapterManager
+from .memory_planner import MemoryPlanner, component_sizes
+from .cancellation import CancellationToken, JobCancelled, StepGuard
+from .progress import TaskProgress, StepReporter
+from .monitoring import (
+    StageTimer,
+    record_processing_time,
+    record_image_processed,
+    record_job_cancelled,
+    record_gpu_seconds_saved,
+    record_tier_latency
+)
+
+
+# المعاملات التي تختلف لكل صورة داخل الدفعة، أما البقية فمشتركة
+BATCHED_PARAMS = ("prompt", "negative_prompt", "image", "generator", "cancel_token", "progress")
+
+
+def first_set(*values):
+    """أول قيمة ليست None"""
+    return next((value for value in values if value is not None), None)
 
 
 class FluxUpscaler:
     """معالج رفع جودة الصور باستخدام Flux Dev + LoRA"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        result_cache: Optional[ResultCache] = None,
+        encoder: Optional[ImageEncoder] = None,
+        device: Optional[str] = None,
+        monitor=None
+    ):
         self.pipeline = None
+        self.monitor = monitor
+        self.result_cache = result_cache
+        self.encoder = encoder or ImageEncoder(workers=0)
         self.is_loaded = False
-        self.device = f"cuda:{settings.CUDA_DEVICE}"
+        self.snapshot: Optional[dict] = None
+        self.load_time: Optional[float] = None
+        self.load_time_breakdown: Dict[str, float] = {}
         self.model_config = get_model_config()
         self.processing_config = get_processing_config()
+        self.device = device or self.model_config["device"]
+        self.prompt_cache = PromptEmbeddingCache(self.processing_config["prompt_cache_size"])
+        self.adapters = AdapterManager(config=self.model_config)
+        self.memory_planner: Optional[MemoryPlanner] = None
+        self.executor = InferenceExecutor(
+            max_inflight=self.model_config["max_inflight_jobs"],
+            name=f"inference-{self.device}"
+        )
+        self.batcher = MicroBatcher(
+            self._run_batch,
+            max_batch_size=self.model_config["max_batch_size"],
+            window_ms=self.model_config["batch_window_ms"]
+        )
         
         # إحصائيات
         self.total_processed = 0
@@ -37,38 +90,62 @@ class FluxUpscaler:
         logger.info(f"🔧 تم إنشاء FluxUpscaler للجهاز: {self.device}")
     
     async def load_models(self) -> bool:
-        """تحميل الموديلات"""
+        """تحميل الموديلات - من اللقطة المدمجة إن وجدت، وإلا من المصدر مع LoRA"""
         try:
             logger.info("📥 بدء تحميل موديلات Flux...")
+            start_time = time.perf_counter()
+            self.load_time_breakdown = {}
             
             # التحقق من توفر GPU
             if not torch.cuda.is_available():
                 raise RuntimeError("CUDA غير متوفر")
             
-            # تحميل Flux pipeline
-            logger.info(f"تحميل {self.model_config['flux_model']}...")
+            dtype = resolve_dtype(self.model_config['dtype'])
+            self.snapshot = find_snapshot(self.model_config)
+            
+            if self.snapshot:
+                # أوزان مدمجة مسبقاً بصيغة safetensors: تحميل بالـ mmap دون دمج LoRA
+                logger.info(f"⚡ تحميل اللقطة المدمجة من: {self.model_config['snapshot_path']}")
+                components, self.load_time_breakdown = await asyncio.to_thread(
+                    load_components, self.model_config['snapshot_path'], dtype
+                )
+                self.pipeline = FluxPipeline(**components)
+            else:
+                # كل نسخة مربوطة بجهازها بدلاً من توزيع الموديل تلقائياً على كل الأجهزة
+                logger.info(f"تحميل {self.model_config['flux_model']}...")
+                step_time = time.perf_counter()
+                self.pipeline = await asyncio.to_thread(
+                    FluxPipeline.from_pretrained,
+                    self.model_config['flux_model'],
+                    torch_dtype=dtype
+                )
+                self.load_time_breakdown["pipeline"] = round(time.perf_counter() - step_time, 3)
             
-            self.pipeline = FluxPipeline.from_pretrained(
-                self.model_config['flux_model'],
-                torch_dtype=torch.bfloat16,
-                device_map="auto"
+            # تحميل LoRA الافتراضي ودمجه في الأوزان (اللقطة تحتويه مدمجاً مسبقاً)
+            step_time = time.perf_counter()
+            await asyncio.to_thread(
+                self.adapters.attach,
+                self.pipeline,
+                baked=bool(self.snapshot and self.snapshot.get("lora_fused"))
             )
+            if self.adapters.has_default:
+                self.load_time_breakdown["lora"] = round(time.perf_counter() - step_time, 3)
             
-            # تحميل LoRA إذا كان متوفراً
-            lora_path = self.model_config['lora_path']
-            if os.path.exists(lora_path):
-                logger.info(f"تحميل LoRA من: {lora_path}")
-                self.pipeline.load_lora_weights(lora_path)
-            else:
-                logger.warning(f"LoRA غير موجود في: {lora_path}")
+            self.prompt_cache.clear()
             
-            # تحسين الذاكرة
-            if self.model_config['enable_memory_efficient']:
-                self.pipeline.enable_model_cpu_offload()
-                self.pipeline.enable_attention_slicing()
+            # اختيار طريقة التشغيل حسب الذاكرة المتاحة قبل نقل الأوزان إلى الجهاز
+            step_time = time.perf_counter()
+            self.memory_planner = MemoryPlanner(self.device, monitor=self.monitor)
+            self.memory_planner.initialize(component_sizes(self.pipeline))
+            await asyncio.to_thread(self.memory_planner.apply, self.pipeline)
+            self.load_time_breakdown["device_placement"] = round(time.perf_counter() - step_time, 3)
             
+            self.load_time = round(time.perf_counter() - start_time, 3)
             self.is_loaded = True
-            logger.success("✅ تم تحميل جميع الموديلات بنجاح")
+            logger.success(
+                f"✅ تم تحميل جميع الموديلات بنجاح على {self.device} خلال {self.load_time:.1f} ثانية "
+                f"({'لقطة مدمجة' if self.snapshot else 'المصدر + LoRA'})"
+            )
             return True
             
         except Exception as e:
@@ -76,62 +153,120 @@ class FluxUpscaler:
             self.is_loaded = False
             return False
     
+    def get_model_info(self) -> ModelInfo:
+        """معلومات الموديل المحمل ووقت تحميل كل مكون"""
+        return ModelInfo(
+            name=self.model_config['flux_model'],
+            version=self.snapshot.get("created_at", "snapshot") if self.snapshot else "latest",
+            source="snapshot" if self.snapshot else "hub",
+            loaded=self.is_loaded,
+            load_time=self.load_time,
+            load_time_breakdown=self.load_time_breakdown or None
+        )
+    
     async def upscale_image(
         self, 
-        input_path: str, 
+        image: Union[str, ImageContext], 
         prompt: str,
+        task_id: Optional[str] = None,
+        stage_timer: Optional[StageTimer] = None,
+        cancel_token: Optional[CancellationToken] = None,
+        progress: Optional[TaskProgress] = None,
+        prepared: Optional[Tuple[Image.Image, Tuple[int, int]]] = None,
         **kwargs
     ) -> UpscaleResponse:
-        """رفع جودة الصورة"""
+        """رفع جودة الصورة - تتوقف بين خطوات الاستدلال إذا انتهت مهلة cancel_token أو أُلغي"""
         
         if not self.is_loaded:
             raise RuntimeError("الموديلات غير محملة")
         
-        task_id = str(uuid.uuid4())
+        task_id = task_id or str(uuid.uuid4())
         start_time = time.time()
+        # المراحل السابقة (الرفع والتحقق والانتظار) مسجلة في المؤقت نفسه
+        timer = stage_timer or StageTimer()
+        context = image if isinstance(image, ImageContext) else ImageContext(image)
         
         try:
             logger.info(f"🎨 بدء معالجة الصورة: {task_id}")
             
-            # تحميل الصورة
-            input_image = load_image(input_path)
-            original_size = input_image.size
+            params = self._resolve_params(prompt, kwargs)
+            tier = get_tier(params["quality_tier"])
+            preset = get_preset(params["output_format"])
             
-            # التحقق من حجم الصورة
-            max_size = settings.MAX_IMAGE_SIZE
-            if max(original_size) > max_size:
-                # تصغير الصورة إذا كانت كبيرة جداً
-                ratio = max_size / max(original_size)
-                new_size = (int(original_size[0] * ratio), int(original_size[1] * ratio))
-                input_image = input_image.resize(new_size, Image.Resampling.LANCZOS)
-                logger.info(f"تم تصغير الصورة من {original_size} إلى {new_size}")
+            # البحث في ذاكرة النتائج قبل أي عمل على GPU
+            cache_key = None
+            if self.result_cache:
+                cache_start = time.perf_counter()
+                content_hash = (kwargs.get("content_hash")
+                                or context.content_hash
+                                or await asyncio.to_thread(hash_file, context.path))
+                cache_key = self.result_cache.make_key(content_hash, self._cache_params(params))
+                cached = await self._get_cached(cache_key, task_id, preset, start_time)
+                timer.record("cache", time.perf_counter() - cache_start)
+                if cached:
+                    cached.metadata["stages"] = timer.to_dict()
+                    record_processing_time(cached.processing_time)
+                    record_tier_latency(tier.name, cached.processing_time)
+                    record_image_processed(True)
+                    return cached
+            
+            # لا عمل على GPU لمهمة انتهت مهلتها أثناء الانتظار
+            if cancel_token:
+                cancel_token.check()
+            
+            # تحميل الصورة (خارج حلقة الأحداث) - إلا إذا حضّرتها مرحلة سابقة
+            input_image, original_size = prepared or await self.prepare_input(context, timer, tier)
             
             # إعداد المعاملات
             generation_params = {
-                "prompt": prompt,
+                "prompt": params["prompt"],
                 "image": input_image,
-                "num_inference_steps": kwargs.get("num_inference_steps", self.processing_config["num_inference_steps"]),
-                "guidance_scale": kwargs.get("guidance_scale", self.processing_config["guidance_scale"]),
-                "strength": kwargs.get("strength", self.processing_config["strength"]),
-                "generator": torch.Generator(device=self.device).manual_seed(kwargs.get("seed", 42))
+                "num_inference_steps": params["num_inference_steps"],
+                "guidance_scale": params["guidance_scale"],
+                "strength": params["strength"],
+                "generator": torch.Generator(device=self.device).manual_seed(params["seed"]),
+                "adapter": params["adapter"],
+                "cancel_token": cancel_token,
+                "progress": progress
             }
             
             # إضافة negative prompt إذا كان متوفراً
-            negative_prompt = kwargs.get("negative_prompt", self.processing_config["negative_prompt"])
-            if negative_prompt:
-                generation_params["negative_prompt"] = negative_prompt
+            if params["negative_prompt"]:
+                generation_params["negative_prompt"] = params["negative_prompt"]
             
             # معالجة الصورة
             logger.info("🔄 بدء عملية المعالجة...")
             
-            with torch.inference_mode():
-                result_image = self.pipeline(**generation_params).images[0]
+            tiled = self._needs_tiling(original_size, tier)
+            tile_count = 0
+            if progress:
+                progress.update(stage="inference")
+            with timer.stage("inference"):
+                if tiled:
+                    result_image, tile_count = await self._upscale_tiled(generation_params, params["seed"])
+                else:
+                    result_image = await self.batcher.submit(
+                        self._batch_key(generation_params),
+                        generation_params
+                    )
             
-            # حفظ النتيجة
-            output_path = await self._save_result(result_image, task_id)
+            # في الدفعة يكتمل الاستدعاء إذا بقيت مهمة أخرى مطلوبة - النتيجة تُهمل
+            if cancel_token:
+                cancel_token.check()
+            
+            # حفظ النتيجة - الترميز يُقاس داخل عملية الترميز والباقي نقل الصورة والكتابة
+            if progress:
+                progress.update(stage="encode")
+            save_start = time.perf_counter()
+            output_path, encoding = await self._save_result(result_image, task_id, preset)
+            timer.record("encode", encoding["encode_time"])
+            timer.record("save", max(0.0, time.perf_counter() - save_start - encoding["encode_time"]))
             
             # حساب الوقت
             processing_time = time.time() - start_time
+            record_processing_time(processing_time)
+            record_tier_latency(tier.name, processing_time)
+            record_image_processed(True)
             
             # تحديث الإحصائيات
             self.total_processed += 1
@@ -140,20 +275,50 @@ class FluxUpscaler:
             
             logger.success(f"✅ تم معالجة الصورة بنجاح في {processing_time:.2f} ثانية")
             
-            return UpscaleResponse(
+            response = UpscaleResponse(
                 task_id=task_id,
                 status=ProcessingStatus.COMPLETED,
                 output_path=output_path,
                 processing_time=processing_time,
                 original_size=original_size,
                 output_size=result_image.size,
-                file_size=os.path.getsize(output_path) if os.path.exists(output_path) else None
+                file_size=encoding["output_bytes"],
+                completed_at=datetime.now(),
+                metadata={
+                    "quality_tier": tier.name,
+                    "tiled": tiled,
+                    "tiles": tile_count,
+                    "cache_hit": False,
+                    "encoding": encoding,
+                    "stages": timer.to_dict()
+                }
+            )
+            
+            if cache_key:
+                await asyncio.to_thread(self.result_cache.put, cache_key, response)
+            
+            return response
+            
+        except JobCancelled as e:
+            processing_time = time.time() - start_time
+            record_job_cancelled(e.reason)
+            
+            logger.warning(f"⏹️ تم إيقاف المهمة {task_id} بعد {processing_time:.2f} ثانية: {e}")
+            
+            return UpscaleResponse(
+                task_id=task_id,
+                status=ProcessingStatus.CANCELLED,
+                processing_time=processing_time,
+                completed_at=datetime.now(),
+                error_message=str(e),
+                metadata={"cancel_reason": e.reason, "stages": timer.to_dict()}
             )
             
         except Exception as e:
             processing_time = time.time() - start_time
             self.total_processed += 1
             self.failed_processed += 1
+            record_image_processed(False)
             
             logger.error(f"❌ فشل في معالجة الصورة {task_id}: {e}")
             
@@ -161,25 +326,355 @@ class FluxUpscaler:
                 task_id=task_id,
                 status=ProcessingStatus.FAILED,
                 processing_time=processing_time,
-                error_message=str(e)
+                completed_at=datetime.now(),
+                error_message=str(e),
+                metadata={"stages": timer.to_dict()}
             )
+        
+        finally:
+            context.release()
     
-    async def _save_result(self, image: Image.Image, task_id: str) -> str:
-        """حفظ الصورة المعالجة"""
-        try:
-            # إنشاء مجلد النتائج إذا لم يكن موجوداً
-            result_dir = Path(settings.RESULT_DIR)
-            result_dir.mkdir(parents=True, exist_ok=True)
+    def _resolve_params(self, prompt: str, kwargs: dict) -> dict:
+        """معاملات التوليد النهائية بعد تطبيق القيم الافتراضية"""
+        seed = kwargs.get("seed")
+        # القيم الصريحة في الطلب أولاً ثم مستوى الجودة ثم الإعدادات الافتراضية - الصفر قيمة صريحة
+        tier = get_tier(kwargs.get("quality_tier"))
+        output_format = first_set(kwargs.get("output_format"), tier.output_format, self.encoder_default_preset)
+        return {
+            "prompt": prompt,
+            "negative_prompt": kwargs.get("negative_prompt", self.processing_config["negative_prompt"]),
+            "num_inference_steps": first_set(
+                kwargs.get("num_inference_steps"),
+                tier.num_inference_steps,
+                self.processing_config["num_inference_steps"]
+            ),
+            "guidance_scale": first_set(kwargs.get("guidance_scale"), self.processing_config["guidance_scale"]),
+            "strength": first_set(kwargs.get("strength"), tier.strength, self.processing_config["strength"]),
+            "seed": 42 if seed is None else seed,
+            "output_format": getattr(output_format, "value", output_format),
+            "adapter": self.adapters.resolve(kwargs.get("adapter")),
+            "quality_tier": tier.name,
+            "max_image_size": tier.max_image_size
+        }
+    
+    def _cache_params(self, params: dict) -> dict:
+        """كل ما يؤثر على الصورة الناتجة: معاملات التوليد والموديل وطريقة المعالجة"""
+        return {
+            **params,
+            "model": self.model_config["flux_model"],
+            "lora": self.model_config["lora_path"],
+            "tiling": [
+                self.processing_config["enable_tiling"],
+                self.processing_config["tile_size"],
+                self.processing_config["tile_overlap"]
+            ],
+            "resolution_bucket": self.model_config["resolution_bucket"] if self.batcher.enabled else None
+        }
+    
+    async def _get_cached(
+        self,
+        cache_key: str,
+        task_id: str,
+        preset: EncodingPreset,
+        start_time: float
+    ) -> Optional[UpscaleResponse]:
+        """إرجاع نتيجة مخزنة دون تشغيل GPU"""
+        output_path = self._result_path(task_id, preset.extension)
+        cached = await asyncio.to_thread(self.result_cache.get, cache_key, output_path)
+        if cached is None:
+            return None
+        
+        processing_time = time.time() - start_time
+        self.total_processed += 1
+        self.successful_processed += 1
+        self.total_processing_time += processing_time
+        
+        logger.success(f"⚡ نتيجة من الذاكرة للمهمة {task_id}")
+        
+        return cached.model_copy(update={
+            "task_id": task_id,
+            "output_path": str(output_path),
+            "processing_time": processing_time,
+            "created_at": datetime.now(),
+            "completed_at": datetime.now(),
+            "metadata": {**(cached.metadata or {}), "cache_hit": True}
+        })
+    
+    async def prepare_input(
+        self,
+        context: ImageContext,
+        timer: Optional[StageTimer] = None,
+        quality_tier: Union[str, QualityProfile, None] = None
+    ) -> Tuple[Image.Image, Tuple[int, int]]:
+        """فك ترميز الصورة وتجهيزها للـ pipeline على خيط منفصل - يمكن تشغيلها قبل دور الصورة على GPU"""
+        tier = quality_tier if isinstance(quality_tier, QualityProfile) else get_tier(quality_tier)
+        return await asyncio.to_thread(self._load_input, context, timer, tier)
+    
+    def _load_input(
+        self,
+        context: ImageContext,
+        timer: Optional[StageTimer] = None,
+        tier: Optional[QualityProfile] = None
+    ) -> Tuple[Image.Image, Tuple[int, int]]:
+        """فك ترميز الصورة (مرة واحدة عبر السياق) وتصغيرها إلى حد دقة مستوى الجودة إذا لزم الأمر"""
+        timer = timer or StageTimer()
+        tier = tier or get_tier()
+        with timer.stage("decode"):
+            input_image = context.decode()
+        original_size = input_image.size
+        
+        # الصور الكبيرة تُعالج بالبلاطات بحجمها الكامل
+        if self._needs_tiling(original_size, tier):
+            return input_image, original_size
+        
+        with timer.stage("resize"):
+            # التحقق من حجم الصورة
+            max_size = tier.max_image_size
+            if max(original_size) > max_size:
+                # تصغير الصورة إذا كانت كبيرة جداً
+                ratio = max_size / max(original_size)
+                new_size = (int(original_size[0] * ratio), int(original_size[1] * ratio))
+                input_image = input_image.resize(new_size, Image.Resampling.LANCZOS)
+                logger.info(f"تم تصغير الصورة من {original_size} إلى {new_size}")
+            
+            # توحيد الأبعاد حتى تتوافق الصور المتقاربة في الدفعة نفسها
+            if self.batcher.enabled:
+                input_image = self._bucket_image(input_image)
+        
+        return input_image, original_size
+    
+    def _needs_tiling(self, size: Tuple[int, int], tier: Optional[QualityProfile] = None) -> bool:
+        """هل تحتاج الصورة إلى المعالجة بالبلاطات - المعاينة تُصغَّر دائماً"""
+        tier = tier or get_tier()
+        return self.processing_config["enable_tiling"] and tier.tiling and max(size) > tier.max_image_size
+    
+    async def _upscale_tiled(self, generation_params: dict, seed: int) -> Tuple[Image.Image, int]:
+        """معالجة صورة كبيرة على بلاطات متداخلة ثم دمجها - الذاكرة تعتمد على حجم البلاطة فقط"""
+        image = generation_params["image"]
+        overlap = self.processing_config["tile_overlap"]
+        boxes = plan_tiles(image.size, self.processing_config["tile_size"], overlap)
+        group_size = max(1, self.processing_config["tile_batch_size"])
+        
+        logger.info(f"🧩 معالجة الصورة {image.size} على {len(boxes)} بلاطة")
+        
+        cancel_token = generation_params.get("cancel_token")
+        progress = generation_params.get("progress")
+        blender = None
+        for start in range(0, len(boxes), group_size):
+            if cancel_token:
+                cancel_token.check()
+            if progress:
+                progress.update(tile=start + 1, tiles=len(boxes))
+            group = boxes[start:start + group_size]
+            
+            params_list = []
+            for index, box in enumerate(group, start):
+                params = dict(generation_params)
+                params["image"] = image.crop(box)
+                params["generator"] = torch.Generator(device=self.device).manual_seed(seed + index)
+                params_list.append(params)
+            
+            tiles = await self._run_batch(params_list)
+            
+            if blender is None:
+                scale = tiles[0].width / (group[0][2] - group[0][0])
+                blender = TileBlender(image.size, overlap, scale)
+            
+            await asyncio.to_thread(self._blend_tiles, blender, group, tiles)
+        
+        return await asyncio.to_thread(blender.result), len(boxes)
+    
+    @staticmethod
+    def _blend_tiles(blender: TileBlender, boxes: list, tiles: list):
+        """إضافة مجموعة بلاطات إلى الصورة النهائية"""
+        for box, tile in zip(boxes, tiles):
+            blender.add(box, tile)
+    
+    def _bucket_image(self, image: Image.Image) -> Image.Image:
+        """تقريب أبعاد الصورة إلى أقرب مضاعف لـ RESOLUTION_BUCKET"""
+        bucket = self.model_config["resolution_bucket"]
+        width, height = image.size
+        size = (
+            max(bucket, round(width / bucket) * bucket),
+            max(bucket, round(height / bucket) * bucket)
+        )
+        if size != image.size:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+        return image
+    
+    @staticmethod
+    def _batch_key(generation_params: dict) -> tuple:
+        """مفتاح التوافق: الطلبات بالمفتاح نفسه يمكن دمجها في دفعة"""
+        return (
+            generation_params["image"].size,
+            generation_params["num_inference_steps"],
+            generation_params["guidance_scale"],
+            generation_params["strength"],
+            "negative_prompt" in generation_params,
+            generation_params.get("adapter")
+        )
+    
+    @staticmethod
+    def _collate(params_list: list) -> dict:
+        """دمج معاملات عدة طلبات في استدعاء واحد"""
+        if len(params_list) == 1:
+            return params_list[0]
+        
+        batched = dict(params_list[0])
+        for key in BATCHED_PARAMS:
+            if key in batched:
+                batched[key] = [params[key] for params in params_list]
+        return batched
+    
+    async def _run_batch(self, params_list: list) -> list:
+        """تشغيل دفعة على منفذ الاستدلال"""
+        return await self.executor.run(self._run_pipeline, self._collate(params_list))
+    
+    @property
+    def swappable(self) -> bool:
+        """هل يقبل هذا المعالج محولات غير الافتراضي"""
+        return self.adapters.swappable
+    
+    @property
+    def model_identity(self) -> str:
+        """هوية الموديل و LoRA النشط - تدخل في مفاتيح التخزين المؤقت"""
+        return f"{self.model_config['flux_model']}|{self.model_config['lora_path']}|{self.adapters.active}"
+    
+    def _run_pipeline(self, generation_params: dict) -> list:
+        """تشغيل الـ pipeline - يُستدعى على خيط الاستدلال فقط"""
+        generation_params = dict(generation_params)
+        self.adapters.activate(generation_params.pop("adapter", None))
+        tokens = generation_params.pop("cancel_token", None)
+        progresses = generation_params.pop("progress", None)
+        
+        planner = self.memory_planner
+        if planner:
+            planner.before_job()
+        
+        stopped = None
+        with torch.inference_mode():
+            generation_params = self._embed_prompts(generation_params)
+            
+            steps = generation_params["num_inference_steps"]
+            callbacks = []
+            
+            # نشر التقدم أولاً حتى يرى المشتركون آخر خطوة قبل أي إيقاف
+            progresses = progresses if isinstance(progresses, list) else [progresses]
+            if any(progresses):
+                inputs = generation_params["image"]
+                callbacks.append(StepReporter(
+                    progresses, steps,
+                    (inputs[0] if isinstance(inputs, list) else inputs).size,
+                    preview_interval=self.processing_config.get("preview_interval", 0)
+                ))
+            
+            # فحص المهلة والإلغاء بعد كل خطوة (إذا كانت لكل صور الاستدعاء مهلة)
+            tokens = tokens if isinstance(tokens, list) else [tokens]
+            if all(tokens):
+                callbacks.append(StepGuard(tokens, steps))
+            
+            if callbacks:
+                generation_params["callback_on_step_end"] = self._chain_callbacks(callbacks)
             
+            try:
+                images = self._call_pipeline(generation_params, planner)
+            except JobCancelled as e:
+                # دون traceback حتى لا تبقى الـ latents الوسيطة محجوزة
+                stopped = e.with_traceback(None)
+        
+        if stopped:
+            torch.cuda.empty_cache()
+            record_gpu_seconds_saved(stopped.saved_seconds)
+            logger.info(f"⏹️ تم إيقاف الاستدلال على {self.device} (توفير ~{stopped.saved_seconds:.1f}s)")
+            raise stopped
+        
+        if planner:
+            planner.after_job(self.pipeline, self._megapixels(generation_params["image"]))
+        return images
+    
+    @staticmethod
+    def _chain_callbacks(callbacks: list):
+        """دمج عدة callback_on_step_end في واحد"""
+        if len(callbacks) == 1:
+            return callbacks[0]
+        
+        def chained(pipeline, step, timestep, callback_kwargs):
+            for callback in callbacks:
+                callback_kwargs = callback(pipeline, step, timestep, callback_kwargs)
+            return callback_kwargs
+        
+        return chained
+    
+    def _call_pipeline(self, generation_params: dict, planner: Optional[MemoryPlanner]) -> list:
+        """استدعاء الـ pipeline مع إعادة المحاولة بخطة أقل استهلاكاً عند نفاد الذاكرة"""
+        try:
+            return self.pipeline(**generation_params).images
+        except torch.cuda.OutOfMemoryError:
+            # الانتقال إلى طريقة أقل استهلاكاً وإعادة المحاولة مرة واحدة
+            if not (planner and planner.handle_oom(self.pipeline)):
+                raise
+            logger.warning(f"⚠️ نفاد ذاكرة GPU على {self.device} - إعادة المحاولة بخطة {planner.plan.strategy}")
+            return self.pipeline(**generation_params).images
+    
+    @staticmethod
+    def _megapixels(images) -> float:
+        """مجموع الميغابكسل في استدعاء واحد"""
+        if not isinstance(images, list):
+            images = [images]
+        return sum(image.width * image.height for image in images) / 1e6
+    
+    def _embed_prompts(self, generation_params: dict) -> dict:
+        """استبدال نص الـ prompt بتضمينات مخزنة حتى لا تعمل مشفرات النص لكل صورة"""
+        if (not self.prompt_cache.enabled
+                or "prompt" not in generation_params
+                or not hasattr(self.pipeline, "encode_prompt")):
+            return generation_params
+        
+        prompts = generation_params["prompt"]
+        if not isinstance(prompts, list):
+            prompts = [prompts]
+        
+        device = self.pipeline._execution_device
+        prompt_embeds, pooled_prompt_embeds = [], []
+        for prompt in prompts:
+            embeds, pooled = self.prompt_cache.get_or_encode(
+                (prompt, self.model_identity),
+                lambda: self.pipeline.encode_prompt(prompt=prompt, prompt_2=None, device=device)[:2]
+            )
+            prompt_embeds.append(embeds)
+            pooled_prompt_embeds.append(pooled)
+        
+        params = dict(generation_params)
+        del params["prompt"]
+        params["prompt_embeds"] = torch.cat(prompt_embeds).to(device)
+        params["pooled_prompt_embeds"] = torch.cat(pooled_prompt_embeds).to(device)
+        return params
+    
+    @property
+    def encoder_default_preset(self) -> str:
+        """إعداد الترميز الافتراضي للنشر"""
+        return get_preset().name
+    
+    @staticmethod
+    def _result_path(task_id: str, extension: str = ".png") -> Path:
+        """مسار ملف النتيجة لمهمة"""
+        return Path(settings.RESULT_DIR) / f"upscaled_{task_id}{extension}"
+    
+    async def _save_result(self, image: Image.Image, task_id: str, preset: EncodingPreset) -> Tuple[str, dict]:
+        """ترميز الصورة المعالجة وحفظها خارج حلقة الأحداث"""
+        try:
             # تحديد مسار الحفظ
-            output_filename = f"upscaled_{task_id}.png"
-            output_path = result_dir / output_filename
+            output_path = self._result_path(task_id, preset.extension)
+            output_path.parent.mkdir(parents=True, exist_ok=True)
             
-            # حفظ الصورة
-            image.save(output_path, "PNG", optimize=True)
+            # ترميز الصورة وحفظها
+            encoding = await self.encoder.encode(image, str(output_path), preset)
             
-            logger.info(f"💾 تم حفظ النتيجة في: {output_path}")
-            return str(output_path)
+            logger.info(
+                f"💾 تم حفظ النتيجة في: {output_path} "
+                f"({preset.name}, {encoding['output_bytes']} bytes, {encoding['encode_time']:.2f}s)"
+            )
+            return str(output_path), encoding
             
         except Exception as e:
             logger.error(f"❌ فشل في حفظ النتيجة: {e}")
@@ -190,8 +685,10 @@ class FluxUpscaler:
         try:
             if self.pipeline:
                 del self.pipeline
+                self.pipeline = None
                 torch.cuda.empty_cache()
                 logger.info("🧹 تم تنظيف موارد GPU")
+            self.executor.shutdown(wait=False)
         except Exception as e:
             logger.error(f"خطأ في التنظيف: {e}")
     
@@ -0,0 +1,210 @@
+"""
+مجمع عمال GPU - نسخة pipeline لكل جهاز وتوزيع كل مهمة على الأقل حملاً
+"""
+
+import time
+import asyncio
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Union
+import torch
+from loguru import logger
+
+from .config import get_model_config
+from .models import UpscaleResponse, ProcessingStatus, ModelInfo
+from .upscaler import FluxUpscaler
+from .result_cache import ResultCache
+from .image_context import ImageContext
+from .encoding import ImageEncoder
+from .monitoring import StageTimer, set_device_inflight, record_device_job
+
+
+# وزن آخر قياس في المتوسط المتحرك لوقت الخدمة
+SERVICE_TIME_ALPHA = 0.3
+
+
+def resolve_devices(gpu_devices: Optional[List[str]] = None) -> List[str]:
+    """الأجهزة التي يعمل عليها المجمع: القائمة المحددة أو كل GPU مرئي"""
+    config = get_model_config()
+    gpu_devices = config["gpu_devices"] if gpu_devices is None else gpu_devices
+
+    if gpu_devices:
+        return [device if ":" in device or device == "cpu" else f"cuda:{device}" for device in gpu_devices]
+
+    if torch.cuda.is_available() and torch.cuda.device_count() > 0:
+        return [f"cuda:{index}" for index in range(torch.cuda.device_count())]
+
+    return [config["device"]]
+
+
+@dataclass
+class DeviceReplica:
+    """نسخة على جهاز واحد مع حالة حملها"""
+    device: str
+    upscaler: FluxUpscaler
+    active: int = 0
+    service_time: Optional[float] = None
+    completed: int = 0
+    failed: int = 0
+    # الإلغاء (انقطاع العميل أو انقضاء المهلة) ليس خطأ في الجهاز
+    cancelled: int = 0
+
+    def observe(self, duration: float):
+        """تحديث المتوسط المتحرك لوقت الخدمة"""
+        if self.service_time is None:
+            self.service_time = duration
+        else:
+            self.service_time += SERVICE_TIME_ALPHA * (duration - self.service_time)
+
+
+class GPUWorkerPool:
+    """يشغل FluxUpscaler لكل جهاز ويعرض الواجهة نفسها لبقية الخدمة"""
+
+    def __init__(
+        self,
+        devices: Optional[List[str]] = None,
+        factory: Optional[Callable[[str], FluxUpscaler]] = None,
+        result_cache: Optional[ResultCache] = None,
+        encoder: Optional[ImageEncoder] = None,
+        monitor=None
+    ):
+        self.result_cache = result_cache
+        self.encoder = encoder
+        # مراقب GPU واحد للخدمة تشترك فيه مخططات الذاكرة على كل الأجهزة
+        factory = factory or (
+            lambda device: FluxUpscaler(result_cache=result_cache, encoder=encoder, device=device, monitor=monitor)
+        )
+
+        devices = devices or resolve_devices()
+        self.replicas = [DeviceReplica(device=device, upscaler=factory(device)) for device in devices]
+
+        logger.info(f"🎮 تم إنشاء مجمع العمال على {len(self.replicas)} جهاز: {', '.join(devices)}")
+
+    @property
+    def is_loaded(self) -> bool:
+        """هل توجد نسخة واحدة على الأقل جاهزة"""
+        return any(replica.upscaler.is_loaded for replica in self.replicas)
+
+    @property
+    def replica_count(self) -> int:
+        """عدد النسخ الجاهزة"""
+        return sum(1 for replica in self.replicas if replica.upscaler.is_loaded) or len(self.replicas)
+
+    @property
+    def swappable(self) -> bool:
+        """هل تقبل كل النسخ محولات غير الافتراضي - أي مهمة قد تصل إلى أي جهاز"""
+        return all(replica.upscaler.swappable for replica in self.replicas)
+
+    async def load_models(self) -> bool:
+        """تحميل الموديلات على كل الأجهزة بالتوازي - الأجهزة التي تفشل تُستبعد من التوزيع"""
+        await asyncio.gather(*[replica.upscaler.load_models() for replica in self.replicas])
+
+        loaded = [replica.device for replica in self.replicas if replica.upscaler.is_loaded]
+        if len(loaded) < len(self.replicas):
+            logger.warning(f"⚠️ تم تحميل الموديلات على {len(loaded)} من {len(self.replicas)} جهاز")
+        return bool(loaded)
+
+    def _select(self) -> DeviceReplica:
+        """اختيار النسخة ذات أقل وقت انتظار متوقع: (المهام الجارية + 1) × متوسط وقت الخدمة"""
+        candidates = [replica for replica in self.replicas if replica.upscaler.is_loaded]
+        if not candidates:
+            raise RuntimeError("الموديلات غير محملة")
+
+        known = [replica.service_time for replica in candidates if replica.service_time is not None]
+        default_time = sum(known) / len(known) if known else 1.0
+
+        return min(
+            candidates,
+            key=lambda replica: ((replica.active + 1) * (replica.service_time or default_time), replica.active)
+        )
+
+    async def prepare_input(
+        self,
+        context: ImageContext,
+        timer: Optional[StageTimer] = None,
+        quality_tier: Optional[str] = None
+    ):
+        """تجهيز الصورة قبل اختيار الجهاز - الإعدادات نفسها على كل النسخ"""
+        candidates = [replica for replica in self.replicas if replica.upscaler.is_loaded] or self.replicas
+        return await candidates[0].upscaler.prepare_input(context, timer, quality_tier)
+
+    async def upscale_image(
+        self,
+        image: Union[str, ImageContext],
+        prompt: str,
+        task_id: Optional[str] = None,
+        **kwargs
+    ) -> UpscaleResponse:
+        """رفع جودة الصورة على الجهاز الأقل حملاً"""
+        replica = self._select()
+        replica.active += 1
+        set_device_inflight(replica.device, replica.active)
+        start_time = time.perf_counter()
+
+        try:
+            result = await replica.upscaler.upscale_image(image, prompt, task_id=task_id, **kwargs)
+        finally:
+            replica.active -= 1
+            set_device_inflight(replica.device, replica.active)
+
+        duration = time.perf_counter() - start_time
+        metadata = result.metadata or {}
+
+        if result.status == ProcessingStatus.COMPLETED:
+            replica.completed += 1
+            # نتائج الذاكرة المؤقتة لا تمثل وقت خدمة الجهاز
+            if not metadata.get("cache_hit"):
+                replica.observe(duration)
+            status = "success"
+        elif result.status == ProcessingStatus.CANCELLED:
+            replica.cancelled += 1
+            status = "cancelled"
+        else:
+            replica.failed += 1
+            status = "failed"
+        record_device_job(replica.device, status, duration)
+
+        return result.model_copy(update={"metadata": {**metadata, "device": replica.device}})
+
+    async def cleanup(self):
+        """تنظيف موارد كل الأجهزة"""
+        for replica in self.replicas:
+            await replica.upscaler.cleanup()
+
+    def get_model_info(self) -> List[ModelInfo]:
+        """معلومات الموديل ووقت التحميل لكل جهاز"""
+        return [replica.upscaler.get_model_info() for replica in self.replicas]
+
+    def get_device_stats(self) -> List[dict]:
+        """حالة كل جهاز"""
+        return [
+            {
+                "device": replica.device,
+                "loaded": replica.upscaler.is_loaded,
+                "active": replica.active,
+                "service_time": round(replica.service_time, 3) if replica.service_time is not None else None,
+                "completed": replica.completed,
+                "failed": replica.failed,
+                "cancelled": replica.cancelled,
+                "prompt_cache": replica.upscaler.prompt_cache.get_stats(),
+                "adapters": replica.upscaler.adapters.get_stats(),
+                "memory": replica.upscaler.memory_planner.get_stats() if replica.upscaler.memory_planner else None
+            }
+            for replica in self.replicas
+        ]
+
+    def get_stats(self) -> dict:
+        """إحصائيات المعالجة مجمعة من كل الأجهزة"""
+        stats = [replica.upscaler.get_stats() for replica in self.replicas]
+        total = sum(item["total_processed"] for item in stats)
+        successful = sum(item["successful_processed"] for item in stats)
+        total_time = sum(item["total_processing_time"] for item in stats)
+
+        return {
+            "total_processed": total,
+            "successful_processed": successful,
+            "failed_processed": sum(item["failed_processed"] for item in stats),
+            "average_processing_time": total_time / total if total > 0 else 0,
+            "success_rate": successful / total * 100 if total > 0 else 0,
+            "total_processing_time": total_time,
+            "devices": self.get_device_stats()
+        }
@@ -0,0 +1,49 @@
+"""
+أدوات الاختبار المشتركة - تُستورد في ملفات الاختبار عبر from conftest import ...
+"""
+
+import asyncio
+from datetime import datetime
+
+from core.models import UpscaleResponse, ProcessingStatus
+
+
+class IdentityFakePipeline:
+    """pipeline وهمي يعيد الصورة كما هي"""
+
+    def __call__(self, **kwargs):
+        class Output:
+            images = [kwargs["image"].copy()]
+
+        return Output()
+
+
+class FakeUpscaler:
+    """معالج وهمي يسجل كل استدعاء (الإدخال، الوصف، معرف المهمة، باقي المعاملات)"""
+
+    def __init__(self, fail: bool = False):
+        self.is_loaded = True
+        self.fail = fail
+        self.calls = []
+
+    async def upscale_image(self, image, prompt, task_id=None, **kwargs):
+        self.calls.append((image, prompt, task_id, kwargs))
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("boom")
+        return UpscaleResponse(
+            task_id=task_id,
+            status=ProcessingStatus.COMPLETED,
+            output_path=f"/tmp/upscaled_{task_id}.png",
+            completed_at=datetime.now()
+        )
+
+    @property
+    def task_ids(self):
+        """معرفات المهام التي وصلت إلى المعالج"""
+        return [call[2] for call in self.calls]
+
+
+def queue_config(**overrides):
+    """إعدادات طابور صغير بعامل واحد وبلا مهلة - تُستبدل أي قيمة عبر overrides"""
+    return {"max_queue_size": 10, "num_workers": 1, "history_size": 100, "processing_timeout": 0, **overrides}
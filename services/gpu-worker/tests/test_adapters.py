@@ -0,0 +1,239 @@
+"""
+اختبارات إدارة محولات LoRA
+"""
+
+import pytest
+import io
+import os
+import sys
+from fastapi.testclient import TestClient
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import app as app_module
+from core.config import settings
+from core.models import ProcessingStatus
+from core.adapters import AdapterManager, AdapterError, DEFAULT_ADAPTER, list_adapters
+from core.task_queue import TaskQueue
+from core.upscaler import FluxUpscaler
+
+
+class FakeLoraPipeline:
+    """pipeline وهمي يسجل عمليات LoRA"""
+
+    def __init__(self):
+        self.calls = []
+        self.loaded = set()
+        self.seen_adapters = []
+        self.manager = None
+
+    def load_lora_weights(self, path, adapter_name=None):
+        self.calls.append(("load", adapter_name))
+        self.loaded.add(adapter_name)
+
+    def fuse_lora(self, adapter_names=None):
+        self.calls.append(("fuse", tuple(adapter_names)))
+
+    def unfuse_lora(self):
+        self.calls.append(("unfuse",))
+
+    def set_adapters(self, names):
+        self.calls.append(("set", tuple(names)))
+
+    def delete_adapters(self, names):
+        self.calls.append(("delete", tuple(names)))
+        self.loaded -= set(names)
+
+    def enable_lora(self):
+        self.calls.append(("enable",))
+
+    def disable_lora(self):
+        self.calls.append(("disable",))
+
+    def __call__(self, **kwargs):
+        assert "adapter" not in kwargs
+        self.seen_adapters.append(self.manager.active if self.manager else None)
+
+        class Output:
+            images = [kwargs["image"].copy()]
+
+        return Output()
+
+
+@pytest.fixture
+def adapter_config(tmp_path):
+    """مجلد محولات وملف LoRA افتراضي"""
+    adapters_dir = tmp_path / "adapters"
+    adapters_dir.mkdir()
+    for name in ("anime", "photo", "sketch"):
+        (adapters_dir / f"{name}.safetensors").write_bytes(b"lora")
+
+    lora_path = tmp_path / "lora.safetensors"
+    lora_path.write_bytes(b"lora")
+
+    return {
+        "lora_path": str(lora_path),
+        "adapters_dir": str(adapters_dir),
+        "max_loaded_adapters": 2
+    }
+
+
+class TestAdapterManager:
+    """اختبارات التبديل والطرد"""
+
+    def test_default_is_fused_on_attach(self, adapter_config):
+        """اختبار دمج المحول الافتراضي عند التحميل"""
+        pipeline = FakeLoraPipeline()
+        manager = AdapterManager(config=adapter_config)
+        manager.attach(pipeline)
+
+        assert pipeline.calls == [("load", DEFAULT_ADAPTER), ("fuse", (DEFAULT_ADAPTER,))]
+        assert manager.get_stats()["fused"] is True
+        assert manager.get_stats()["resident"] == [DEFAULT_ADAPTER]
+
+    def test_switch_and_back(self, adapter_config):
+        """اختبار فك الدمج للتبديل ثم إعادة الدمج عند الرجوع للافتراضي"""
+        pipeline = FakeLoraPipeline()
+        manager = AdapterManager(config=adapter_config)
+        manager.attach(pipeline)
+        pipeline.calls.clear()
+
+        manager.activate("anime")
+        assert pipeline.calls == [("unfuse",), ("load", "anime"), ("enable",), ("set", ("anime",))]
+        assert manager.active == "anime" and not manager.fused
+
+        pipeline.calls.clear()
+        manager.activate(None)
+        assert pipeline.calls == [("enable",), ("set", (DEFAULT_ADAPTER,)), ("fuse", (DEFAULT_ADAPTER,))]
+        assert manager.fused
+
+        stats = manager.get_stats()
+        assert stats["swaps"] == 2
+        assert stats["last_swap_ms"] is not None
+
+    def test_lru_eviction(self, adapter_config):
+        """اختبار طرد المحول الأقدم استخداماً عند تجاوز الحد"""
+        pipeline = FakeLoraPipeline()
+        manager = AdapterManager(config=adapter_config)
+        manager.attach(pipeline)
+
+        manager.activate("anime")
+        manager.activate("photo")
+        manager.activate("anime")
+        manager.activate("sketch")
+
+        assert ("delete", ("photo",)) in pipeline.calls
+        assert manager.get_stats()["resident"] == [DEFAULT_ADAPTER, "anime", "sketch"]
+        assert pipeline.loaded == {DEFAULT_ADAPTER, "anime", "sketch"}
+
+    def test_without_default_lora(self, adapter_config, tmp_path):
+        """اختبار الرجوع للموديل الأساسي عند غياب LoRA الافتراضي"""
+        adapter_config["lora_path"] = str(tmp_path / "missing.safetensors")
+        pipeline = FakeLoraPipeline()
+        manager = AdapterManager(config=adapter_config)
+        manager.attach(pipeline)
+
+        manager.activate("anime")
+        pipeline.calls.clear()
+        manager.activate(DEFAULT_ADAPTER)
+
+        assert pipeline.calls == [("disable",)]
+
+    def test_rejects_unknown_and_unsafe_names(self, adapter_config):
+        """اختبار رفض المحولات غير الموجودة والأسماء غير الآمنة"""
+        manager = AdapterManager(config=adapter_config)
+
+        for name in ("missing", "../lora", ".hidden"):
+            with pytest.raises(AdapterError):
+                manager.resolve(name)
+
+    def test_baked_snapshot_rejects_switching(self, adapter_config):
+        """اختبار منع التبديل عند التشغيل من لقطة مدمجة"""
+        pipeline = FakeLoraPipeline()
+        manager = AdapterManager(config=adapter_config)
+        manager.attach(pipeline, baked=True)
+
+        assert pipeline.calls == []
+        assert manager.resolve(None) == DEFAULT_ADAPTER
+        with pytest.raises(AdapterError):
+            manager.resolve("anime")
+
+    def test_list_adapters(self, adapter_config):
+        """اختبار قائمة المحولات المتاحة"""
+        assert list_adapters(adapter_config) == [DEFAULT_ADAPTER, "anime", "photo", "sketch"]
+
+
+class TestUpscalerAdapters:
+    """اختبارات اختيار المحول لكل طلب"""
+
+    @pytest.mark.asyncio
+    async def test_per_request_adapter(self, adapter_config, tmp_path, monkeypatch):
+        """اختبار تفعيل المحول المطلوب على خيط الاستدلال وفصله في مفتاح الدفعة"""
+        monkeypatch.setattr(settings, "RESULT_DIR", str(tmp_path / "results"))
+        path = tmp_path / "input.png"
+        Image.new("RGB", (64, 64), color="blue").save(path, "PNG")
+
+        upscaler = FluxUpscaler()
+        upscaler.device = "cpu"
+        upscaler.adapters = AdapterManager(config=adapter_config)
+        pipeline = FakeLoraPipeline()
+        pipeline.manager = upscaler.adapters
+        upscaler.adapters.attach(pipeline)
+        upscaler.pipeline = pipeline
+        upscaler.is_loaded = True
+
+        try:
+            anime = await upscaler.upscale_image(str(path), "prompt", adapter="anime")
+            default = await upscaler.upscale_image(str(path), "prompt")
+            missing = await upscaler.upscale_image(str(path), "prompt", adapter="missing")
+        finally:
+            upscaler.executor.shutdown()
+
+        assert anime.status == ProcessingStatus.COMPLETED
+        assert default.status == ProcessingStatus.COMPLETED
+        assert missing.status == ProcessingStatus.FAILED
+        assert pipeline.seen_adapters == ["anime", DEFAULT_ADAPTER]
+
+        image = Image.new("RGB", (64, 64))
+        assert (upscaler._batch_key({"image": image, "num_inference_steps": 1, "guidance_scale": 1,
+                                     "strength": 1, "adapter": "anime"})
+                != upscaler._batch_key({"image": image, "num_inference_steps": 1, "guidance_scale": 1,
+                                        "strength": 1, "adapter": DEFAULT_ADAPTER}))
+
+
+class TestAdapterEndpoints:
+    """اختبارات التحقق من المحول قبل قبول المهمة"""
+
+    @pytest.mark.parametrize("swappable", [True, False])
+    def test_snapshot_rejects_extra_adapters(self, adapter_config, monkeypatch, swappable):
+        """اختبار رفض المحولات غير الافتراضية بـ 400 عند التشغيل من لقطة مدمجة بدلاً من فشل المهمة لاحقاً"""
+
+        class FakePool:
+            is_loaded = True
+
+            def __init__(self):
+                self.swappable = swappable
+
+        monkeypatch.setattr(settings, "LORA_MODEL_PATH", adapter_config["lora_path"])
+        monkeypatch.setattr(settings, "LORA_ADAPTERS_DIR", adapter_config["adapters_dir"])
+        monkeypatch.setattr(app_module, "upscaler", FakePool())
+        monkeypatch.setattr(app_module, "file_handler", object())
+        monkeypatch.setattr(app_module, "task_queue", TaskQueue(FakePool(), config={
+            "max_queue_size": 10, "num_workers": 1, "history_size": 100, "processing_timeout": 0
+        }))
+        client = TestClient(app_module.app)
+
+        # بدون ملف: التحقق من المحول يسبق التحقق من الملف
+        response = client.post("/upscale", params={"adapter": "anime"})
+        assert response.status_code == 400
+        assert ("snapshot" in response.json()["detail"]) == (not swappable)
+        default = client.post("/upscale", params={"adapter": DEFAULT_ADAPTER})
+        assert default.json()["detail"] == "File is required"
+
+        if not swappable:
+            buffer = io.BytesIO()
+            Image.new("RGB", (16, 16)).save(buffer, "PNG")
+            batch = client.post("/upscale/batch", params={"adapter": "anime"},
+                                files=[("files", ("input.png", buffer.getvalue(), "image/png"))])
+            assert batch.status_code == 400
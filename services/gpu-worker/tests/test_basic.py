@@ -6,8 +6,11 @@ import pytest
 import asyncio
 from fastapi.testclient import TestClient
 from unittest.mock import Mock, patch
+import hashlib
+import io
 import tempfile
 import os
+from fastapi import UploadFile
 from PIL import Image
 
 # Import the app
@@ -16,7 +19,9 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from app import app
 from core.config import settings
-from utils.file_handler import FileHandler
+from utils.file_handler import FileHandler, UploadTooLargeError
+from utils.upload_limit import UploadLimitMiddleware, MULTIPART_OVERHEAD
+from core.image_context import ImageContext
 from utils.gpu_monitor import GPUMonitor
 
 
@@ -97,6 +102,50 @@ class TestFileHandler:
         finally:
             os.unlink(temp_file.name)
     
+    @pytest.mark.asyncio
+    async def test_validate_image_context_does_not_decode(self, file_handler, test_image):
+        """اختبار التحقق من الترويسة فقط وفك الترميز مرة واحدة لاحقاً"""
+        context = ImageContext(test_image)
+        
+        assert await file_handler.validate_image(context) is True
+        assert context.is_decoded is False
+        assert file_handler.get_file_info(context)["width"] == 100
+        
+        decoded = context.decode()
+        assert decoded.mode == "RGB"
+        assert context.decode() is decoded
+        
+        context.release()
+        assert context.is_decoded is False
+    
+    @pytest.mark.asyncio
+    async def test_save_upload_streams_and_hashes(self, tmp_path, monkeypatch):
+        """اختبار حفظ الملف على دفعات مع حساب البصمة"""
+        monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+        monkeypatch.setattr(settings, "UPLOAD_CHUNK_SIZE", 1000)
+        handler = FileHandler()
+        
+        content = os.urandom(4500)
+        upload = await handler.save_upload(UploadFile(file=io.BytesIO(content), filename="a.png"))
+        
+        assert upload.size == len(content)
+        assert upload.content_hash == hashlib.sha256(content).hexdigest()
+        with open(upload.path, "rb") as f:
+            assert f.read() == content
+    
+    @pytest.mark.asyncio
+    async def test_save_upload_rejects_oversized_stream(self, tmp_path, monkeypatch):
+        """اختبار إيقاف الرفع فور تجاوز الحد حتى بدون حجم معلن"""
+        monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+        monkeypatch.setattr(settings, "UPLOAD_CHUNK_SIZE", 1000)
+        monkeypatch.setattr(settings, "MAX_FILE_SIZE", 2500)
+        handler = FileHandler()
+        
+        with pytest.raises(UploadTooLargeError):
+            await handler.save_upload(UploadFile(file=io.BytesIO(b"x" * 5000), filename="a.png"))
+        
+        assert list(tmp_path.iterdir()) == []
+    
     def test_get_file_info(self, file_handler, test_image):
         """اختبار الحصول على معلومات الملف"""
         info = file_handler.get_file_info(test_image)
@@ -118,6 +167,57 @@ class TestFileHandler:
         assert "temp" in stats
 
 
+class TestUploadLimit:
+    """اختبارات رفض الطلبات الكبيرة قبل تحليل multipart"""
+    
+    @pytest.mark.asyncio
+    async def test_declared_length_rejected_before_reading(self):
+        """اختبار الرفض من Content-Length دون قراءة الجسم أو الوصول إلى التطبيق"""
+        reached = []
+        sent = []
+        
+        async def inner(scope, receive, send):
+            reached.append(scope["path"])
+        
+        async def receive():
+            raise AssertionError("الجسم لا يجب أن يُقرأ")
+        
+        async def send(message):
+            sent.append(message)
+        
+        middleware = UploadLimitMiddleware(inner, limit_for=lambda path: 100 if path == "/upscale" else None)
+        scope = {"type": "http", "method": "POST", "path": "/upscale", "headers": [(b"content-length", b"5000")]}
+        await middleware(scope, receive, send)
+        
+        assert reached == []
+        assert sent[0]["status"] == 413
+        
+        await middleware({**scope, "path": "/other"}, receive, send)
+        assert reached == ["/other"]
+    
+    def test_streamed_body_rejected_while_receiving(self, monkeypatch):
+        """اختبار الرفض أثناء الاستلام عندما لا يُعلن الحجم (chunked)"""
+        monkeypatch.setattr(settings, "MAX_FILE_SIZE", 1000)
+        boundary = "limit-test"
+        body = (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.png\"\r\n"
+            f"Content-Type: image/png\r\n\r\n"
+        ).encode() + b"x" * (1000 + MULTIPART_OVERHEAD) + f"\r\n--{boundary}--\r\n".encode()
+        
+        def chunks():
+            for start in range(0, len(body), 16 * 1024):
+                yield body[start:start + 16 * 1024]
+        
+        response = TestClient(app).post(
+            "/upscale",
+            content=chunks(),
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        )
+        
+        assert response.status_code == 413
+        assert "too large" in response.json()["detail"]
+
+
 class TestGPUMonitor:
     """اختبارات مراقب GPU"""
     
@@ -0,0 +1,300 @@
+"""
+اختبارات المعالجة الدفعية
+"""
+
+import pytest
+import asyncio
+import io
+import json
+import os
+import sys
+import zipfile
+from datetime import datetime
+from fastapi.testclient import TestClient
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import app as app_module
+from core.config import settings
+from core.models import UpscaleResponse, ProcessingStatus
+from core.batch_pipeline import BatchItem, BatchPipeline
+from core.cancellation import JobCancelled
+from core.task_queue import TaskQueue
+from utils.file_handler import FileHandler
+from utils.archive import ZipStream
+
+
+def _png_bytes(color="blue", size=(16, 16)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color=color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class FakeUpscaler:
+    """معالج وهمي يسجل ترتيب المراحل ويكتب نتيجة صغيرة"""
+
+    replica_count = 1
+
+    def __init__(self, result_dir=None, delay=0.0, fail=()):
+        self.result_dir = result_dir
+        self.delay = delay
+        self.fail = set(fail)
+        self.events = []
+        self.inflight = 0
+        self.max_inflight = 0
+        self.queue = None
+        self.queue_sizes = []
+
+    async def prepare_input(self, context, timer=None, quality_tier=None):
+        self.events.append(("prepare", context.path))
+        return Image.open(context.path).convert("RGB"), (16, 16)
+
+    async def upscale_image(self, image, prompt, task_id=None, prepared=None, cancel_token=None, **kwargs):
+        self.events.append(("infer", image.path))
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        if self.queue:
+            self.queue_sizes.append(self.queue.qsize())
+        try:
+            await asyncio.sleep(self.delay)
+            if cancel_token:
+                cancel_token.check()
+        except JobCancelled as e:
+            return UpscaleResponse(task_id=task_id or "batch", status=ProcessingStatus.CANCELLED, error_message=str(e))
+        finally:
+            self.inflight -= 1
+
+        if os.path.basename(image.path) in self.fail:
+            raise RuntimeError("inference failed")
+
+        output_path = None
+        if self.result_dir:
+            output_path = os.path.join(self.result_dir, f"{os.path.basename(image.path)}.png")
+            prepared[0].save(output_path, "PNG")
+        return UpscaleResponse(
+            task_id=task_id or "batch",
+            status=ProcessingStatus.COMPLETED,
+            output_path=output_path,
+            file_size=os.path.getsize(output_path) if output_path else None,
+            completed_at=datetime.now()
+        )
+
+
+@pytest.fixture
+def file_handler(tmp_path, monkeypatch):
+    for name in ("UPLOAD_DIR", "RESULT_DIR", "TEMP_DIR"):
+        monkeypatch.setattr(settings, name, str(tmp_path / name.lower()))
+    return FileHandler()
+
+
+def _saved_items(file_handler, tmp_path, count):
+    """عناصر دفعة من صور محفوظة في مجلد الرفع"""
+    items = []
+    for index in range(count):
+        path = os.path.join(file_handler.config["upload_dir"], f"image_{index}.png")
+        with open(path, "wb") as f:
+            f.write(_png_bytes())
+        file_handler.storage.add(path, pinned=True)
+        upload = type("Upload", (), {"path": path, "content_hash": f"hash{index}", "size": os.path.getsize(path)})()
+        items.append(BatchItem(index=index, name=f"image_{index}.png", upload=upload))
+    return items
+
+
+async def _iterate(items):
+    for item in items:
+        yield item
+
+
+class TestBatchPipeline:
+    """اختبارات خط المعالجة"""
+
+    @pytest.mark.asyncio
+    async def test_stages_overlap(self, file_handler, tmp_path):
+        """اختبار تحضير الصورة التالية أثناء استدلال الحالية وحذف ملفات الإدخال"""
+        upscaler = FakeUpscaler(result_dir=file_handler.config["result_dir"], delay=0.05)
+        items = _saved_items(file_handler, tmp_path, 4)
+        pipeline = BatchPipeline(upscaler, file_handler, config={"max_files": 10, "depth": 2})
+
+        results = [item async for item in pipeline.run(_iterate(items), "prompt")]
+
+        assert sorted(item.index for item in results) == [0, 1, 2, 3]
+        assert all(item.status == ProcessingStatus.COMPLETED for item in results)
+        assert all(item.result.download_url.startswith("/download/") for item in results)
+        # كل الصور حُضّرت قبل انتهاء استدلال أول صورتين
+        assert [kind for kind, _ in upscaler.events[:4]].count("prepare") >= 3
+        assert upscaler.max_inflight == 2
+        assert not any(os.path.exists(item.upload.path) for item in items)
+        assert pipeline.summary["completed"] == pipeline.summary["total"] == 4
+
+    @pytest.mark.asyncio
+    async def test_failed_items_do_not_stop_batch(self, file_handler, tmp_path):
+        """اختبار تسجيل أخطاء العناصر في البيان واستمرار الدفعة"""
+        upscaler = FakeUpscaler(fail={"image_1.png"})
+        items = _saved_items(file_handler, tmp_path, 3)
+        with open(items[2].upload.path, "wb") as f:
+            f.write(b"not an image")
+        items.append(BatchItem(index=3, name="broken.png", error="Extraction failed"))
+        pipeline = BatchPipeline(upscaler, file_handler, config={"max_files": 10, "depth": 1})
+
+        results = {item.index: item async for item in pipeline.run(_iterate(items), "prompt")}
+
+        assert results[0].status == ProcessingStatus.COMPLETED
+        assert results[1].to_dict()["error_message"] == "inference failed"
+        assert results[2].to_dict()["error_message"] == "Invalid image file"
+        assert results[3].to_dict() == {"index": 3, "name": "broken.png", "status": "failed", "error_message": "Extraction failed"}
+        assert pipeline.summary["failed"] == 3
+
+    @pytest.mark.asyncio
+    async def test_early_close_cancels_remaining(self, file_handler, tmp_path):
+        """اختبار أن إغلاق المستهلك يلغي الاستدلال ويحذف الملفات المعلقة"""
+        upscaler = FakeUpscaler(delay=0.05)
+        items = _saved_items(file_handler, tmp_path, 6)
+        pipeline = BatchPipeline(upscaler, file_handler, config={"max_files": 10, "depth": 1})
+
+        pulled = []
+
+        async def source():
+            for item in items:
+                pulled.append(item)
+                yield item
+
+        results = pipeline.run(source(), "prompt")
+        await results.__anext__()
+        await results.aclose()
+
+        # الصور التي دخلت الخط حُذفت والباقي لم يُقرأ من المصدر
+        assert 1 < len(pulled) < 6
+        assert not any(os.path.exists(item.upload.path) for item in pulled)
+        assert sum(1 for kind, _ in upscaler.events if kind == "infer") < 6
+
+    @pytest.mark.asyncio
+    async def test_items_enforce_processing_timeout(self, file_handler, tmp_path):
+        """اختبار أن لكل عنصر مهلة PROCESSING_TIMEOUT"""
+        upscaler = FakeUpscaler(delay=0.05)
+        items = _saved_items(file_handler, tmp_path, 2)
+        pipeline = BatchPipeline(upscaler, file_handler, config={"max_files": 10, "depth": 1, "processing_timeout": 0.01})
+
+        results = [item async for item in pipeline.run(_iterate(items), "prompt")]
+
+        assert all(item.status == ProcessingStatus.CANCELLED for item in results)
+        assert all(item.token.reason == "deadline" for item in results)
+        assert pipeline.summary["cancelled"] == 2
+
+    @pytest.mark.asyncio
+    async def test_items_share_queue_capacity(self, file_handler, tmp_path):
+        """اختبار أن عناصر الدفعة تُحسب ضمن سعة الطابور ولا تتجاوزها"""
+        queue = TaskQueue(FakeUpscaler(), config={"max_queue_size": 2, "num_workers": 1, "history_size": 10})
+        queue.submit("/tmp/input.png", "prompt")
+        upscaler = FakeUpscaler(delay=0.01)
+        upscaler.queue = queue
+        items = _saved_items(file_handler, tmp_path, 4)
+        pipeline = BatchPipeline(upscaler, file_handler, config={"max_files": 10, "depth": 2}, task_queue=queue)
+
+        results = [item async for item in pipeline.run(_iterate(items), "prompt")]
+
+        assert len(results) == 4
+        assert max(upscaler.queue_sizes) == 2
+        assert queue.get_stats()["reserved"] == 0
+        assert queue.qsize() == 1
+
+
+class TestArchives:
+    """اختبارات الأرشيفات"""
+
+    @pytest.mark.asyncio
+    async def test_extract_skips_non_images(self, file_handler, tmp_path):
+        """اختبار استخراج الصور فقط وتسجيلها في الفهرس"""
+        path = tmp_path / "batch.zip"
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("a.png", _png_bytes())
+            archive.writestr("nested/b.jpg", _png_bytes())
+            archive.writestr("notes.txt", "text")
+            archive.writestr("__MACOSX/._a.png", "meta")
+
+        assert file_handler.list_archive(str(path)) == ["a.png", "nested/b.jpg"]
+
+        members = [(name, member) async for name, member in file_handler.extract_archive(str(path))]
+
+        assert [name for name, _ in members] == ["a.png", "nested/b.jpg"]
+        uploads = file_handler.storage.directories["uploads"]
+        for _, member in members:
+            assert os.path.exists(member.path)
+            assert os.path.basename(member.path) in uploads.pinned
+
+    def test_zip_stream_is_readable(self, tmp_path):
+        """اختبار أن الأرشيف المتدفق صالح"""
+        source = tmp_path / "result.png"
+        source.write_bytes(_png_bytes())
+
+        stream = ZipStream()
+        data = stream.add_file(str(source), "0000_result.png") + stream.add_bytes("manifest.json", b"{}") + stream.close()
+
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            assert archive.namelist() == ["0000_result.png", "manifest.json"]
+            assert archive.read("0000_result.png") == source.read_bytes()
+
+
+class TestBatchEndpoint:
+    """اختبارات POST /upscale/batch"""
+
+    @pytest.fixture
+    def client(self, file_handler, monkeypatch):
+        monkeypatch.setattr(app_module, "upscaler", FakeUpscaler(result_dir=file_handler.config["result_dir"]))
+        monkeypatch.setattr(app_module, "file_handler", file_handler)
+        monkeypatch.setattr(app_module, "task_queue", TaskQueue(FakeUpscaler(), config={
+            "max_queue_size": 10, "num_workers": 1, "history_size": 10
+        }))
+        return TestClient(app_module.app)
+
+    def test_manifest_output(self, client):
+        """اختبار بيان NDJSON لملفات متعددة وأرشيف"""
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zf:
+            zf.writestr("c.png", _png_bytes())
+        files = [
+            ("files", ("a.png", _png_bytes(), "image/png")),
+            ("files", ("b.png", _png_bytes("red"), "image/png")),
+            ("files", ("more.zip", archive.getvalue(), "application/zip")),
+        ]
+
+        response = client.post("/upscale/batch", files=files)
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert sorted(line["name"] for line in lines[:-1]) == ["a.png", "b.png", "c.png"]
+        assert all(line["status"] == "completed" for line in lines[:-1])
+        assert lines[-1]["summary"]["completed"] == 3
+
+    def test_archive_output(self, client):
+        """اختبار إرجاع النتائج كأرشيف zip مع البيان"""
+        files = [("files", ("a.png", _png_bytes(), "image/png"))]
+
+        response = client.post("/upscale/batch", params={"output": "archive"}, files=files)
+
+        assert response.headers["content-type"] == "application/zip"
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            manifest = json.loads(archive.read("manifest.json"))
+            assert archive.namelist() == ["0000_a.png", "manifest.json"]
+        assert manifest["items"][0]["file"] == "0000_a.png"
+        assert manifest["summary"]["total"] == 1
+
+    def test_rejects_invalid_requests(self, client, monkeypatch):
+        """اختبار رفض الملفات غير المدعومة والأرشيف التالف والدفعات الكبيرة"""
+        assert client.post("/upscale/batch", files=[("files", ("a.txt", b"text", "text/plain"))]).status_code == 400
+        assert client.post("/upscale/batch", files=[("files", ("a.zip", b"broken", "application/zip"))]).status_code == 400
+
+        monkeypatch.setattr(settings, "MAX_BATCH_FILES", 1)
+        files = [("files", (f"{name}.png", _png_bytes(), "image/png")) for name in "ab"]
+        assert client.post("/upscale/batch", files=files).status_code == 413
+        assert os.listdir(app_module.file_handler.config["upload_dir"]) == []
+
+    def test_rejects_when_queue_full(self, client):
+        """اختبار رفض الدفعة قبل حفظها إذا كان الطابور ممتلئاً"""
+        for _ in range(10):
+            app_module.task_queue.submit("/tmp/input.png", "prompt")
+
+        files = [("files", ("a.png", _png_bytes(), "image/png"))]
+        assert client.post("/upscale/batch", files=files).status_code == 503
+        assert os.listdir(app_module.file_handler.config["upload_dir"]) == []
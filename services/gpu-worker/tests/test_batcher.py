@@ -0,0 +1,144 @@
+"""
+اختبارات مُجمِّع الدفعات
+"""
+
+import pytest
+import asyncio
+import os
+import sys
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from core.config import settings
+from core.models import ProcessingStatus
+from core.batcher import MicroBatcher
+from core.upscaler import FluxUpscaler
+
+
+class RecordingBatchRunner:
+    """منفذ دفعات وهمي يسجل أحجام الدفعات"""
+
+    def __init__(self, fail: bool = False):
+        self.batches = []
+        self.fail = fail
+
+    async def __call__(self, params_list):
+        self.batches.append(len(params_list))
+        if self.fail:
+            raise RuntimeError("batch failed")
+        return [params["value"] * 10 for params in params_list]
+
+
+class CountingFakePipeline:
+    """pipeline وهمي يسجل حجم كل استدعاء"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, **kwargs):
+        images = kwargs["image"] if isinstance(kwargs["image"], list) else [kwargs["image"]]
+        self.calls.append(len(images))
+
+        class Output:
+            pass
+
+        output = Output()
+        output.images = [image.copy() for image in images]
+        return output
+
+
+class TestMicroBatcher:
+    """اختبارات التجميع"""
+
+    @pytest.mark.asyncio
+    async def test_disabled_runs_single(self):
+        """اختبار التشغيل الفردي عند حجم دفعة 1"""
+        runner = RecordingBatchRunner()
+        batcher = MicroBatcher(runner, max_batch_size=1)
+
+        results = await asyncio.gather(*(batcher.submit("k", {"value": i}) for i in range(3)))
+
+        assert results == [0, 10, 20]
+        assert runner.batches == [1, 1, 1]
+
+    @pytest.mark.asyncio
+    async def test_compatible_requests_batched(self):
+        """اختبار دمج الطلبات المتوافقة وتوزيع النتائج"""
+        runner = RecordingBatchRunner()
+        batcher = MicroBatcher(runner, max_batch_size=4, window_ms=50)
+
+        results = await asyncio.gather(*(batcher.submit("k", {"value": i}) for i in range(4)))
+
+        assert results == [0, 10, 20, 30]
+        assert runner.batches == [4]
+
+    @pytest.mark.asyncio
+    async def test_window_flushes_partial_batch(self):
+        """اختبار تشغيل دفعة ناقصة بعد انتهاء النافذة"""
+        runner = RecordingBatchRunner()
+        batcher = MicroBatcher(runner, max_batch_size=8, window_ms=5)
+
+        results = await asyncio.gather(*(batcher.submit("k", {"value": i}) for i in range(3)))
+
+        assert results == [0, 10, 20]
+        assert runner.batches == [3]
+        assert batcher.pending_count() == 0
+
+    @pytest.mark.asyncio
+    async def test_incompatible_requests_split(self):
+        """اختبار فصل الطلبات غير المتوافقة"""
+        runner = RecordingBatchRunner()
+        batcher = MicroBatcher(runner, max_batch_size=4, window_ms=5)
+
+        await asyncio.gather(
+            batcher.submit("a", {"value": 1}),
+            batcher.submit("b", {"value": 2}),
+            batcher.submit("a", {"value": 3})
+        )
+
+        assert sorted(runner.batches) == [1, 2]
+
+    @pytest.mark.asyncio
+    async def test_errors_propagate_to_all(self):
+        """اختبار وصول الخطأ لكل طلبات الدفعة"""
+        batcher = MicroBatcher(RecordingBatchRunner(fail=True), max_batch_size=2, window_ms=5)
+
+        results = await asyncio.gather(
+            batcher.submit("k", {"value": 1}),
+            batcher.submit("k", {"value": 2}),
+            return_exceptions=True
+        )
+
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+
+class TestUpscalerBatching:
+    """اختبارات التجميع داخل المعالج"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_pipeline_call(self, tmp_path, monkeypatch):
+        """اختبار تشغيل الطلبات المتزامنة في استدعاء pipeline واحد"""
+        monkeypatch.setattr(settings, "RESULT_DIR", str(tmp_path / "results"))
+        monkeypatch.setattr(settings, "MAX_BATCH_SIZE", 4)
+        monkeypatch.setattr(settings, "BATCH_WINDOW_MS", 50.0)
+
+        inputs = []
+        for i, size in enumerate([(60, 70), (64, 64), (70, 60), (64, 66)]):
+            path = tmp_path / f"input_{i}.png"
+            Image.new("RGB", size, color="red").save(path, "PNG")
+            inputs.append(str(path))
+
+        upscaler = FluxUpscaler()
+        upscaler.device = "cpu"
+        upscaler.pipeline = CountingFakePipeline()
+        upscaler.is_loaded = True
+
+        try:
+            results = await asyncio.gather(*(upscaler.upscale_image(path, "prompt") for path in inputs))
+        finally:
+            upscaler.executor.shutdown()
+
+        assert all(result.status == ProcessingStatus.COMPLETED for result in results)
+        assert upscaler.pipeline.calls == [4]
+        assert len({result.output_path for result in results}) == 4
@@ -0,0 +1,199 @@
+"""
+اختبارات أداة قياس الأداء
+"""
+
+import pytest
+import os
+import sys
+import json
+import asyncio
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from benchmarks.run import summarize, flatten, compare, host_mismatch, bench_e2e, main
+from benchmarks.fake_pipeline import FakeFluxPipeline, load_pipeline
+from core.config import settings
+
+
+def _results(p50, throughput):
+    return {
+        "stages": {"decode": {"n": 5, "p50_ms": p50, "p95_ms": p50 * 2}},
+        "e2e": {"c1": {"p50_ms": p50, "p95_ms": p50 * 2, "throughput_rps": throughput}}
+    }
+
+
+class TestComparison:
+    """اختبارات مقارنة النتائج بخط الأساس"""
+
+    def test_summarize(self):
+        """اختبار حساب النسب المئوية بالميلي ثانية"""
+        summary = summarize([0.001 * i for i in range(1, 101)])
+
+        assert summary["n"] == 100
+        assert summary["p50_ms"] == pytest.approx(50, abs=1)
+        assert summary["p95_ms"] == pytest.approx(95, abs=1)
+        assert summary["max_ms"] == pytest.approx(100)
+
+    def test_flatten_keeps_compared_metrics(self):
+        """اختبار تسطيح النتائج مع إهمال الحقول غير المقارنة"""
+        flat = flatten(_results(10, 5))
+
+        assert flat["stages.decode.p50_ms"] == 10
+        assert flat["e2e.c1.throughput_rps"] == 5
+        assert "stages.decode.n" not in flat
+
+    def test_no_regression_within_tolerance(self):
+        """اختبار عدم الإبلاغ عن تراجع ضمن الحد المسموح"""
+        report = compare(_results(12, 4.5), _results(10, 5), tolerance=0.3)
+
+        assert report
+        assert not any(row["regression"] for row in report)
+
+    def test_latency_and_throughput_regressions(self):
+        """اختبار الإبلاغ عن زيادة الزمن وانخفاض الإنتاجية"""
+        report = {row["metric"]: row for row in compare(_results(20, 2), _results(10, 5), tolerance=0.3)}
+
+        assert report["stages.decode.p50_ms"]["regression"]
+        assert report["stages.decode.p50_ms"]["change_pct"] == 100.0
+        assert report["e2e.c1.throughput_rps"]["regression"]
+
+    def test_improvement_is_not_regression(self):
+        """اختبار أن التحسن لا يعتبر تراجعاً"""
+        report = compare(_results(5, 10), _results(10, 5), tolerance=0.3)
+
+        assert not any(row["regression"] for row in report)
+
+
+class FakeClient:
+    """عميل وهمي يعيد حالة ثابتة لكل مهمة"""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.posted = 0
+
+    async def post(self, url, files=None):
+        self.posted += 1
+        return FakeResponse(202, {"task_id": str(self.posted - 1)})
+
+    async def get(self, url):
+        return FakeResponse(200, {"status": self.statuses[int(url.rsplit("/", 1)[-1])]})
+
+
+class FakeResponse:
+    """استجابة HTTP وهمية"""
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class TestEndToEndPolling:
+    """اختبارات متابعة المهام في القياس الكامل"""
+
+    def test_cancelled_and_stuck_tasks_end_polling(self):
+        """اختبار اعتبار الإلغاء حالة نهائية وإنهاء متابعة المهمة العالقة عند انقضاء المهلة"""
+        client = FakeClient(["completed", "cancelled", "processing"])
+
+        result = asyncio.run(asyncio.wait_for(
+            bench_e2e(client, b"png", concurrency=3, requests=3, poll_timeout=0.05), timeout=5
+        ))
+
+        assert result["failures"] == 2
+        assert result["timeouts"] == 1
+        assert result["n"] == 1
+
+    def test_no_latency_without_completed_tasks(self):
+        """اختبار عدم تسجيل زمن أو إنتاجية عندما لا تكتمل أي مهمة"""
+        client = FakeClient(["failed", "cancelled"])
+
+        result = asyncio.run(bench_e2e(client, b"png", concurrency=2, requests=2))
+
+        assert result["n"] == 0
+        assert "p50_ms" not in result
+        assert result["throughput_rps"] == 0
+        assert result["failures"] == 2
+
+        # الإنتاجية الصفرية تظهر تراجعاً والأزمنة الغائبة تُتخطى
+        baseline = {"e2e": {"c2": {"p50_ms": 10, "p95_ms": 20, "throughput_rps": 5}}}
+        report = compare({"e2e": {"c2": result}}, baseline, tolerance=0.3)
+        assert [row["metric"] for row in report] == ["e2e.c2.throughput_rps"]
+        assert report[0]["regression"]
+
+    def test_host_mismatch(self):
+        """اختبار اكتشاف اختلاف جهاز خط الأساس"""
+        host = {"environment": {"machine": "x86_64", "cpu_model": "A", "cpu_count": 8}}
+        other = {"environment": {"machine": "x86_64", "cpu_model": "B", "cpu_count": 8}}
+
+        assert host_mismatch(host, host) == []
+        assert host_mismatch(host, other) == ["cpu_model"]
+        assert host_mismatch(host, {}) == ["machine", "cpu_model", "cpu_count"]
+
+
+class TestFakePipeline:
+    """اختبارات الـ pipeline الوهمي"""
+
+    def test_returns_images(self):
+        """اختبار إعادة صورة لكل مدخل"""
+        from PIL import Image
+
+        pipeline = FakeFluxPipeline(latency=0, scale=2)
+        output = pipeline(image=[Image.new("RGB", (8, 8))] * 2, prompt=["x", "x"])
+
+        assert [img.size for img in output.images] == [(16, 16), (16, 16)]
+        assert pipeline.calls == 1
+
+    def test_load_by_spec(self):
+        """اختبار تحميل pipeline بديل بمسار module:Class"""
+        pipeline = load_pipeline("benchmarks.fake_pipeline:FakeFluxPipeline", latency=0.2)
+
+        assert isinstance(pipeline, FakeFluxPipeline)
+        assert pipeline.latency == 0.2
+
+
+class TestRun:
+    """اختبار تشغيل قصير كامل"""
+
+    def test_quick_run(self, tmp_path, monkeypatch):
+        """اختبار تشغيل كل المراحل ومقارنة النتائج بخط أساس"""
+        for name in ("UPLOAD_DIR", "RESULT_DIR", "TEMP_DIR", "MAX_IMAGE_SIZE", "MAX_FILE_SIZE"):
+            monkeypatch.setattr(settings, name, getattr(settings, name))
+
+        output = tmp_path / "latest.json"
+        baseline = tmp_path / "baseline.json"
+        args = [
+            "--concurrency", "1,2", "--requests", "2", "--iterations", "2",
+            "--latency", "0", "--image-size", "64", "--max-image-size", "128",
+            "--presets", "png_fast", "--output", str(output), "--baseline", str(baseline)
+        ]
+
+        assert main(args + ["--update-baseline"]) == 0
+        results = json.loads(output.read_text())
+
+        assert set(results["stages"]) == {"ingest", "decode", "resize", "encode", "save"}
+        assert set(results["e2e"]) == {"c1", "c2"}
+        assert results["e2e"]["c2"]["failures"] == 0
+        assert baseline.exists()
+
+        # مقارنة مع خط أساس بطيء جداً - لا يوجد تراجع
+        slow = json.loads(baseline.read_text())
+        for stage in slow["stages"].values():
+            for summary in ([stage] if "p50_ms" in stage else stage.values()):
+                summary["p50_ms"] = summary["p95_ms"] = 1e9
+        for level in slow["e2e"].values():
+            level["p50_ms"] = level["p95_ms"] = 1e9
+            level["throughput_rps"] = 1e-9
+        baseline.write_text(json.dumps(slow))
+
+        assert main(args) == 0
+        assert json.loads(output.read_text())["comparison"]
+
+        # خط أساس من جهاز آخر - تُتخطى المقارنة
+        slow["environment"]["cpu_model"] = "another cpu"
+        baseline.write_text(json.dumps(slow))
+        assert main(args) == 0
+        assert "comparison" not in json.loads(output.read_text())
+        assert main(args + ["--force-compare"]) == 0
+        assert json.loads(output.read_text())["comparison"]
@@ -0,0 +1,218 @@
+"""
+اختبارات المهلة وإلغاء المهام
+"""
+
+import pytest
+import asyncio
+import os
+import sys
+from fastapi.testclient import TestClient
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import app as app_module
+from core.config import settings
+from core.models import ProcessingStatus
+from core.cancellation import CancellationToken, JobCancelled, StepGuard
+from core.task_queue import TaskQueue
+from core.upscaler import FluxUpscaler
+from core.monitoring import GPU_SECONDS_SAVED
+from conftest import FakeUpscaler, queue_config
+
+
+class FakeClock:
+    """ساعة يتحكم بها الاختبار"""
+
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class SteppingFakePipeline:
+    """pipeline وهمي يستدعي callback_on_step_end بعد كل خطوة ويلغي المهمة عند خطوة محددة"""
+
+    def __init__(self, cancel_at=None):
+        self.cancel_at = cancel_at
+        self.token = None
+        self.steps = 0
+
+    def __call__(self, num_inference_steps, callback_on_step_end=None, **kwargs):
+        for step in range(num_inference_steps):
+            self.steps += 1
+            if step == self.cancel_at:
+                self.token.cancel()
+            if callback_on_step_end:
+                callback_on_step_end(self, step, None, {})
+
+        class Output:
+            images = [kwargs["image"].copy()]
+
+        return Output()
+
+
+class TestCancellationToken:
+    """اختبارات حالة الإلغاء"""
+
+    def test_deadline(self):
+        """اختبار انتهاء المهلة"""
+        clock = FakeClock()
+        token = CancellationToken(timeout=5, clock=clock)
+
+        assert not token.cancelled
+        assert token.remaining() == 5
+
+        clock.now += 5
+        assert token.reason == "deadline"
+        with pytest.raises(JobCancelled):
+            token.check()
+
+    def test_first_reason_wins(self):
+        """اختبار الاحتفاظ بأول سبب للإلغاء"""
+        token = CancellationToken()
+        token.cancel("disconnected")
+        token.cancel("cancelled")
+
+        assert token.reason == "disconnected"
+        assert token.deadline is None
+
+    def test_step_guard_estimates_saved_time(self):
+        """اختبار الإيقاف بين الخطوات وتقدير الوقت الموفر"""
+        clock = FakeClock(0)
+        token = CancellationToken()
+        guard = StepGuard([token], total_steps=10, clock=clock)
+
+        clock.now = 2.0
+        assert guard(None, 1, None, {"latents": 1}) == {"latents": 1}
+
+        token.cancel()
+        clock.now = 3.0
+        with pytest.raises(JobCancelled) as error:
+            guard(None, 2, None, {})
+
+        assert error.value.reason == "cancelled"
+        assert error.value.saved_seconds == pytest.approx(7.0)
+
+    def test_step_guard_keeps_batch_running(self):
+        """اختبار استمرار الدفعة ما دامت فيها مهمة مطلوبة"""
+        cancelled, active = CancellationToken(), CancellationToken()
+        cancelled.cancel()
+        guard = StepGuard([cancelled, active], total_steps=4)
+
+        assert guard(None, 0, None, {}) == {}
+
+
+class TestUpscalerCancellation:
+    """اختبارات إيقاف الاستدلال في المعالج"""
+
+    @pytest.mark.asyncio
+    async def test_stops_between_steps(self, tmp_path, monkeypatch):
+        """اختبار إيقاف الـ pipeline بعد الإلغاء وعدم حفظ نتيجة"""
+        monkeypatch.setattr(settings, "RESULT_DIR", str(tmp_path / "results"))
+        path = tmp_path / "input.png"
+        Image.new("RGB", (64, 64), color="blue").save(path, "PNG")
+
+        upscaler = FluxUpscaler()
+        upscaler.device = "cpu"
+        upscaler.pipeline = SteppingFakePipeline(cancel_at=2)
+        upscaler.is_loaded = True
+        upscaler.processing_config = {**upscaler.processing_config, "enable_tiling": False}
+
+        token = CancellationToken()
+        upscaler.pipeline.token = token
+        saved_before = GPU_SECONDS_SAVED._value.get()
+        try:
+            result = await upscaler.upscale_image(str(path), "prompt", cancel_token=token, num_inference_steps=10)
+        finally:
+            upscaler.executor.shutdown()
+
+        assert result.status == ProcessingStatus.CANCELLED
+        assert result.metadata["cancel_reason"] == "cancelled"
+        assert upscaler.pipeline.steps == 3
+        assert GPU_SECONDS_SAVED._value.get() > saved_before
+        assert result.output_path is None
+
+
+class TestQueueCancellation:
+    """اختبارات الإلغاء في الطابور"""
+
+    @pytest.mark.asyncio
+    async def test_cancelled_pending_job_skips_gpu(self):
+        """اختبار أن المهمة الملغاة قبل بدئها لا تصل إلى المعالج"""
+        upscaler = FakeUpscaler()
+        queue = TaskQueue(upscaler, config=queue_config())
+
+        response = queue.submit("/tmp/input.png", "prompt")
+        assert queue.cancel(response.task_id).status == ProcessingStatus.CANCELLED
+
+        queue.start()
+        try:
+            task = await asyncio.wait_for(queue.wait(response.task_id), timeout=5)
+        finally:
+            await queue.stop()
+
+        assert task.status == ProcessingStatus.CANCELLED
+        assert upscaler.calls == []
+        assert queue.get_stats()["tasks"]["cancelled"] == 1
+
+    @pytest.mark.asyncio
+    async def test_deadline_starts_when_dequeued(self):
+        """اختبار أن الانتظار في الطابور لا يستهلك المهلة وأنها تبدأ عند سحب المهمة"""
+        upscaler = FakeUpscaler()
+        queue = TaskQueue(upscaler, config=queue_config(processing_timeout=0.05))
+
+        response = queue.submit("/tmp/input.png", "prompt")
+        job = queue._jobs[response.task_id]
+        await asyncio.sleep(0.1)
+        assert job.token.deadline is None
+
+        queue.start()
+        try:
+            task = await asyncio.wait_for(queue.wait(response.task_id), timeout=5)
+        finally:
+            await queue.stop()
+
+        assert task.status == ProcessingStatus.COMPLETED
+        assert upscaler.task_ids == [response.task_id]
+        assert job.token.deadline is not None
+
+    @pytest.mark.asyncio
+    async def test_cancelled_pending_job_frees_capacity(self):
+        """اختبار أن المهمة الملغاة في الانتظار لا تُحسب ضمن سعة الطابور"""
+        queue = TaskQueue(FakeUpscaler(), config=queue_config(max_queue_size=1))
+
+        response = queue.submit("/tmp/input.png", "prompt")
+        assert not queue.has_capacity()
+
+        queue.cancel(response.task_id)
+        assert queue.has_capacity() and queue.qsize() == 0
+        second = queue.submit("/tmp/input.png", "prompt")
+
+        queue.start()
+        try:
+            await asyncio.wait_for(queue.wait(second.task_id), timeout=5)
+        finally:
+            await queue.stop()
+
+        assert queue.qsize() == 0
+        assert queue.get(response.task_id).status == ProcessingStatus.CANCELLED
+        assert queue.get(second.task_id).status == ProcessingStatus.COMPLETED
+
+
+class TestCancelEndpoint:
+    """اختبارات DELETE /tasks/{id}"""
+
+    def test_cancel_pending_task(self, monkeypatch):
+        """اختبار إلغاء مهمة منتظرة ورفض المهام غير الموجودة"""
+        queue = TaskQueue(FakeUpscaler(), config=queue_config())
+        monkeypatch.setattr(app_module, "task_queue", queue)
+        response = queue.submit("/tmp/input.png", "prompt")
+
+        client = TestClient(app_module.app)
+        cancelled = client.delete(f"/tasks/{response.task_id}")
+
+        assert cancelled.status_code == 202
+        assert cancelled.json()["status"] == "cancelled"
+        assert client.delete("/tasks/does-not-exist").status_code == 404
@@ -0,0 +1,191 @@
+"""
+اختبارات نقطة تحميل النتائج
+"""
+
+import pytest
+import asyncio
+import os
+import sys
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import app as app_module
+from core.config import settings
+from utils.file_handler import FileHandler
+from utils.file_response import SendfileResponse, FileTruncatedError, parse_range
+
+
+CONTENT = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """عميل اختبار مع ملف نتيجة جاهز"""
+    result_dir = tmp_path / "results"
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(settings, "RESULT_DIR", str(result_dir))
+    monkeypatch.setattr(settings, "TEMP_DIR", str(tmp_path / "temp"))
+    monkeypatch.setattr(settings, "DOWNLOAD_ACCEL_PREFIX", "")
+    monkeypatch.setattr(app_module, "file_handler", FileHandler())
+
+    (result_dir / "upscaled_test.png").write_bytes(CONTENT)
+    (tmp_path / "secret.txt").write_text("secret")
+
+    return TestClient(app_module.app)
+
+
+class TestParseRange:
+    """اختبارات تحليل ترويسة Range"""
+
+    @pytest.mark.parametrize("header,expected", [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-", (100, 999)),
+        ("bytes=-100", (900, 999)),
+        ("bytes=900-5000", (900, 999)),
+        ("bytes=0-1,5-9", None),
+        ("items=0-1", None),
+    ])
+    def test_valid(self, header, expected):
+        """اختبار النطاقات الصحيحة أو المتجاهلة"""
+        assert parse_range(header, 1000) == expected
+
+    @pytest.mark.parametrize("header", ["bytes=1000-", "bytes=50-10", "bytes=-0"])
+    def test_unsatisfiable(self, header):
+        """اختبار النطاقات غير القابلة للتلبية"""
+        with pytest.raises(ValueError):
+            parse_range(header, 1000)
+
+
+class TestDownloadEndpoint:
+    """اختبارات /download"""
+
+    def test_full_download(self, client):
+        """اختبار تحميل الملف كاملاً مع ترويسات التخزين المؤقت"""
+        response = client.get("/download/upscaled_test.png")
+
+        assert response.status_code == 200
+        assert response.content == CONTENT
+        assert response.headers["content-type"] == "image/png"
+        assert response.headers["content-length"] == str(len(CONTENT))
+        assert response.headers["accept-ranges"] == "bytes"
+        assert response.headers["etag"].startswith('"')
+        assert "immutable" in response.headers["cache-control"]
+        assert "last-modified" in response.headers
+
+    def test_head(self, client):
+        """اختبار HEAD بدون جسم"""
+        response = client.head("/download/upscaled_test.png")
+
+        assert response.status_code == 200
+        assert response.content == b""
+        assert response.headers["content-length"] == str(len(CONTENT))
+
+    def test_conditional_requests(self, client):
+        """اختبار 304 عند تطابق ETag أو تاريخ التعديل"""
+        first = client.get("/download/upscaled_test.png")
+
+        by_etag = client.get("/download/upscaled_test.png", headers={"If-None-Match": first.headers["etag"]})
+        assert by_etag.status_code == 304
+        assert by_etag.content == b""
+
+        by_date = client.get(
+            "/download/upscaled_test.png",
+            headers={"If-Modified-Since": first.headers["last-modified"]}
+        )
+        assert by_date.status_code == 304
+
+        stale = client.get("/download/upscaled_test.png", headers={"If-None-Match": '"other"'})
+        assert stale.status_code == 200
+
+    def test_range_request(self, client):
+        """اختبار استئناف التحميل بطلب نطاق"""
+        response = client.get("/download/upscaled_test.png", headers={"Range": "bytes=100-199"})
+
+        assert response.status_code == 206
+        assert response.content == CONTENT[100:200]
+        assert response.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+
+    def test_if_range_mismatch_sends_full_file(self, client):
+        """اختبار تجاهل النطاق إذا تغير الملف"""
+        response = client.get(
+            "/download/upscaled_test.png",
+            headers={"Range": "bytes=100-199", "If-Range": '"old"'}
+        )
+
+        assert response.status_code == 200
+        assert response.content == CONTENT
+
+    def test_unsatisfiable_range(self, client):
+        """اختبار 416 لنطاق خارج الملف"""
+        response = client.get("/download/upscaled_test.png", headers={"Range": f"bytes={len(CONTENT)}-"})
+
+        assert response.status_code == 416
+        assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+    @pytest.mark.parametrize("filename", ["missing.png", "..%2Fsecret.txt", "%2E%2E"])
+    def test_not_found(self, client, filename):
+        """اختبار 404 للملفات المفقودة ومحاولات الخروج من مجلد النتائج"""
+        response = client.get(f"/download/{filename}")
+        assert response.status_code == 404
+
+    def test_accel_redirect(self, client, monkeypatch):
+        """اختبار تفويض الإرسال إلى nginx"""
+        monkeypatch.setattr(settings, "DOWNLOAD_ACCEL_PREFIX", "/protected/results/")
+
+        response = client.get("/download/upscaled_test.png")
+
+        assert response.status_code == 200
+        assert response.headers["x-accel-redirect"] == "/protected/results/upscaled_test.png"
+        assert response.content == b""
+
+
+class TestFallbackSend:
+    """اختبارات الإرسال على دفعات عندما لا يدعم الخادم sendfile"""
+
+    def _send(self, path, send, stat_result=None):
+        scope = {"type": "http", "method": "GET", "headers": [], "extensions": {}}
+        response = SendfileResponse(str(path), stat_result or os.stat(path))
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        asyncio.run(response(scope, receive, send))
+
+    def test_truncated_file_aborts(self, tmp_path, monkeypatch):
+        """اختبار قطع الاتصال بدلاً من جسم أقصر من Content-Length عند اقتطاع الملف أثناء الإرسال"""
+        monkeypatch.setattr("utils.file_response.CHUNK_SIZE", 1024)
+        path = tmp_path / "result.png"
+        path.write_bytes(CONTENT)
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+            if message["type"] == "http.response.body":
+                # اقتطاع الملف بعد أول دفعة
+                os.truncate(path, 2048)
+
+        with pytest.raises(FileTruncatedError):
+            self._send(path, send)
+
+        assert dict(messages[0]["headers"])[b"content-length"] == str(len(CONTENT)).encode()
+        assert all(message.get("more_body") for message in messages[1:])
+
+    def test_replaced_file_uses_opened_stat(self, tmp_path):
+        """اختبار أن الحجم والـ ETag من الملف المفتوح إذا استُبدل بعد stat"""
+        path = tmp_path / "result.png"
+        path.write_bytes(CONTENT)
+        stale = os.stat(path)
+        replacement = tmp_path / "replacement.png"
+        replacement.write_bytes(b"new")
+        os.replace(replacement, path)
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        self._send(path, send, stale)
+
+        assert dict(messages[0]["headers"])[b"content-length"] == b"3"
+        assert b"".join(message.get("body", b"") for message in messages[1:]) == b"new"
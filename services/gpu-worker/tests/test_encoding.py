@@ -0,0 +1,104 @@
+"""
+اختبارات ترميز الصور الناتجة
+"""
+
+import pytest
+import os
+import sys
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from core.config import settings
+from core.models import ProcessingStatus, OutputPreset
+from core.encoding import ImageEncoder, get_preset
+from core.upscaler import FluxUpscaler
+from conftest import IdentityFakePipeline
+
+
+@pytest.fixture
+def image():
+    """صورة للترميز"""
+    return Image.new("RGB", (64, 48), color="purple")
+
+
+class TestEncodingPresets:
+    """اختبارات إعدادات الترميز"""
+
+    @pytest.mark.parametrize("preset", [preset.value for preset in OutputPreset])
+    def test_every_preset_resolves(self, preset):
+        """اختبار وجود إعداد لكل قيمة في OutputPreset"""
+        assert get_preset(preset).name == preset
+
+    def test_unknown_preset(self):
+        """اختبار رفض إعداد غير معروف"""
+        with pytest.raises(ValueError):
+            get_preset("tiff")
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("workers", [0, 1])
+    async def test_encode_reports_time_and_bytes(self, image, tmp_path, workers):
+        """اختبار الترميز في خيط وفي عملية منفصلة"""
+        encoder = ImageEncoder(workers=workers)
+        encoder.start()
+        try:
+            output_path = tmp_path / "out.webp"
+            info = await encoder.encode(image, str(output_path), get_preset("webp"))
+        finally:
+            encoder.shutdown()
+
+        assert info["format"] == "WEBP"
+        assert info["output_bytes"] == output_path.stat().st_size
+        assert info["encode_time"] >= 0
+        with Image.open(output_path) as img:
+            assert img.format == "WEBP"
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mode", ["RGB", "RGBA", "L", "P"])
+    async def test_process_pool_preserves_pixels(self, tmp_path, mode):
+        """اختبار نقل البكسلات إلى عملية الترميز (ذاكرة مشتركة أو pickle) دون تغييرها"""
+        source = Image.linear_gradient("L").resize((48, 32)).convert(mode)
+        encoder = ImageEncoder(workers=1)
+        encoder.start()
+        try:
+            # عمليات الترميز لا ترث حالة العملية الرئيسية (CUDA/NVML)
+            assert encoder._pool._mp_context.get_start_method() != "fork"
+            output_path = tmp_path / "out.png"
+            await encoder.encode(source, str(output_path), get_preset("png"))
+        finally:
+            encoder.shutdown()
+
+        with Image.open(output_path) as img:
+            assert img.size == source.size
+            assert img.convert("RGBA").tobytes() == source.convert("RGBA").tobytes()
+
+
+class TestUpscalerEncoding:
+    """اختبارات الترميز داخل المعالج"""
+
+    @pytest.mark.asyncio
+    async def test_per_request_output_format(self, tmp_path, monkeypatch):
+        """اختبار اختيار الترميز لكل طلب وتسجيله في metadata"""
+        monkeypatch.setattr(settings, "RESULT_DIR", str(tmp_path / "results"))
+
+        path = tmp_path / "input.png"
+        Image.new("RGB", (64, 64), color="blue").save(path, "PNG")
+
+        upscaler = FluxUpscaler()
+        upscaler.device = "cpu"
+        upscaler.pipeline = IdentityFakePipeline()
+        upscaler.is_loaded = True
+
+        try:
+            default = await upscaler.upscale_image(str(path), "prompt")
+            jpeg = await upscaler.upscale_image(str(path), "prompt", output_format=OutputPreset.JPEG)
+        finally:
+            upscaler.executor.shutdown()
+
+        assert default.status == ProcessingStatus.COMPLETED
+        assert default.output_path.endswith(".png")
+        assert default.metadata["encoding"]["preset"] == settings.OUTPUT_PRESET
+
+        assert jpeg.output_path.endswith(".jpg")
+        assert jpeg.metadata["encoding"]["format"] == "JPEG"
+        assert jpeg.file_size == jpeg.metadata["encoding"]["output_bytes"]
@@ -0,0 +1,119 @@
+"""
+اختبارات منفذ الاستدلال - حلقة الأحداث لا تتوقف أثناء المعالجة
+"""
+
+import pytest
+import asyncio
+import os
+import sys
+import time
+import threading
+import httpx
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import app as app_module
+from core.config import settings
+from core.models import ProcessingStatus
+from core.upscaler import FluxUpscaler
+from core.inference_executor import InferenceExecutor
+from utils.gpu_monitor import GPUMonitor
+
+
+class SlowFakePipeline:
+    """pipeline وهمي بطيء يحجب الخيط الذي يعمل عليه"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.threads = []
+
+    def __call__(self, **kwargs):
+        self.threads.append(threading.current_thread().name)
+        time.sleep(self.delay)
+
+        class Output:
+            images = [kwargs["image"].copy()]
+
+        return Output()
+
+
+@pytest.fixture
+def input_image(tmp_path):
+    """صورة إدخال للاختبار"""
+    path = tmp_path / "input.png"
+    Image.new("RGB", (64, 64), color="green").save(path, "PNG")
+    return str(path)
+
+
+@pytest.fixture
+def slow_upscaler(tmp_path, monkeypatch):
+    """معالج بـ pipeline وهمي بطيء"""
+    monkeypatch.setattr(settings, "RESULT_DIR", str(tmp_path / "results"))
+
+    upscaler = FluxUpscaler()
+    upscaler.device = "cpu"
+    upscaler.pipeline = SlowFakePipeline(delay=1.0)
+    upscaler.is_loaded = True
+    yield upscaler
+    upscaler.executor.shutdown(wait=True)
+
+
+class TestInferenceExecutor:
+    """اختبارات المنفذ"""
+
+    @pytest.mark.asyncio
+    async def test_runs_on_dedicated_thread(self):
+        """اختبار التشغيل على خيط الاستدلال"""
+        executor = InferenceExecutor(max_inflight=1)
+        try:
+            name = await executor.run(lambda: threading.current_thread().name)
+        finally:
+            executor.shutdown()
+
+        assert name.startswith("inference")
+
+    @pytest.mark.asyncio
+    async def test_inflight_limit(self):
+        """اختبار حد المهام الجارية"""
+        executor = InferenceExecutor(max_inflight=1)
+        observed = []
+
+        def job():
+            observed.append(executor.inflight)
+            time.sleep(0.05)
+
+        try:
+            await asyncio.gather(*(executor.run(job) for _ in range(4)))
+        finally:
+            executor.shutdown()
+
+        assert observed == [1, 1, 1, 1]
+
+    @pytest.mark.asyncio
+    async def test_health_stays_fast_during_inference(self, slow_upscaler, input_image, monkeypatch):
+        """اختبار بقاء /health سريعاً أثناء تشغيل pipeline بطيء"""
+        monkeypatch.setattr(app_module, "gpu_monitor", GPUMonitor())
+        monkeypatch.setattr(app_module, "upscaler", slow_upscaler)
+
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            job = asyncio.create_task(slow_upscaler.upscale_image(input_image, "prompt"))
+
+            # انتظار بدء الاستدلال فعلياً
+            while not slow_upscaler.pipeline.threads:
+                await asyncio.sleep(0.01)
+
+            latencies = []
+            for _ in range(5):
+                start = time.perf_counter()
+                response = await client.get("/health")
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200
+
+            assert not job.done()
+            result = await job
+
+        assert result.status == ProcessingStatus.COMPLETED
+        assert slow_upscaler.pipeline.threads[0].startswith("inference")
+        assert max(latencies) < 0.5
@@ -0,0 +1,226 @@
+"""
+اختبارات مخطط الذاكرة
+"""
+
+import pytest
+import os
+import sys
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from core.memory_planner import (
+    MemoryPlanner,
+    component_sizes,
+    RESIDENT,
+    MODEL_OFFLOAD,
+    SEQUENTIAL_OFFLOAD
+)
+
+
+GB = 1024 ** 3
+
+
+class FakeMonitor:
+    """مراقب وهمي بذاكرة محددة"""
+
+    def __init__(self, gpu_free, host_available=64 * GB):
+        self.memory = {"gpu_free": gpu_free, "gpu_total": gpu_free, "host_available": host_available}
+
+    def get_free_memory(self, device):
+        return self.memory
+
+
+class FakeVae:
+    """VAE وهمي يسجل حالة tiling و slicing"""
+
+    def __init__(self):
+        self.tiling = None
+        self.slicing = None
+
+    def enable_tiling(self):
+        self.tiling = True
+
+    def disable_tiling(self):
+        self.tiling = False
+
+    def enable_slicing(self):
+        self.slicing = True
+
+    def disable_slicing(self):
+        self.slicing = False
+
+
+class FakePipeline:
+    """pipeline وهمي يسجل عمليات النقل والتفريغ"""
+
+    def __init__(self):
+        self.calls = []
+        self.vae = FakeVae()
+
+    def to(self, device):
+        self.calls.append(("to", device))
+
+    def enable_model_cpu_offload(self, device=None):
+        self.calls.append(("model_offload", device))
+
+    def enable_sequential_cpu_offload(self, device=None):
+        self.calls.append(("sequential_offload", device))
+
+    def remove_all_hooks(self):
+        self.calls.append(("remove_hooks",))
+
+
+# أوزان شبيهة بـ Flux: transformer كبير ومشفرات نص
+SIZES = {"transformer": 24 * GB, "text_encoder_2": 9 * GB, "text_encoder": 1 * GB, "vae": 1 * GB}
+
+
+def _config(**overrides):
+    return {
+        "enable_memory_efficient": True,
+        "strategy": "auto",
+        "headroom_bytes": 1 * GB,
+        "activation_bytes_per_megapixel": 3 * GB,
+        "vae_tiling_megapixels": 2.0,
+        "max_megapixels": 1.0,
+        "max_batch_size": 1,
+        "promote_after_jobs": 3,
+        **overrides
+    }
+
+
+def _planner(gpu_free, host_available=64 * GB, **overrides):
+    planner = MemoryPlanner("cuda:0", monitor=FakeMonitor(gpu_free, host_available), config=_config(**overrides))
+    planner.initialize(SIZES)
+    return planner
+
+
+class TestInitialPlan:
+    """اختبارات الخطة الأولى"""
+
+    @pytest.mark.parametrize("gpu_free,expected", [
+        (80 * GB, RESIDENT),
+        (32 * GB, MODEL_OFFLOAD),
+        (16 * GB, SEQUENTIAL_OFFLOAD),
+    ])
+    def test_strategy_by_free_vram(self, gpu_free, expected):
+        """اختبار اختيار أسرع طريقة تتسع للذاكرة"""
+        plan = _planner(gpu_free).plan
+
+        assert plan.strategy == expected
+        assert plan.reason
+        assert plan.estimates["weights_bytes"] == sum(SIZES.values())
+
+    def test_offload_needs_host_memory(self):
+        """اختبار عدم اختيار model offload إذا لم تتسع الذاكرة الرئيسية للأوزان"""
+        assert _planner(32 * GB, host_available=16 * GB).plan.strategy == SEQUENTIAL_OFFLOAD
+
+    def test_forced_strategy(self):
+        """اختبار الطريقة المحددة في الإعدادات"""
+        assert _planner(16 * GB, enable_memory_efficient=False).plan.strategy == RESIDENT
+        assert _planner(80 * GB, strategy=MODEL_OFFLOAD).plan.strategy == MODEL_OFFLOAD
+
+    def test_vae_options_for_large_outputs(self):
+        """اختبار تفعيل VAE tiling للصور الكبيرة و slicing للدفعات"""
+        small = _planner(80 * GB).plan
+        large = _planner(200 * GB, max_megapixels=4.2, max_batch_size=2).plan
+
+        assert (small.vae_tiling, small.vae_slicing) == (False, False)
+        assert (large.vae_tiling, large.vae_slicing) == (True, True)
+
+    def test_apply(self):
+        """اختبار تطبيق الخطة على الـ pipeline"""
+        planner = _planner(32 * GB)
+        pipeline = FakePipeline()
+        planner.apply(pipeline)
+
+        assert pipeline.calls == [("model_offload", "cuda:0")]
+        assert pipeline.vae.tiling is False
+        assert planner.get_stats()["history"][0]["strategy"] == MODEL_OFFLOAD
+
+
+class TestReplanning:
+    """اختبارات إعادة التخطيط من القياسات"""
+
+    def test_upgrade_when_estimate_was_pessimistic(self):
+        """اختبار الانتقال إلى التحميل الكامل عندما تكون الذروة الفعلية أقل من التقدير"""
+        planner = _planner(38 * GB)
+        pipeline = FakePipeline()
+        planner.apply(pipeline)
+        assert planner.plan.strategy == MODEL_OFFLOAD
+
+        # الذروة الفعلية: الـ transformer + 1GB فقط لكل ميغابكسل
+        changed = planner.after_job(pipeline, megapixels=1.0, peak_bytes=25 * GB)
+
+        assert changed
+        assert planner.plan.strategy == RESIDENT
+        assert pipeline.calls[-2:] == [("remove_hooks",), ("to", "cuda:0")]
+        assert planner.get_stats()["replans"] == 1
+
+    def test_downgrade_near_limit(self):
+        """اختبار الانتقال إلى طريقة أقل استهلاكاً عند الاقتراب من نفاد الذاكرة"""
+        planner = _planner(80 * GB)
+        pipeline = FakePipeline()
+        planner.apply(pipeline)
+
+        changed = planner.after_job(pipeline, megapixels=1.0, peak_bytes=78 * GB)
+
+        assert changed
+        assert planner.plan.strategy == MODEL_OFFLOAD
+        assert pipeline.calls[-2:] == [("to", "cpu"), ("model_offload", "cuda:0")]
+
+    def test_stable_when_estimate_holds(self):
+        """اختبار عدم التغيير عندما يكون التقدير صحيحاً"""
+        planner = _planner(80 * GB)
+        pipeline = FakePipeline()
+        planner.apply(pipeline)
+
+        assert not planner.after_job(pipeline, megapixels=1.0, peak_bytes=38 * GB)
+        assert planner.plan.strategy == RESIDENT
+        assert planner.get_stats()["measured"]
+
+    def test_oom_steps_down_until_sequential(self):
+        """اختبار التدرج بعد نفاد الذاكرة حتى التفريغ التسلسلي"""
+        planner = _planner(80 * GB)
+        pipeline = FakePipeline()
+        planner.apply(pipeline)
+
+        assert planner.handle_oom(pipeline)
+        assert planner.plan.strategy == MODEL_OFFLOAD
+        assert planner.handle_oom(pipeline)
+        assert planner.plan.strategy == SEQUENTIAL_OFFLOAD
+        assert not planner.handle_oom(pipeline)
+
+    def test_no_promotion_right_after_oom(self):
+        """اختبار بقاء الطريقة الأقل استهلاكاً بعد OOM حتى تتوالى مهام بعيدة عن حد الذاكرة"""
+        planner = _planner(80 * GB)
+        pipeline = FakePipeline()
+        planner.apply(pipeline)
+        assert planner.handle_oom(pipeline)
+
+        # ذروة صغيرة بعد OOM مباشرة لا تعيد التحميل الكامل
+        assert not planner.after_job(pipeline, megapixels=1.0, peak_bytes=26 * GB)
+        assert planner.plan.strategy == MODEL_OFFLOAD
+        assert planner.get_stats()["floor"] == MODEL_OFFLOAD
+
+        assert not planner.after_job(pipeline, megapixels=1.0, peak_bytes=26 * GB)
+        assert planner.plan.strategy == MODEL_OFFLOAD
+
+        assert planner.after_job(pipeline, megapixels=1.0, peak_bytes=26 * GB)
+        assert planner.plan.strategy == RESIDENT
+        assert planner.get_stats()["floor"] is None
+
+
+class TestComponentSizes:
+    """اختبارات حساب حجم الأوزان"""
+
+    def test_component_sizes(self):
+        """اختبار حساب حجم أوزان المكونات"""
+
+        class Pipeline:
+            components = {
+                "transformer": torch.nn.Linear(10, 10, dtype=torch.bfloat16),
+                "scheduler": object()
+            }
+
+        assert component_sizes(Pipeline()) == {"transformer": (100 + 10) * 2}
@@ -0,0 +1,102 @@
+"""
+اختبارات middleware المقاييس
+"""
+
+import pytest
+import os
+import sys
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from core.monitoring import MetricsMiddleware, MetricsCollector, ACTIVE_REQUESTS
+
+
+class RecordingCollector(MetricsCollector):
+    """جامع يحتفظ بالطلبات المسجلة"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    def record_request(self, method, endpoint, status, duration):
+        self.requests.append((method, endpoint, status))
+        super().record_request(method, endpoint, status, duration)
+
+
+@pytest.fixture
+def collector():
+    return RecordingCollector()
+
+
+@pytest.fixture
+def client(collector):
+    app = FastAPI()
+
+    @app.get("/download/{filename}")
+    async def download(filename: str):
+        if filename == "missing":
+            raise HTTPException(status_code=404)
+        return {"filename": filename}
+
+    @app.get("/boom")
+    async def boom():
+        raise RuntimeError("boom")
+
+    app.add_middleware(MetricsMiddleware, collector=collector)
+    return TestClient(app, raise_server_exceptions=False)
+
+
+class TestMetricsMiddleware:
+    """اختبارات تسميات المقاييس"""
+
+    def test_labels_by_route_template(self, client, collector):
+        """اختبار التسمية بقالب المسار بدلاً من المسار الفعلي"""
+        client.get("/download/a.png")
+        client.get("/download/b.png")
+        client.get("/download/missing")
+
+        assert collector.requests == [
+            ("GET", "/download/{filename}", 200),
+            ("GET", "/download/{filename}", 200),
+            ("GET", "/download/{filename}", 404)
+        ]
+        assert len(collector._request_series) == 2
+
+    def test_unmatched_paths_share_one_label(self, client, collector):
+        """اختبار تجميع المسارات غير الموجودة في تسمية واحدة"""
+        client.get("/nope/1")
+        client.get("/nope/2")
+
+        assert collector.requests == [("GET", "unmatched", 404)] * 2
+
+    def test_unhandled_error_recorded_as_500(self, client, collector):
+        """اختبار تسجيل الاستثناءات كـ 500 وإعادة عداد الطلبات النشطة"""
+        active = ACTIVE_REQUESTS._value.get()
+
+        response = client.get("/boom")
+
+        assert response.status_code == 500
+        assert collector.requests == [("GET", "/boom", 500)]
+        assert ACTIVE_REQUESTS._value.get() == active
+
+
+class TestMetricsRoutes:
+    """اختبارات مسارات المقاييس في التطبيق"""
+
+    def test_prometheus_and_json_do_not_clash(self):
+        """اختبار أن /metrics يبقى JSON و /metrics/prometheus يعرض Prometheus"""
+        from app import app
+
+        client = TestClient(app)
+        metrics = client.get("/metrics")
+        prometheus = client.get("/metrics/prometheus")
+        summary = client.get("/metrics/summary")
+
+        assert metrics.headers["content-type"].startswith("application/json")
+        assert isinstance(metrics.json(), dict)
+        assert prometheus.headers["content-type"].startswith("text/plain")
+        assert "gpu_worker_requests_total" in prometheus.text
+        assert [route.path for route in app.routes].count("/metrics") == 1
+        assert "success_rate" in summary.json()
@@ -0,0 +1,162 @@
+"""
+اختبارات بث تقدم المهام
+"""
+
+import pytest
+import asyncio
+import os
+import sys
+import threading
+import torch
+from datetime import datetime
+from fastapi.testclient import TestClient
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import app as app_module
+from core.config import settings
+from core.models import UpscaleResponse, ProcessingStatus
+from core.progress import TaskProgress, StepReporter, latent_preview
+from core.task_queue import TaskQueue
+from core.upscaler import FluxUpscaler
+
+
+class LatentFakePipeline:
+    """pipeline وهمي يمرر latents معبأة إلى callback_on_step_end بعد كل خطوة"""
+
+    def __call__(self, num_inference_steps, image, callback_on_step_end=None, **kwargs):
+        latents = torch.randn(1, (image.height // 16) * (image.width // 16), 64)
+        for step in range(num_inference_steps):
+            if callback_on_step_end:
+                callback_on_step_end(self, step, None, {"latents": latents})
+
+        class Output:
+            images = [image.copy()]
+
+        return Output()
+
+
+class FakeUpscaler:
+    """معالج وهمي للطابور"""
+
+    is_loaded = True
+
+    async def upscale_image(self, image, prompt, task_id=None, **kwargs):
+        return UpscaleResponse(task_id=task_id, status=ProcessingStatus.COMPLETED, completed_at=datetime.now())
+
+
+class TestLatentPreview:
+    """اختبارات المعاينة الرخيصة"""
+
+    def test_preview_shape(self):
+        """اختبار معاينة بدقة 1/16 لكل صورة في الدفعة"""
+        latents = torch.randn(2, 2 * 4, 64)
+
+        pixels = latent_preview(latents, (64, 32))
+
+        assert pixels.shape == (2, 2, 4, 3)
+        assert pixels.dtype.name == "uint8"
+
+    def test_mismatched_latents(self):
+        """اختبار تجاهل latents بشكل غير متوقع"""
+        assert latent_preview(torch.randn(1, 7, 64), (64, 32)) is None
+        assert latent_preview(torch.randn(1, 4, 16, 16), (64, 32)) is None
+
+
+class TestTaskProgress:
+    """اختبارات دمج التحديثات"""
+
+    @pytest.mark.asyncio
+    async def test_slow_subscriber_sees_latest_state(self):
+        """اختبار أن التحديثات من خيط آخر تُدمج ولا تنتظر المشترك"""
+        progress = TaskProgress()
+        events = progress.events()
+        assert await events.__anext__() == ("progress", {"status": "pending"})
+
+        def steps():
+            for step in range(1, 51):
+                progress.update(step=step, total_steps=50)
+
+        thread = threading.Thread(target=steps)
+        thread.start()
+        thread.join()
+
+        event, state = await asyncio.wait_for(events.__anext__(), timeout=5)
+        assert event == "progress" and state["step"] == 50
+
+        progress.finish("completed")
+        remaining = [item async for item in events]
+        assert remaining == [("progress", {"status": "completed", "step": 50, "total_steps": 50, "finished": True})]
+
+    @pytest.mark.asyncio
+    async def test_keepalive(self):
+        """اختبار رسالة الإبقاء على الاتصال أثناء الانتظار"""
+        events = TaskProgress().events(keepalive=0.01)
+        await events.__anext__()
+
+        assert await asyncio.wait_for(events.__anext__(), timeout=5) == ("ping", {})
+        await events.aclose()
+
+    def test_previews_only_for_subscribers(self):
+        """اختبار عدم حساب المعاينات دون مشترك طلبها"""
+        progress = TaskProgress()
+        reporter = StepReporter([progress], total_steps=4, image_size=(32, 32), preview_interval=2)
+        latents = torch.randn(1, 4, 64)
+
+        reporter(None, 1, None, {"latents": latents})
+        assert progress.preview is None
+
+        progress.preview_subscribers = 1
+        reporter(None, 3, None, {"latents": latents})
+        assert progress.preview[0] == 4
+        assert progress.state["step"] == 4 and progress.state["eta"] == 0
+
+
+class TestUpscalerProgress:
+    """اختبارات التقدم من المعالج"""
+
+    @pytest.mark.asyncio
+    async def test_steps_reported(self, tmp_path, monkeypatch):
+        """اختبار نشر كل الخطوات ومعاينة من latents الـ pipeline"""
+        monkeypatch.setattr(settings, "RESULT_DIR", str(tmp_path / "results"))
+        path = tmp_path / "input.png"
+        Image.new("RGB", (64, 64), color="blue").save(path, "PNG")
+
+        upscaler = FluxUpscaler()
+        upscaler.device = "cpu"
+        upscaler.pipeline = LatentFakePipeline()
+        upscaler.is_loaded = True
+        upscaler.processing_config = {**upscaler.processing_config, "enable_tiling": False, "preview_interval": 5}
+
+        progress = TaskProgress()
+        progress.preview_subscribers = 1
+        try:
+            result = await upscaler.upscale_image(str(path), "prompt", progress=progress, num_inference_steps=10)
+        finally:
+            upscaler.executor.shutdown()
+
+        assert result.status == ProcessingStatus.COMPLETED
+        assert progress.state["step"] == progress.state["total_steps"] == 10
+        assert progress.state["stage"] == "encode"
+        assert progress.preview[0] == 10 and progress.preview[1].shape == (4, 4, 3)
+
+
+class TestEventsEndpoint:
+    """اختبارات GET /tasks/{id}/events"""
+
+    def test_stream_ends_with_result(self, monkeypatch):
+        """اختبار بث الحالة ثم النتيجة النهائية"""
+        queue = TaskQueue(FakeUpscaler(), config={"max_queue_size": 4, "num_workers": 1, "history_size": 10})
+        monkeypatch.setattr(app_module, "task_queue", queue)
+        response = queue.submit("/tmp/input.png", "prompt")
+        queue.cancel(response.task_id)
+
+        client = TestClient(app_module.app)
+        stream = client.get(f"/tasks/{response.task_id}/events")
+
+        assert stream.headers["content-type"].startswith("text/event-stream")
+        assert stream.text.startswith("event: progress\n")
+        assert "event: done\n" in stream.text
+        assert '"status": "cancelled"' in stream.text
+        assert client.get("/tasks/missing/events").status_code == 404
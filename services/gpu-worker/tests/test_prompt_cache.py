@@ -0,0 +1,105 @@
+"""
+اختبارات ذاكرة تضمينات النصوص
+"""
+
+import pytest
+import asyncio
+import os
+import sys
+import torch
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from core.config import settings
+from core.models import ProcessingStatus
+from core.prompt_cache import PromptEmbeddingCache
+from core.upscaler import FluxUpscaler
+
+
+class EncodingFakePipeline:
+    """pipeline وهمي بمشفر نصوص يعد الاستدعاءات"""
+
+    _execution_device = torch.device("cpu")
+
+    def __init__(self):
+        self.encoded = []
+        self.calls = []
+
+    def encode_prompt(self, prompt, prompt_2=None, device=None):
+        self.encoded.append(prompt)
+        return torch.ones(1, 4, 8) * len(prompt), torch.ones(1, 8), torch.zeros(4, 3)
+
+    def __call__(self, **kwargs):
+        self.calls.append(kwargs)
+        images = kwargs["image"] if isinstance(kwargs["image"], list) else [kwargs["image"]]
+
+        class Output:
+            pass
+
+        output = Output()
+        output.images = [image.copy() for image in images]
+        return output
+
+
+class TestPromptEmbeddingCache:
+    """اختبارات الذاكرة"""
+
+    def test_encodes_once_per_key(self):
+        """اختبار التشفير مرة واحدة لكل مفتاح"""
+        cache = PromptEmbeddingCache(max_entries=4)
+        calls = []
+
+        def encode():
+            calls.append(1)
+            return torch.ones(1, 2), torch.ones(1, 1)
+
+        cache.get_or_encode(("a", "model"), encode)
+        cache.get_or_encode(("a", "model"), encode)
+        cache.get_or_encode(("a", "other-lora"), encode)
+
+        assert len(calls) == 2
+
+    def test_bounded(self):
+        """اختبار حد عدد العناصر"""
+        cache = PromptEmbeddingCache(max_entries=2)
+        for prompt in "abc":
+            cache.get_or_encode(prompt, lambda: (torch.ones(1), torch.ones(1)))
+
+        assert cache.get_stats()["entries"] == 2
+
+
+class TestUpscalerPromptEmbeddings:
+    """اختبارات استخدام التضمينات داخل المعالج"""
+
+    @pytest.mark.asyncio
+    async def test_embeddings_passed_to_pipeline(self, tmp_path, monkeypatch):
+        """اختبار تمرير التضمينات المخزنة بدلاً من النص"""
+        monkeypatch.setattr(settings, "RESULT_DIR", str(tmp_path / "results"))
+        monkeypatch.setattr(settings, "MAX_BATCH_SIZE", 2)
+        monkeypatch.setattr(settings, "BATCH_WINDOW_MS", 50.0)
+
+        path = tmp_path / "input.png"
+        Image.new("RGB", (64, 64), color="blue").save(path, "PNG")
+
+        upscaler = FluxUpscaler()
+        upscaler.device = "cpu"
+        upscaler.pipeline = EncodingFakePipeline()
+        upscaler.is_loaded = True
+
+        try:
+            batch = await asyncio.gather(
+                upscaler.upscale_image(str(path), "same prompt", seed=1),
+                upscaler.upscale_image(str(path), "same prompt", seed=2)
+            )
+            single = await upscaler.upscale_image(str(path), "same prompt", seed=3)
+        finally:
+            upscaler.executor.shutdown()
+
+        assert all(result.status == ProcessingStatus.COMPLETED for result in [*batch, single])
+        assert upscaler.pipeline.encoded == ["same prompt"]
+
+        batched_call = upscaler.pipeline.calls[0]
+        assert "prompt" not in batched_call
+        assert batched_call["prompt_embeds"].shape[0] == 2
+        assert batched_call["pooled_prompt_embeds"].shape[0] == 2
@@ -0,0 +1,209 @@
+"""
+اختبارات مستويات الجودة
+"""
+
+import pytest
+import asyncio
+import os
+import sys
+from datetime import datetime
+from fastapi.testclient import TestClient
+from PIL import Image
+from prometheus_client import REGISTRY
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import app as app_module
+from core.config import settings
+from core.models import ProcessingStatus, QualityTier
+from core.image_context import ImageContext
+from core.quality import get_tier
+from core.task_queue import TaskQueue
+from core.upscaler import FluxUpscaler
+from utils.file_handler import FileHandler
+from conftest import FakeUpscaler, queue_config
+
+
+class RecordingFakePipeline:
+    """pipeline وهمي يسجل الخطوات وحجم الصورة الداخلة"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, num_inference_steps, image, strength, **kwargs):
+        self.calls.append((num_inference_steps, strength, image.size))
+
+        class Output:
+            images = [image.copy()]
+
+        return Output()
+
+
+def _tier_latency_count(tier: str) -> float:
+    return REGISTRY.get_sample_value("gpu_worker_tier_latency_seconds_count", {"tier": tier}) or 0
+
+
+class TestTierTable:
+    """اختبارات جدول المستويات"""
+
+    def test_preview_is_cheaper(self):
+        """اختبار أن المعاينة أقل خطوات ودقة من المستوى القياسي"""
+        preview, standard, best = get_tier("preview"), get_tier(QualityTier.STANDARD), get_tier("max")
+
+        assert preview.num_inference_steps < settings.NUM_INFERENCE_STEPS < best.num_inference_steps
+        assert preview.max_image_size < standard.max_image_size
+        assert not preview.tiling and preview.retain_input
+        assert get_tier().name == settings.DEFAULT_QUALITY_TIER
+
+    def test_unknown_tier(self):
+        """اختبار رفض مستوى غير معروف"""
+        with pytest.raises(ValueError):
+            get_tier("ultra")
+
+    def test_explicit_params_override_tier(self):
+        """اختبار أولوية المعاملات الصريحة على المستوى"""
+        upscaler = FluxUpscaler()
+        try:
+            params = upscaler._resolve_params("prompt", {"quality_tier": "preview", "num_inference_steps": 12})
+        finally:
+            upscaler.executor.shutdown()
+
+        assert params["num_inference_steps"] == 12
+        assert params["strength"] == settings.PREVIEW_STRENGTH
+        assert params["output_format"] == settings.PREVIEW_OUTPUT_PRESET
+        assert params["quality_tier"] == "preview"
+
+
+class TestUpscalerTiers:
+    """اختبارات المستويات في المعالج"""
+
+    @pytest.mark.asyncio
+    async def test_preview_downscales_instead_of_tiling(self, tmp_path, monkeypatch):
+        """اختبار أن المعاينة تُصغّر الصورة الكبيرة وتستخدم خطواتها وتُسجل زمنها"""
+        monkeypatch.setattr(settings, "RESULT_DIR", str(tmp_path / "results"))
+        monkeypatch.setattr(settings, "MAX_IMAGE_SIZE", 128)
+        monkeypatch.setattr(settings, "PREVIEW_MAX_IMAGE_SIZE", 32)
+        path = tmp_path / "input.png"
+        Image.new("RGB", (256, 128), color="blue").save(path, "PNG")
+
+        upscaler = FluxUpscaler()
+        upscaler.device = "cpu"
+        upscaler.pipeline = RecordingFakePipeline()
+        upscaler.is_loaded = True
+        before = _tier_latency_count("preview")
+        try:
+            result = await upscaler.upscale_image(str(path), "prompt", quality_tier=QualityTier.PREVIEW)
+        finally:
+            upscaler.executor.shutdown()
+
+        assert result.status == ProcessingStatus.COMPLETED
+        assert upscaler.pipeline.calls == [(settings.PREVIEW_INFERENCE_STEPS, settings.PREVIEW_STRENGTH, (32, 16))]
+        assert result.metadata["quality_tier"] == "preview"
+        assert result.metadata["tiled"] is False
+        assert result.output_path.endswith(".jpg")
+        assert _tier_latency_count("preview") == before + 1
+
+
+class TestSourceReuse:
+    """اختبارات إعادة استخدام إدخال المعاينة"""
+
+    @pytest.mark.asyncio
+    async def test_standard_request_reuses_preview_input(self, tmp_path, monkeypatch):
+        """اختبار الاحتفاظ بإدخال المعاينة وإعادة استخدامه بالبصمة والبذرة نفسيهما"""
+        for name in ("UPLOAD_DIR", "RESULT_DIR", "TEMP_DIR"):
+            monkeypatch.setattr(settings, name, str(tmp_path / name.lower()))
+        file_handler = FileHandler()
+        path = os.path.join(file_handler.config["upload_dir"], "input.png")
+        Image.new("RGB", (16, 16), color="blue").save(path, "PNG")
+        file_handler.storage.add(path, pinned=True)
+
+        upscaler = FakeUpscaler()
+        queue = TaskQueue(upscaler, file_handler, config=queue_config())
+        queue.start()
+        try:
+            preview = queue.submit(ImageContext(path, content_hash="abc", file_size=10), "prompt",
+                                   quality_tier=QualityTier.PREVIEW, seed=7)
+            await asyncio.wait_for(queue.wait(preview.task_id), timeout=5)
+            assert os.path.exists(path)
+            assert "input.png" not in file_handler.storage.directories["uploads"].pinned
+
+            standard = queue.resubmit(preview.task_id, "prompt", quality_tier=QualityTier.STANDARD)
+            await asyncio.wait_for(queue.wait(standard.task_id), timeout=5)
+        finally:
+            await queue.stop()
+
+        image, _, _, params = upscaler.calls[1]
+        assert image.path == path and image.content_hash == "abc"
+        assert params["seed"] == 7
+        # الإدخال ما زال ملك المعاينة
+        assert os.path.exists(path)
+        assert queue.get_stats()["retained_inputs"] == 1
+        assert queue.resubmit("missing", "prompt") is None
+
+    @pytest.mark.asyncio
+    async def test_standard_input_is_deleted(self, tmp_path, monkeypatch):
+        """اختبار حذف إدخال المهام غير المعاينة كما كان"""
+        for name in ("UPLOAD_DIR", "RESULT_DIR", "TEMP_DIR"):
+            monkeypatch.setattr(settings, name, str(tmp_path / name.lower()))
+        file_handler = FileHandler()
+        path = os.path.join(file_handler.config["upload_dir"], "input.png")
+        Image.new("RGB", (16, 16), color="blue").save(path, "PNG")
+
+        queue = TaskQueue(FakeUpscaler(), file_handler, config=queue_config())
+        queue.start()
+        try:
+            response = queue.submit(path, "prompt", quality_tier=QualityTier.STANDARD)
+            await asyncio.wait_for(queue.wait(response.task_id), timeout=5)
+        finally:
+            await queue.stop()
+
+        assert not os.path.exists(path)
+        assert queue.resubmit(response.task_id, "prompt") is None
+
+    @pytest.mark.asyncio
+    async def test_resubmitted_input_survives_janitor(self, tmp_path, monkeypatch):
+        """اختبار حماية الإدخال من المنظف بين resubmit والمعالجة ثم تركه له بعدها"""
+        for name in ("UPLOAD_DIR", "RESULT_DIR", "TEMP_DIR"):
+            monkeypatch.setattr(settings, name, str(tmp_path / name.lower()))
+        file_handler = FileHandler()
+        path = os.path.join(file_handler.config["upload_dir"], "input.png")
+        Image.new("RGB", (16, 16), color="blue").save(path, "PNG")
+        file_handler.storage.add(path, pinned=True)
+        later = datetime.now().timestamp() + 365 * 24 * 3600
+
+        upscaler = FakeUpscaler()
+        queue = TaskQueue(upscaler, file_handler, config=queue_config())
+        queue.start()
+        try:
+            preview = queue.submit(path, "prompt", quality_tier=QualityTier.PREVIEW)
+            await asyncio.wait_for(queue.wait(preview.task_id), timeout=5)
+        finally:
+            await queue.stop()
+
+        standard = queue.resubmit(preview.task_id, "prompt", quality_tier=QualityTier.STANDARD)
+        assert file_handler.storage.evict(now=later) == []
+        assert os.path.exists(path)
+
+        queue.start()
+        try:
+            await asyncio.wait_for(queue.wait(standard.task_id), timeout=5)
+        finally:
+            await queue.stop()
+
+        assert upscaler.calls[1][0].path == path
+        assert file_handler.storage.evict(now=later) == [path]
+
+
+class TestUpscaleEndpointTiers:
+    """اختبارات source_task_id في POST /upscale"""
+
+    def test_source_validation(self, monkeypatch):
+        """اختبار رفض الطلب دون ملف أو مصدر وإرجاع 404 لمصدر غير معروف"""
+        monkeypatch.setattr(app_module, "upscaler", FakeUpscaler())
+        monkeypatch.setattr(app_module, "task_queue", TaskQueue(FakeUpscaler(), config=queue_config()))
+        client = TestClient(app_module.app)
+
+        assert client.post("/upscale").status_code == 400
+        response = client.post("/upscale", params={"source_task_id": "missing", "quality_tier": "standard"})
+        assert response.status_code == 404
+        assert client.post("/upscale", params={"quality_tier": "ultra"}).status_code == 422
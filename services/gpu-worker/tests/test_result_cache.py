@@ -0,0 +1,156 @@
+"""
+اختبارات ذاكرة النتائج
+"""
+
+import pytest
+import os
+import sys
+import time
+from pathlib import Path
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from core.config import settings
+from core.models import UpscaleResponse, ProcessingStatus
+from core.monitoring import metrics_collector
+from core.result_cache import ResultCache, hash_file
+from core.upscaler import FluxUpscaler
+
+
+class CountingFakePipeline:
+    """pipeline وهمي يعد الاستدعاءات"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, **kwargs):
+        self.calls += 1
+
+        class Output:
+            images = [kwargs["image"].copy()]
+
+        return Output()
+
+
+def _write_result(directory: Path, name: str, size: int) -> UpscaleResponse:
+    """إنشاء ملف نتيجة بحجم محدد"""
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / name
+    path.write_bytes(b"x" * size)
+    return UpscaleResponse(task_id=name, status=ProcessingStatus.COMPLETED, output_path=str(path))
+
+
+class TestResultCache:
+    """اختبارات الذاكرة"""
+
+    def test_key_depends_on_params(self):
+        """اختبار اختلاف المفتاح مع المعاملات"""
+        base = {"prompt": "a", "seed": 1}
+
+        assert ResultCache.make_key("h", base) == ResultCache.make_key("h", dict(base))
+        assert ResultCache.make_key("h", base) != ResultCache.make_key("h", {**base, "seed": 2})
+        assert ResultCache.make_key("h", base) != ResultCache.make_key("other", base)
+
+    def test_put_and_get(self, tmp_path):
+        """اختبار التخزين والاسترجاع"""
+        cache = ResultCache(cache_dir=str(tmp_path / "cache"), max_bytes=1024)
+        cache.put("k1", _write_result(tmp_path / "results", "a.png", 100))
+
+        destination = tmp_path / "results" / "copy.png"
+        response = cache.get("k1", destination)
+
+        assert response is not None
+        assert destination.read_bytes() == b"x" * 100
+        assert cache.get("missing", tmp_path / "none.png") is None
+
+    def test_lru_eviction_under_budget(self, tmp_path):
+        """اختبار إخلاء الأقدم استخداماً عند تجاوز الميزانية"""
+        cache = ResultCache(cache_dir=str(tmp_path / "cache"), max_bytes=250)
+        cache.put("k1", _write_result(tmp_path / "results", "1.png", 100))
+        cache.put("k2", _write_result(tmp_path / "results", "2.png", 100))
+
+        # استخدام k1 يجعل k2 الأقدم
+        cache.get("k1", tmp_path / "hit.png")
+        cache.put("k3", _write_result(tmp_path / "results", "3.png", 100))
+
+        assert cache.get("k2", tmp_path / "k2.png") is None
+        assert cache.get("k1", tmp_path / "k1.png") is not None
+        assert cache.total_bytes <= 250
+
+    def test_index_survives_restart(self, tmp_path):
+        """اختبار إعادة بناء الفهرس من القرص"""
+        cache_dir = str(tmp_path / "cache")
+        ResultCache(cache_dir=cache_dir, max_bytes=1024).put("k1", _write_result(tmp_path / "results", "1.png", 10))
+
+        reopened = ResultCache(cache_dir=cache_dir, max_bytes=1024)
+        assert reopened.get_stats()["entries"] == 1
+        assert reopened.total_bytes == 10
+
+    def test_hit_keeps_result_mtime(self, tmp_path):
+        """اختبار أن الإصابة لا تغير عمر ملف النتيجة المربوط بمجلد النتائج، وأن الترتيب يبقى بعد إعادة التشغيل"""
+        cache_dir = str(tmp_path / "cache")
+        cache = ResultCache(cache_dir=cache_dir, max_bytes=250)
+        first = _write_result(tmp_path / "results", "1.png", 100)
+        cache.put("k1", first)
+        cache.put("k2", _write_result(tmp_path / "results", "2.png", 100))
+
+        old = time.time() - 3600
+        for path in Path(cache_dir).iterdir():
+            os.utime(path, (old, old))
+        os.utime(first.output_path, (old, old))
+
+        cache.get("k1", tmp_path / "hit.png")
+        assert os.stat(first.output_path).st_mtime == old
+
+        # k1 استُخدم مؤخراً - بعد إعادة التشغيل يبقى k2 الأقدم ويُخلى أولاً
+        reopened = ResultCache(cache_dir=cache_dir, max_bytes=250)
+        reopened.put("k3", _write_result(tmp_path / "results", "3.png", 100))
+        assert reopened.get("k2", tmp_path / "k2.png") is None
+        assert reopened.get("k1", tmp_path / "k1.png") is not None
+
+
+class TestUpscalerResultCache:
+    """اختبارات الذاكرة داخل المعالج"""
+
+    @pytest.mark.asyncio
+    async def test_repeat_request_skips_pipeline(self, tmp_path, monkeypatch):
+        """اختبار عدم تشغيل pipeline لطلب مكرر"""
+        monkeypatch.setattr(settings, "RESULT_DIR", str(tmp_path / "results"))
+
+        path = tmp_path / "input.png"
+        Image.new("RGB", (64, 64), color="blue").save(path, "PNG")
+
+        upscaler = FluxUpscaler(result_cache=ResultCache(cache_dir=str(tmp_path / "cache"), max_bytes=10 ** 8))
+        upscaler.device = "cpu"
+        upscaler.pipeline = CountingFakePipeline()
+        upscaler.is_loaded = True
+
+        hits_before = metrics_collector.cache_stats.get("result", {}).get("hits", 0)
+        try:
+            first = await upscaler.upscale_image(str(path), "prompt", seed=7)
+            second = await upscaler.upscale_image(str(path), "prompt", seed=7, content_hash=hash_file(str(path)))
+            third = await upscaler.upscale_image(str(path), "prompt", seed=8)
+        finally:
+            upscaler.executor.shutdown()
+
+        assert upscaler.pipeline.calls == 2
+        assert first.metadata["cache_hit"] is False
+        assert second.metadata["cache_hit"] is True
+        assert third.metadata["cache_hit"] is False
+        assert second.output_path != first.output_path
+        assert Path(second.output_path).read_bytes() == Path(first.output_path).read_bytes()
+        assert metrics_collector.cache_stats["result"]["hits"] == hits_before + 1
+
+    def test_explicit_zero_in_cache_key(self):
+        """اختبار أن القيمة الصريحة صفر لا تُستبدل بالافتراضية في المعاملات ولا في مفتاح الذاكرة"""
+        upscaler = FluxUpscaler()
+        try:
+            params = upscaler._resolve_params("prompt", {"guidance_scale": 0})
+            defaults = upscaler._resolve_params("prompt", {"guidance_scale": None})
+        finally:
+            upscaler.executor.shutdown()
+
+        assert params["guidance_scale"] == 0
+        assert defaults["guidance_scale"] == settings.GUIDANCE_SCALE
+        assert upscaler._cache_params(params)["guidance_scale"] == 0
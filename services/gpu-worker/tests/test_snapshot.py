@@ -0,0 +1,109 @@
+"""
+اختبارات لقطة الموديل المدمجة
+"""
+
+import pytest
+import json
+import os
+import sys
+import torch
+from diffusers import AutoencoderKL, FlowMatchEulerDiscreteScheduler
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from core.snapshot import (
+    MANIFEST_NAME,
+    find_snapshot,
+    load_components,
+    read_manifest,
+    resolve_dtype,
+    write_snapshot
+)
+
+
+class TinyPipeline:
+    """pipeline صغير من مكونات diffusers حقيقية يمكن حفظها دون اتصال"""
+
+    def __init__(self):
+        self.vae = AutoencoderKL(
+            block_out_channels=(8,),
+            down_block_types=("DownEncoderBlock2D",),
+            up_block_types=("UpDecoderBlock2D",),
+            latent_channels=4,
+            norm_num_groups=8,
+            layers_per_block=1
+        )
+        self.scheduler = FlowMatchEulerDiscreteScheduler()
+
+    def save_pretrained(self, path, safe_serialization=True):
+        self.vae.save_pretrained(os.path.join(path, "vae"), safe_serialization=safe_serialization)
+        self.scheduler.save_pretrained(os.path.join(path, "scheduler"))
+        with open(os.path.join(path, "model_index.json"), "w") as f:
+            json.dump({
+                "_class_name": "TinyPipeline",
+                "vae": ["diffusers", "AutoencoderKL"],
+                "scheduler": ["diffusers", "FlowMatchEulerDiscreteScheduler"],
+                "text_encoder_2": [None, None]
+            }, f)
+
+
+def _config(snapshot_path, **overrides):
+    return {
+        "snapshot_path": str(snapshot_path),
+        "flux_model": "flux",
+        "lora_path": "/models/lora.safetensors",
+        "dtype": "bfloat16",
+        **overrides
+    }
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    """لقطة مكتوبة على القرص"""
+    path = tmp_path / "snapshot"
+    write_snapshot(TinyPipeline(), str(path), {
+        "model": "flux",
+        "lora": "/models/lora.safetensors",
+        "lora_fused": True,
+        "dtype": "bfloat16"
+    })
+    return path
+
+
+class TestSnapshot:
+    """اختبارات كتابة اللقطة والتحميل منها"""
+
+    def test_write_is_atomic(self, snapshot_path):
+        """اختبار كتابة البيان والأوزان بصيغة safetensors دون بقايا مؤقتة"""
+        manifest = read_manifest(str(snapshot_path))
+
+        assert manifest["lora_fused"] is True
+        assert "created_at" in manifest
+        assert (snapshot_path / "vae" / "diffusion_pytorch_model.safetensors").exists()
+        assert not os.path.exists(f"{snapshot_path}.tmp")
+
+    def test_find_snapshot_matches_config(self, snapshot_path, tmp_path):
+        """اختبار استخدام اللقطة فقط عند تطابق الموديل و LoRA ونوع البيانات"""
+        assert find_snapshot(_config(snapshot_path)) is not None
+        assert find_snapshot(_config(snapshot_path, lora_path="/models/other.safetensors")) is None
+        assert find_snapshot(_config(snapshot_path, dtype="float16")) is None
+        assert find_snapshot(_config(tmp_path / "missing")) is None
+
+    def test_corrupt_manifest(self, snapshot_path):
+        """اختبار تجاهل بيان تالف"""
+        (snapshot_path / MANIFEST_NAME).write_text("{")
+        assert find_snapshot(_config(snapshot_path)) is None
+
+    def test_load_components_with_breakdown(self, snapshot_path):
+        """اختبار تحميل كل مكون بنوع البيانات المطلوب مع وقت تحميله"""
+        components, breakdown = load_components(str(snapshot_path), resolve_dtype("bfloat16"))
+
+        assert set(components) == {"vae", "scheduler"}
+        assert set(breakdown) == {"vae", "scheduler"}
+        assert all(seconds >= 0 for seconds in breakdown.values())
+        assert next(components["vae"].parameters()).dtype == torch.bfloat16
+
+    def test_unknown_dtype(self):
+        """اختبار رفض نوع بيانات غير معروف"""
+        with pytest.raises(ValueError):
+            resolve_dtype("float7")
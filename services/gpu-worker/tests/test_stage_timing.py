@@ -0,0 +1,106 @@
+"""
+اختبارات قياس زمن مراحل الطلب
+"""
+
+import pytest
+import os
+import sys
+import asyncio
+from PIL import Image
+from prometheus_client import REGISTRY
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from core.config import settings
+from core.models import ProcessingStatus
+from core.monitoring import StageTimer
+from core.task_queue import TaskQueue
+from core.upscaler import FluxUpscaler
+from conftest import IdentityFakePipeline
+
+
+def _stage_count(stage: str) -> float:
+    """عدد القياسات المسجلة لمرحلة في Prometheus"""
+    return REGISTRY.get_sample_value("gpu_worker_stage_duration_seconds_count", {"stage": stage}) or 0
+
+
+class TestStageTimer:
+    """اختبارات مؤقت المراحل"""
+
+    def test_records_stages_and_histogram(self):
+        """اختبار تسجيل المرحلة في القاموس وفي Prometheus"""
+        before = _stage_count("decode")
+        timer = StageTimer()
+
+        with timer.stage("decode"):
+            pass
+        timer.record("queue", 0.25)
+
+        assert list(timer.to_dict()) == ["decode", "queue"]
+        assert timer.to_dict()["queue"] == 0.25
+        assert _stage_count("decode") == before + 1
+
+    def test_records_on_error(self):
+        """اختبار تسجيل المرحلة حتى عند فشلها"""
+        timer = StageTimer()
+
+        with pytest.raises(RuntimeError):
+            with timer.stage("inference"):
+                raise RuntimeError("boom")
+
+        assert "inference" in timer.to_dict()
+
+
+class TestUpscalerStages:
+    """اختبارات مراحل المعالج"""
+
+    @pytest.mark.asyncio
+    async def test_stage_breakdown_in_metadata(self, tmp_path, monkeypatch):
+        """اختبار إرفاق زمن كل مرحلة بنتيجة الطلب"""
+        monkeypatch.setattr(settings, "RESULT_DIR", str(tmp_path / "results"))
+        monkeypatch.setattr(settings, "MAX_IMAGE_SIZE", 64)
+
+        path = tmp_path / "input.png"
+        Image.new("RGB", (96, 64), color="blue").save(path, "PNG")
+
+        upscaler = FluxUpscaler()
+        upscaler.device = "cpu"
+        upscaler.pipeline = IdentityFakePipeline()
+        upscaler.is_loaded = True
+        upscaler.processing_config = {**upscaler.processing_config, "enable_tiling": False}
+
+        timer = StageTimer()
+        timer.record("upload", 0.01)
+        try:
+            result = await upscaler.upscale_image(str(path), "prompt", stage_timer=timer)
+        finally:
+            upscaler.executor.shutdown()
+
+        assert result.status == ProcessingStatus.COMPLETED
+        stages = result.metadata["stages"]
+        assert list(stages) == ["upload", "decode", "resize", "inference", "encode", "save"]
+        assert stages["encode"] == pytest.approx(result.metadata["encoding"]["encode_time"], abs=1e-4)
+        assert all(duration >= 0 for duration in stages.values())
+
+    @pytest.mark.asyncio
+    async def test_queue_wait_is_recorded(self):
+        """اختبار تسجيل زمن الانتظار في الطابور"""
+        received = {}
+
+        class FakeUpscaler:
+            async def upscale_image(self, image, prompt, task_id=None, stage_timer=None, **kwargs):
+                received["stages"] = stage_timer.to_dict()
+                raise RuntimeError("stop")
+
+        queue = TaskQueue(FakeUpscaler(), config={"max_queue_size": 4, "num_workers": 1, "history_size": 10})
+        task = queue.submit("missing.png", "prompt", stage_timer=StageTimer())
+        queue.start()
+        try:
+            for _ in range(100):
+                if queue.get(task.task_id).status == ProcessingStatus.FAILED:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+
+        assert "queue" in received["stages"]
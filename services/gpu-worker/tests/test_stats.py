@@ -0,0 +1,128 @@
+"""
+اختبارات الإحصائيات المتدفقة
+"""
+
+import pytest
+import os
+import sys
+import random
+from datetime import date
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from core.stats import QuantileSketch, RollingQuantileSketch, WindowedCounter, DailyCounter
+from core.monitoring import MetricsCollector
+
+
+class FakeClock:
+    """ساعة يتحكم بها الاختبار"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestQuantileSketch:
+    """اختبارات المدرج اللوغاريتمي"""
+
+    def test_quantiles_within_relative_accuracy(self):
+        """اختبار دقة النسب المئوية مقارنة بالقيم المرتبة"""
+        rng = random.Random(7)
+        values = [rng.lognormvariate(0, 1) for _ in range(20000)]
+        sketch = QuantileSketch(relative_accuracy=0.01)
+        for value in values:
+            sketch.add(value)
+
+        ordered = sorted(values)
+        for q in (0.5, 0.9, 0.99):
+            exact = ordered[int(q * (len(ordered) - 1))]
+            assert sketch.quantile(q) == pytest.approx(exact, rel=0.02)
+
+        assert sketch.count == len(values)
+        assert sketch.mean == pytest.approx(sum(values) / len(values))
+
+    def test_fixed_memory(self):
+        """اختبار أن عدد الخانات لا يتغير مع عدد القيم"""
+        sketch = QuantileSketch()
+        size = len(sketch.buckets)
+        for value in (1e-9, 0.5, 3.0, 1e9):
+            sketch.add(value)
+
+        assert len(sketch.buckets) == size
+        assert (sketch.quantile(0.0), sketch.quantile(1.0)) == (1e-9, 1e9)
+        assert sketch.quantile(0.5) == pytest.approx(0.5, rel=0.02)
+
+    def test_empty(self):
+        """اختبار مدرج فارغ"""
+        assert QuantileSketch().summary() == {"count": 0, "mean": 0.0, "min": 0.0, "max": 0.0,
+                                              "p50": 0.0, "p90": 0.0, "p99": 0.0}
+
+    def test_rolling_window_forgets_old_values(self):
+        """اختبار نسيان القيم بعد نافذتين"""
+        clock = FakeClock()
+        sketch = RollingQuantileSketch(window_seconds=60, clock=clock)
+        sketch.add(10.0)
+
+        clock.now += 70
+        sketch.add(1.0)
+        assert sketch.snapshot().count == 2
+
+        clock.now += 60
+        assert sketch.snapshot().count == 1
+        assert sketch.snapshot().quantile(0.5) == pytest.approx(1.0, rel=0.02)
+
+        clock.now += 500
+        assert sketch.snapshot().count == 0
+
+
+class TestWindowedCounters:
+    """اختبارات العدادات الزمنية"""
+
+    def test_total_over_window(self):
+        """اختبار المجموع على آخر دقائق فقط"""
+        clock = FakeClock(0)
+        counter = WindowedCounter(bucket_seconds=60, buckets=5, clock=clock)
+
+        for minute in range(7):
+            clock.now = minute * 60
+            counter.add(minute + 1)
+
+        # آخر 5 دقائق فقط محفوظة: 3 + 4 + 5 + 6 + 7
+        assert counter.total() == 25
+        assert counter.total(120) == 13
+
+        clock.now += 10 * 60
+        assert counter.total() == 0
+
+    def test_daily_counter_resets(self):
+        """اختبار بدء عداد اليوم من الصفر"""
+        today = {"value": date(2024, 1, 1)}
+        counter = DailyCounter(today=lambda: today["value"])
+        counter.add()
+        counter.add()
+
+        assert counter.value() == 2
+        today["value"] = date(2024, 1, 2)
+        assert counter.value() == 0
+
+
+class TestMetricsCollectorSummary:
+    """اختبارات ملخص المعالجة"""
+
+    def test_processing_summary(self):
+        """اختبار النسب المئوية ونسبة النجاح وعدد اليوم"""
+        collector = MetricsCollector()
+        for duration in (1.0, 2.0, 3.0, 4.0):
+            collector.record_processing_time(duration)
+            collector.record_image_processed(True)
+        collector.record_image_processed(False)
+
+        summary = collector.get_processing_summary()
+
+        assert summary["processing_time"]["count"] == 4
+        assert summary["processing_time"]["p50"] == pytest.approx(2.0, rel=0.02)
+        assert summary["success_rate"] == 80.0
+        assert summary["processed_today"] == 5
+        assert collector.get_summary()["recent_processing_times"] == [1.0, 2.0, 3.0, 4.0]
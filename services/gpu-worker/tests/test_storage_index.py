@@ -0,0 +1,156 @@
+"""
+اختبارات فهرس التخزين والمنظف
+"""
+
+import pytest
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from utils.storage_index import StorageIndex, StorageJanitor
+
+
+def _config(tmp_path, max_age_seconds=3600, max_bytes=0):
+    directories = {}
+    for name in ("uploads", "results"):
+        path = tmp_path / name
+        path.mkdir(exist_ok=True)
+        directories[name] = {"path": str(path), "max_age_seconds": max_age_seconds, "max_bytes": max_bytes}
+    return {"cleanup_interval": 3600, "directories": directories}
+
+
+def _write(directory, name, size, mtime):
+    path = directory / name
+    path.write_bytes(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+class TestStorageIndex:
+    """اختبارات الفهرس والحذف"""
+
+    def test_scan_then_evict_by_age(self, tmp_path):
+        """اختبار بناء الفهرس من القرص وحذف الملفات القديمة فقط"""
+        config = _config(tmp_path)
+        now = time.time()
+        old = _write(tmp_path / "results", "old.png", 10, now - 7200)
+        new = _write(tmp_path / "results", "new.png", 10, now - 60)
+
+        index = StorageIndex(config)
+        index.scan()
+        removed = index.evict(now=now)
+
+        assert removed == [old]
+        assert not os.path.exists(old) and os.path.exists(new)
+        assert index.get_stats()["results"]["file_count"] == 1
+
+    def test_evict_by_budget_oldest_first(self, tmp_path):
+        """اختبار حذف الأقدم حتى يعود المجلد ضمن حجمه"""
+        index = StorageIndex(_config(tmp_path, max_age_seconds=0, max_bytes=25))
+        now = time.time()
+        paths = [_write(tmp_path / "results", f"{i}.png", 10, now - 100 + i) for i in range(4)]
+        for i, path in enumerate(paths):
+            index.add(path, size=10, mtime=now - 100 + i)
+
+        removed = index.evict(now=now)
+
+        assert removed == paths[:2]
+        assert index.get_stats()["results"]["total_size"] == 20
+
+    def test_pinned_files_are_kept(self, tmp_path):
+        """اختبار عدم حذف ملفات مهام لم تنته"""
+        index = StorageIndex(_config(tmp_path, max_age_seconds=60))
+        now = time.time()
+        pinned = _write(tmp_path / "uploads", "in_use.png", 10, now - 600)
+        index.add(pinned, size=10, mtime=now - 600, pinned=True)
+
+        assert index.evict(now=now) == []
+        index.unpin(pinned)
+        assert index.evict(now=now) == [pinned]
+
+    def test_cost_scales_with_evicted_files(self, tmp_path):
+        """اختبار أن الجولة لا تمر على الملفات الحديثة"""
+        index = StorageIndex(_config(tmp_path, max_age_seconds=60))
+        now = time.time()
+        for i in range(1000):
+            index.add(str(tmp_path / "results" / f"{i}.png"), size=1, mtime=now)
+
+        visited = []
+        original = index._forget
+        index._forget = lambda directory, name: (visited.append(name), original(directory, name))
+
+        assert index.evict(now=now) == []
+        assert visited == []
+
+    def test_replaced_and_removed_entries(self, tmp_path):
+        """اختبار تحديث الحجم عند استبدال ملف وتجاهل الإدخالات القديمة"""
+        index = StorageIndex(_config(tmp_path, max_age_seconds=60))
+        now = time.time()
+        path = _write(tmp_path / "results", "a.png", 30, now)
+
+        index.add(path, size=10, mtime=now - 600)
+        index.add(path, size=30, mtime=now)
+        assert index.get_stats()["results"]["total_size"] == 30
+        assert index.evict(now=now) == []
+
+        index.remove(path)
+        assert index.get_stats()["results"]["file_count"] == 0
+
+    def test_ignores_unmanaged_paths(self, tmp_path):
+        """اختبار تجاهل الملفات خارج المجلدات المُدارة"""
+        index = StorageIndex(_config(tmp_path))
+        index.add(str(tmp_path / "elsewhere.png"), size=5)
+
+        assert all(stats["file_count"] == 0 for stats in index.get_stats().values())
+
+    def test_reconcile_corrects_drift(self, tmp_path):
+        """اختبار تصحيح المجاميع عند حذف أو إضافة ملفات خارج الخدمة"""
+        index = StorageIndex(_config(tmp_path))
+        now = time.time()
+        kept = _write(tmp_path / "results", "kept.png", 10, now - 60)
+        gone = _write(tmp_path / "results", "gone.png", 20, now - 60)
+        index.scan()
+
+        os.remove(gone)
+        _write(tmp_path / "results", "external.png", 5, now - 30)
+        drift = index.reconcile()
+
+        assert drift["results"] == {"missing": 1, "untracked": 1, "bytes": -15}
+        assert drift["uploads"] == {"missing": 0, "untracked": 0, "bytes": 0}
+        assert index.get_stats()["results"]["total_size"] == 15
+        assert index.last_reconcile["drift"] == drift
+        assert os.path.exists(kept)
+
+    def test_stats_do_not_touch_disk(self, tmp_path, monkeypatch):
+        """اختبار أن الإحصائيات تُقرأ من المجاميع الجارية دون قراءة المجلدات"""
+        index = StorageIndex(_config(tmp_path))
+        for i in range(3):
+            index.add(str(tmp_path / "uploads" / f"{i}.png"), size=100, mtime=time.time())
+
+        def fail(*args, **kwargs):
+            raise AssertionError("disk access")
+
+        monkeypatch.setattr(os, "scandir", fail)
+        monkeypatch.setattr(os, "stat", fail)
+
+        stats = index.get_stats()["uploads"]
+        assert (stats["file_count"], stats["total_size"]) == (3, 300)
+
+
+class TestStorageJanitor:
+    """اختبارات المنظف"""
+
+    @pytest.mark.asyncio
+    async def test_start_scans_and_cleans(self, tmp_path):
+        """اختبار بناء الفهرس وجولة أولى عند التشغيل"""
+        config = _config(tmp_path, max_age_seconds=60)
+        old = _write(tmp_path / "uploads", "orphan.png", 10, time.time() - 600)
+
+        janitor = StorageJanitor(StorageIndex(config), interval=3600)
+        await janitor.start()
+        await janitor.stop()
+
+        assert not os.path.exists(old)
+        assert janitor.index.evicted_total == 1
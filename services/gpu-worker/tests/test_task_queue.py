@@ -0,0 +1,152 @@
+"""
+اختبارات طابور المهام
+"""
+
+import pytest
+import asyncio
+import io
+import os
+import sys
+from fastapi.testclient import TestClient
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import app as app_module
+from core.config import settings
+from core.models import ProcessingStatus
+from core.task_queue import TaskQueue, QueueFullError
+from utils.file_handler import FileHandler
+from conftest import FakeUpscaler, queue_config
+
+
+class TestTaskQueue:
+    """اختبارات الطابور"""
+
+    @pytest.mark.asyncio
+    async def test_submit_returns_pending(self):
+        """اختبار إرجاع حالة الانتظار فوراً"""
+        queue = TaskQueue(FakeUpscaler(), config=queue_config())
+
+        response = queue.submit("/tmp/input.png", "prompt")
+
+        assert response.status == ProcessingStatus.PENDING
+        assert queue.qsize() == 1
+        assert queue.get(response.task_id).status == ProcessingStatus.PENDING
+
+    @pytest.mark.asyncio
+    async def test_worker_completes_task(self):
+        """اختبار معالجة المهمة بواسطة العامل"""
+        upscaler = FakeUpscaler()
+        queue = TaskQueue(upscaler, config=queue_config())
+        queue.start()
+
+        try:
+            response = queue.submit("/tmp/input.png", "prompt")
+            await asyncio.wait_for(queue._queue.join(), timeout=5)
+        finally:
+            await queue.stop()
+
+        task = queue.get(response.task_id)
+        assert task.status == ProcessingStatus.COMPLETED
+        assert task.created_at == response.created_at
+        assert upscaler.task_ids == [response.task_id]
+        assert queue.get_stats()["tasks"]["completed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_worker_records_failure(self):
+        """اختبار تسجيل فشل المهمة"""
+        queue = TaskQueue(FakeUpscaler(fail=True), config=queue_config())
+        queue.start()
+
+        try:
+            response = queue.submit("/tmp/input.png", "prompt")
+            await asyncio.wait_for(queue._queue.join(), timeout=5)
+        finally:
+            await queue.stop()
+
+        task = queue.get(response.task_id)
+        assert task.status == ProcessingStatus.FAILED
+        assert task.error_message == "boom"
+
+    @pytest.mark.asyncio
+    async def test_queue_full(self):
+        """اختبار رفض المهام عند امتلاء الطابور"""
+        queue = TaskQueue(FakeUpscaler(), config=queue_config(max_queue_size=1))
+        queue.submit("/tmp/a.png", "prompt")
+
+        with pytest.raises(QueueFullError):
+            queue.submit("/tmp/b.png", "prompt")
+
+    @pytest.mark.asyncio
+    async def test_history_pruned(self):
+        """اختبار حذف أقدم المهام المنتهية"""
+        queue = TaskQueue(FakeUpscaler(), config=queue_config(history_size=2))
+        queue.start()
+
+        try:
+            ids = []
+            for i in range(4):
+                ids.append(queue.submit(f"/tmp/{i}.png", "prompt").task_id)
+                await asyncio.wait_for(queue._queue.join(), timeout=5)
+        finally:
+            await queue.stop()
+
+        assert queue.get(ids[0]) is None
+        assert queue.get(ids[-1]) is not None
+
+
+class TestTaskEndpoints:
+    """اختبارات endpoints المهام"""
+
+    @pytest.fixture
+    def client(self, tmp_path, monkeypatch):
+        """عميل الاختبار مع طابور غير مُشغَّل"""
+        monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path / "uploads"))
+        monkeypatch.setattr(settings, "RESULT_DIR", str(tmp_path / "results"))
+        monkeypatch.setattr(settings, "TEMP_DIR", str(tmp_path / "temp"))
+
+        upscaler = FakeUpscaler()
+        monkeypatch.setattr(app_module, "upscaler", upscaler)
+        monkeypatch.setattr(app_module, "file_handler", FileHandler())
+        monkeypatch.setattr(app_module, "task_queue", TaskQueue(upscaler, config=queue_config()))
+
+        return TestClient(app_module.app)
+
+    @staticmethod
+    def _png_bytes():
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 64), color="blue").save(buffer, "PNG")
+        return buffer.getvalue()
+
+    def test_upscale_returns_task_id(self, client):
+        """اختبار إرجاع معرف المهمة دون انتظار المعالجة"""
+        response = client.post(
+            "/upscale",
+            files={"file": ("image.png", self._png_bytes(), "image/png")}
+        )
+        assert response.status_code == 202
+
+        data = response.json()
+        assert data["status"] == "pending"
+
+        task = client.get(f"/tasks/{data['task_id']}")
+        assert task.status_code == 200
+        assert task.json()["status"] == "pending"
+
+        tasks = client.get("/tasks").json()
+        assert tasks["queue_size"] == 1
+        assert tasks["tasks"][0]["task_id"] == data["task_id"]
+
+    def test_invalid_image_rejected(self, client):
+        """اختبار رفض الملفات غير الصالحة"""
+        response = client.post(
+            "/upscale",
+            files={"file": ("image.png", b"not an image", "image/png")}
+        )
+        assert response.status_code == 400
+
+    def test_unknown_task(self, client):
+        """اختبار مهمة غير موجودة"""
+        response = client.get("/tasks/does-not-exist")
+        assert response.status_code == 404
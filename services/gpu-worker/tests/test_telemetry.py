@@ -0,0 +1,207 @@
+"""
+اختبارات جامع القياسات في الخلفية
+"""
+
+import pytest
+import os
+import sys
+import time
+from prometheus_client import REGISTRY
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import app as app_module
+from core.worker_pool import GPUWorkerPool
+from utils import telemetry
+from utils.telemetry import TelemetrySampler
+from utils.gpu_monitor import GPUMonitor
+
+
+def _sampler(history_size=3, interval=0.01, gpus=None):
+    """جامع بأجهزة وهمية"""
+    sampler = TelemetrySampler(config={"interval": interval, "history_size": history_size})
+    readings = iter(gpus or [])
+    sampler._read_gpus = lambda: next(readings, [])
+    return sampler
+
+
+def _gpu(utilization, used=4.0, total=8.0):
+    return [{"index": 0, "utilization": utilization, "memory_used_gb": used,
+             "memory_total_gb": total, "temperature": 60, "power_draw": 200.0}]
+
+
+class FakeNvml:
+    """NVML وهمي بأجهزة معروفة بالـ UUID"""
+
+    class NVMLError(Exception):
+        pass
+
+    NVML_TEMPERATURE_GPU = 0
+
+    def __init__(self, devices, fail_init=False):
+        self.devices = devices
+        self.fail_init = fail_init
+        self.initialized = False
+
+    def nvmlInit(self):
+        if self.fail_init:
+            raise self.NVMLError("driver not loaded")
+        self.initialized = True
+
+    def nvmlShutdown(self):
+        self.initialized = False
+
+    def nvmlDeviceGetHandleByUUID(self, uuid):
+        if uuid not in self.devices:
+            raise self.NVMLError(uuid)
+        return uuid
+
+    def nvmlDeviceGetMemoryInfo(self, handle):
+        class Memory:
+            used = self.devices[handle] * telemetry.GB
+            total = 80 * telemetry.GB
+        return Memory()
+
+    def nvmlDeviceGetUtilizationRates(self, handle):
+        class Utilization:
+            gpu = self.devices[handle]
+        return Utilization()
+
+    def nvmlDeviceGetTemperature(self, handle, sensor):
+        return 50
+
+    def nvmlDeviceGetPowerUsage(self, handle):
+        return 100000
+
+
+def _nvml_sampler(monkeypatch, nvml, uuids):
+    """جامع يرى أجهزة PyTorch بالـ UUID المعطاة عبر NVML الوهمي"""
+    monkeypatch.setattr(telemetry, "pynvml", nvml, raising=False)
+    monkeypatch.setattr(telemetry, "NVML_AVAILABLE", True)
+    monkeypatch.setattr(telemetry, "torch_device_uuids", lambda: list(uuids))
+    sampler = TelemetrySampler(config={"interval": 60, "history_size": 3})
+    sampler.cuda_available = True
+    return sampler
+
+
+class TestTelemetrySampler:
+    """اختبارات حلقة العينات والمتوسطات"""
+
+    def test_rolling_averages_over_ring_buffer(self):
+        """اختبار حساب المتوسط على آخر العينات فقط"""
+        sampler = _sampler(history_size=3, gpus=[_gpu(10), _gpu(20), _gpu(30), _gpu(70, used=8.0)])
+
+        for _ in range(4):
+            sampler.sample()
+        averages = sampler.averages()
+
+        assert averages["samples"] == 3
+        assert averages["gpu_utilization_avg"] == pytest.approx(40.0)
+        assert averages["gpu_memory_percent_avg"] == pytest.approx((50 + 50 + 100) / 3, abs=0.01)
+        assert [sample["gpus"][0]["utilization"] for sample in sampler.history()] == [20, 30, 70]
+
+    def test_latest_samples_on_demand(self):
+        """اختبار أخذ عينة عند القراءة قبل تشغيل الخيط"""
+        sampler = _sampler()
+
+        sample = sampler.latest
+
+        assert sample.memory_total_gb > 0
+        assert sampler.averages()["samples"] == 1
+
+    def test_background_thread(self):
+        """اختبار تشغيل الخيط وإيقافه"""
+        sampler = _sampler(history_size=50)
+        sampler.start()
+        try:
+            time.sleep(0.1)
+        finally:
+            sampler.stop()
+
+        assert sampler.averages()["samples"] > 1
+        assert sampler._thread is None
+
+
+class TestMonitorReadsSnapshot:
+    """اختبارات قراءة المراقب من آخر عينة"""
+
+    def test_reads_do_not_probe(self, monkeypatch):
+        """اختبار أن القراءة لا تستدعي nvidia-smi ولا تنتظر cpu_percent"""
+        import psutil
+
+        sampler = _sampler(gpus=[_gpu(55)])
+        sampler.sample()
+        monitor = GPUMonitor(telemetry=sampler)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("sampled on the request path")
+
+        monkeypatch.setattr(sampler, "sample", fail)
+        monkeypatch.setattr(psutil, "cpu_percent", fail)
+
+        start = time.perf_counter()
+        stats = monitor.get_system_stats()
+        memory = monitor.get_memory_usage()
+
+        assert time.perf_counter() - start < 0.5
+        assert "cpu" in stats and stats["averages"]["samples"] == 1
+        assert memory["total"] > 0
+
+
+class TestDeviceMapping:
+    """اختبارات NVML وترقيم الأجهزة"""
+
+    def test_nvml_init_failure_falls_back(self, monkeypatch):
+        """اختبار أن فشل تهيئة NVML في start لا يوقف الجامع"""
+        nvml = FakeNvml({}, fail_init=True)
+        sampler = _nvml_sampler(monkeypatch, nvml, [])
+        sampler.start()
+        try:
+            assert sampler.source != "nvml"
+            assert sampler.averages()["samples"] == 1
+        finally:
+            sampler.stop()
+
+    def test_devices_mapped_by_uuid(self, monkeypatch):
+        """اختبار ربط أرقام PyTorch بأجهزة NVML بالـ UUID وتسمية المقاييس لكل جهاز"""
+        # CUDA_VISIBLE_DEVICES=3,1: cuda:0 هو الجهاز الرابع في NVML
+        nvml = FakeNvml({"GPU-a": 10, "GPU-b": 20, "GPU-c": 30, "GPU-d": 40})
+        sampler = _nvml_sampler(monkeypatch, nvml, ["GPU-d", "GPU-b"])
+        sampler.start()
+        try:
+            gpus = sampler.latest.gpus
+        finally:
+            sampler.stop()
+
+        assert [(gpu["index"], gpu["utilization"]) for gpu in gpus] == [(0, 40.0), (1, 20.0)]
+        assert not nvml.initialized
+        for device, utilization in (("cuda:0", 40.0), ("cuda:1", 20.0)):
+            assert REGISTRY.get_sample_value(
+                "gpu_worker_gpu_utilization_percent", {"device": device}
+            ) == utilization
+
+        monitor = GPUMonitor(telemetry=sampler)
+        assert monitor._device_sample(1)["utilization"] == 20.0
+
+
+class TestSharedMonitor:
+    """اختبارات مشاركة مراقب الخدمة"""
+
+    def test_memory_average_is_gpu_memory(self, monkeypatch):
+        """اختبار أن memory_usage_avg يقيس ذاكرة GPU وليس ذاكرة النظام"""
+        sampler = _sampler(gpus=[_gpu(50, used=2.0, total=8.0)])
+        sampler.sample()
+        monkeypatch.setattr(app_module, "gpu_monitor", GPUMonitor(telemetry=sampler))
+        monkeypatch.setattr(app_module, "upscaler", None)
+
+        assert app_module.get_processing_metrics().memory_usage_avg == pytest.approx(25.0)
+
+    def test_pool_passes_monitor_to_replicas(self):
+        """اختبار أن كل نسخة تستخدم مراقب الخدمة نفسه"""
+        monitor = object()
+        pool = GPUWorkerPool(devices=["cpu", "cpu"], monitor=monitor)
+        try:
+            assert all(replica.upscaler.monitor is monitor for replica in pool.replicas)
+        finally:
+            for replica in pool.replicas:
+                replica.upscaler.executor.shutdown()
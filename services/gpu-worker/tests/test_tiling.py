@@ -0,0 +1,131 @@
+"""
+اختبارات المعالجة بالبلاطات
+"""
+
+import pytest
+import os
+import sys
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from core.config import settings
+from core.models import ProcessingStatus
+from core.tiling import plan_tiles, TileBlender
+from core.upscaler import FluxUpscaler
+
+
+class IdentityFakePipeline:
+    """pipeline وهمي يعيد البلاطات كما هي ويسجل أحجامها"""
+
+    def __init__(self, scale: int = 1):
+        self.scale = scale
+        self.sizes = []
+
+    def __call__(self, **kwargs):
+        images = kwargs["image"] if isinstance(kwargs["image"], list) else [kwargs["image"]]
+        self.sizes.extend(image.size for image in images)
+
+        class Output:
+            pass
+
+        output = Output()
+        output.images = [
+            image.resize((image.width * self.scale, image.height * self.scale), Image.Resampling.NEAREST)
+            for image in images
+        ]
+        return output
+
+
+def _gradient_image(width, height):
+    """صورة متدرجة لاكتشاف أخطاء المواضع"""
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack([x.repeat(height, 0), y.repeat(width, 1), (x + y) / 2], axis=-1)
+    return Image.fromarray(pixels.astype(np.uint8), "RGB")
+
+
+class TestTilePlanning:
+    """اختبارات تخطيط البلاطات"""
+
+    def test_tiles_cover_image(self):
+        """اختبار تغطية البلاطات للصورة كاملة"""
+        boxes = plan_tiles((2500, 1300), tile_size=1024, overlap=128)
+
+        covered = np.zeros((1300, 2500), dtype=bool)
+        for left, top, right, bottom in boxes:
+            assert right - left == 1024 and bottom - top == 1024
+            covered[top:bottom, left:right] = True
+
+        assert covered.all()
+
+    def test_small_axis_uses_single_tile(self):
+        """اختبار محور أصغر من البلاطة"""
+        boxes = plan_tiles((3000, 800), tile_size=1024, overlap=128)
+
+        assert all(top == 0 and bottom == 800 for _, top, _, bottom in boxes)
+
+    def test_invalid_overlap(self):
+        """اختبار رفض تداخل أكبر من البلاطة"""
+        with pytest.raises(ValueError):
+            plan_tiles((2000, 2000), tile_size=256, overlap=256)
+
+    def test_blend_reconstructs_image(self):
+        """اختبار إعادة بناء الصورة من بلاطات غير معدلة"""
+        image = _gradient_image(300, 200)
+        blender = TileBlender(image.size, overlap=32)
+
+        for box in plan_tiles(image.size, tile_size=128, overlap=32):
+            blender.add(box, image.crop(box))
+
+        difference = np.abs(np.asarray(blender.result(), dtype=np.int16) - np.asarray(image, dtype=np.int16))
+        assert difference.max() <= 1
+
+    def test_blend_keeps_one_band(self):
+        """اختبار طباعة الأسطر المكتملة وبقاء شريط float32 بارتفاع بلاطة فقط"""
+        image = _gradient_image(200, 600)
+        blender = TileBlender(image.size, overlap=16, scale=2)
+
+        for box in plan_tiles(image.size, tile_size=64, overlap=16):
+            blender.add(box, image.crop(box).resize(((box[2] - box[0]) * 2, (box[3] - box[1]) * 2)))
+            assert len(blender._canvas) <= 64 * 2
+
+        expected = np.asarray(image.resize((400, 1200)), dtype=np.int16)
+        difference = np.abs(np.asarray(blender.result(), dtype=np.int16) - expected)
+        assert difference.max() <= 2
+
+        with pytest.raises(ValueError):
+            blender.add((0, 0, 64, 64), image.crop((0, 0, 64, 64)))
+
+
+class TestUpscalerTiling:
+    """اختبارات البلاطات داخل المعالج"""
+
+    @pytest.fixture
+    def upscaler(self, tmp_path, monkeypatch):
+        """معالج بـ pipeline وهمي وحد صغير للحجم"""
+        monkeypatch.setattr(settings, "RESULT_DIR", str(tmp_path / "results"))
+        monkeypatch.setattr(settings, "MAX_IMAGE_SIZE", 128)
+
+        upscaler = FluxUpscaler()
+        upscaler.device = "cpu"
+        upscaler.pipeline = IdentityFakePipeline(scale=2)
+        upscaler.is_loaded = True
+        upscaler.processing_config.update({"tile_size": 96, "tile_overlap": 16, "tile_batch_size": 2})
+        yield upscaler
+        upscaler.executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_large_image_processed_in_tiles(self, upscaler, tmp_path):
+        """اختبار معالجة صورة كبيرة بالبلاطات بدلاً من تصغيرها"""
+        path = tmp_path / "large.png"
+        _gradient_image(250, 180).save(path, "PNG")
+
+        result = await upscaler.upscale_image(str(path), "prompt")
+
+        assert result.status == ProcessingStatus.COMPLETED
+        assert result.metadata["tiled"] is True
+        assert result.metadata["tiles"] == len(plan_tiles((250, 180), 96, 16))
+        assert tuple(result.output_size) == (500, 360)
+        assert max(max(size) for size in upscaler.pipeline.sizes) <= 96
@@ -0,0 +1,161 @@
+"""
+اختبارات مجمع عمال GPU على أجهزة وهمية
+"""
+
+import pytest
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+from PIL import Image
+from prometheus_client import REGISTRY
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from core.config import settings
+from core.models import UpscaleResponse, ProcessingStatus
+from core.upscaler import FluxUpscaler
+from core.worker_pool import GPUWorkerPool, resolve_devices
+
+
+class FakeDeviceUpscaler:
+    """معالج وهمي لجهاز واحد بوقت خدمة ثابت"""
+
+    def __init__(self, device: str, delay: float = 0.0, loaded: bool = True,
+                 status: ProcessingStatus = ProcessingStatus.COMPLETED):
+        self.device = device
+        self.delay = delay
+        self.is_loaded = loaded
+        self.status = status
+        self.calls = 0
+
+    async def load_models(self):
+        return self.is_loaded
+
+    async def upscale_image(self, image, prompt, task_id=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return UpscaleResponse(
+            task_id=task_id or "task",
+            status=self.status,
+            output_path=f"/tmp/{task_id}.png",
+            completed_at=datetime.now(),
+            metadata={"cache_hit": False}
+        )
+
+
+class SlowFakePipeline:
+    """pipeline وهمي يحجب خيط الاستدلال"""
+
+    def __call__(self, **kwargs):
+        time.sleep(0.3)
+
+        class Output:
+            images = [kwargs["image"].copy()]
+
+        return Output()
+
+
+class TestDeviceResolution:
+    """اختبارات تحديد الأجهزة"""
+
+    def test_explicit_ids(self):
+        """اختبار تحويل المعرفات إلى أجهزة CUDA"""
+        assert resolve_devices(["0", "1"]) == ["cuda:0", "cuda:1"]
+        assert resolve_devices(["cpu", "cuda:3"]) == ["cpu", "cuda:3"]
+
+
+class TestGPUWorkerPool:
+    """اختبارات التوزيع"""
+
+    @pytest.mark.asyncio
+    async def test_spreads_concurrent_jobs(self):
+        """اختبار توزيع المهام المتزامنة على كل الأجهزة"""
+        pool = GPUWorkerPool(
+            devices=["fake:0", "fake:1", "fake:2"],
+            factory=lambda device: FakeDeviceUpscaler(device, delay=0.05)
+        )
+
+        results = await asyncio.gather(*[pool.upscale_image("in.png", "p", task_id=str(i)) for i in range(6)])
+
+        assert [replica.upscaler.calls for replica in pool.replicas] == [2, 2, 2]
+        assert {result.metadata["device"] for result in results} == {"fake:0", "fake:1", "fake:2"}
+        assert all(replica.active == 0 for replica in pool.replicas)
+
+    @pytest.mark.asyncio
+    async def test_prefers_faster_device(self):
+        """اختبار تفضيل الجهاز الأسرع بعد قياس وقت الخدمة"""
+        pool = GPUWorkerPool(
+            devices=["fast", "slow"],
+            factory=lambda device: FakeDeviceUpscaler(device, delay=0.01 if device == "fast" else 0.2)
+        )
+        pool.replicas[0].service_time = 0.01
+        pool.replicas[1].service_time = 0.2
+
+        await asyncio.gather(*[pool.upscale_image("in.png", "p") for _ in range(6)])
+
+        fast, slow = (replica.upscaler.calls for replica in pool.replicas)
+        assert fast > slow
+
+    @pytest.mark.asyncio
+    async def test_skips_unloaded_devices(self):
+        """اختبار استبعاد الأجهزة التي فشل تحميلها"""
+        pool = GPUWorkerPool(
+            devices=["fake:0", "fake:1"],
+            factory=lambda device: FakeDeviceUpscaler(device, loaded=device == "fake:1")
+        )
+
+        assert await pool.load_models()
+        assert pool.replica_count == 1
+
+        result = await pool.upscale_image("in.png", "p")
+        assert result.metadata["device"] == "fake:1"
+        assert pool.replicas[1].completed == 1
+
+    @pytest.mark.asyncio
+    async def test_cancelled_jobs_are_not_failures(self):
+        """اختبار عدّ المهام الملغاة منفصلة عن الفاشلة في العدادات والمقاييس"""
+        pool = GPUWorkerPool(
+            devices=["cancel:0"],
+            factory=lambda device: FakeDeviceUpscaler(device, status=ProcessingStatus.CANCELLED)
+        )
+
+        def jobs(status):
+            return REGISTRY.get_sample_value(
+                "gpu_worker_device_jobs_total", {"device": "cancel:0", "status": status}
+            ) or 0
+
+        before = {status: jobs(status) for status in ("cancelled", "failed")}
+        await pool.upscale_image("in.png", "p")
+
+        replica = pool.replicas[0]
+        assert (replica.cancelled, replica.failed, replica.completed) == (1, 0, 0)
+        assert jobs("cancelled") == before["cancelled"] + 1
+        assert jobs("failed") == before["failed"]
+
+    @pytest.mark.asyncio
+    async def test_replicas_run_in_parallel(self, tmp_path, monkeypatch):
+        """اختبار أن نسخاً حقيقية من FluxUpscaler تعمل بالتوازي على خيوط منفصلة"""
+        monkeypatch.setattr(settings, "RESULT_DIR", str(tmp_path / "results"))
+        path = tmp_path / "input.png"
+        Image.new("RGB", (64, 64), color="red").save(path, "PNG")
+
+        def factory(device):
+            upscaler = FluxUpscaler(device="cpu")
+            upscaler.pipeline = SlowFakePipeline()
+            upscaler.is_loaded = True
+            return upscaler
+
+        pool = GPUWorkerPool(devices=["cpu:0", "cpu:1"], factory=factory)
+        try:
+            start = time.perf_counter()
+            results = await asyncio.gather(*[pool.upscale_image(str(path), "p") for _ in range(4)])
+            elapsed = time.perf_counter() - start
+        finally:
+            for replica in pool.replicas:
+                replica.upscaler.executor.shutdown()
+
+        assert all(result.status == ProcessingStatus.COMPLETED for result in results)
+        # 4 مهام × 0.3 ثانية على جهازين ≈ 0.6 ثانية بدلاً من 1.2
+        assert elapsed < 1.0
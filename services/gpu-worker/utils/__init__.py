@@ -2,10 +2,23 @@
 Utilities module for GPU Worker Service
 """
 
-from .file_handler import FileHandler
+from .file_handler import FileHandler, SavedUpload, UploadTooLargeError
+from .file_response import SendfileResponse
+from .upload_limit import UploadLimitMiddleware
 from .gpu_monitor import GPUMonitor
+from .telemetry import TelemetrySampler
+from .storage_index import StorageIndex, StorageJanitor
+from .archive import ZipStream
 
 __all__ = [
     "FileHandler",
-    "GPUMonitor"
+    "SavedUpload",
+    "UploadTooLargeError",
+    "SendfileResponse",
+    "UploadLimitMiddleware",
+    "GPUMonitor",
+    "TelemetrySampler",
+    "StorageIndex",
+    "StorageJanitor",
+    "ZipStream"
 ]
@@ -0,0 +1,43 @@
+"""
+أرشيف zip متدفق - يُبث للعميل أثناء إنتاجه دون ملف مؤقت
+"""
+
+import zipfile
+
+
+class ZipStream:
+    """يكتب أرشيف zip في ذاكرة صغيرة تُفرغ بعد كل ملف - zipfile يستخدم data descriptors لأن الكتابة بلا seek"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # النتائج مضغوطة أصلاً (PNG/WebP/JPEG) فلا فائدة من ضغطها مرة أخرى
+        self._zip = zipfile.ZipFile(self, "w", compression=zipfile.ZIP_STORED)
+
+    def write(self, data: bytes) -> int:
+        """واجهة الملف التي يكتب عليها zipfile"""
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        """واجهة الملف التي يستدعيها zipfile"""
+
+    def add_file(self, path: str, arcname: str) -> bytes:
+        """إضافة ملف من القرص وإرجاع البايتات الجاهزة للإرسال"""
+        self._zip.write(path, arcname)
+        return self._drain()
+
+    def add_bytes(self, arcname: str, data: bytes) -> bytes:
+        """إضافة محتوى من الذاكرة وإرجاع البايتات الجاهزة للإرسال"""
+        self._zip.writestr(arcname, data)
+        return self._drain()
+
+    def close(self) -> bytes:
+        """كتابة الفهرس المركزي وإرجاع آخر البايتات"""
+        self._zip.close()
+        return self._drain()
+
+    def _drain(self) -> bytes:
+        """تفريغ ما كُتب منذ آخر إرسال"""
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
@@ -4,22 +4,46 @@
 
 import os
 import uuid
+import asyncio
+import hashlib
+import zipfile
 import aiofiles
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional
-from PIL import Image
+from typing import AsyncIterator, List, Optional, Tuple, Union
 from fastapi import UploadFile
 from loguru import logger
 
 from core.config import settings, get_file_config
+from core.image_context import ImageContext
+from .file_response import stat_regular_file
+from .storage_index import StorageIndex
+
+
+class UploadTooLargeError(ValueError):
+    """الملف المرفوع أكبر من الحد المسموح"""
+
+
+# امتدادات الصور المقبولة داخل أرشيفات الطلبات الدفعية
+ARCHIVE_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+@dataclass
+class SavedUpload:
+    """ملف مرفوع محفوظ على القرص"""
+    path: str
+    content_hash: str
+    size: int
 
 
 class FileHandler:
     """معالج الملفات"""
     
-    def __init__(self):
+    def __init__(self, storage: Optional[StorageIndex] = None):
         self.config = get_file_config()
         self._ensure_directories()
+        # فهرس الملفات المُدارة - يُحدَّث مع كل كتابة وحذف بدلاً من مسح المجلدات
+        self.storage = storage or StorageIndex()
         logger.info("📁 تم تهيئة معالج الملفات")
     
     def _ensure_directories(self):
@@ -34,54 +58,126 @@ class FileHandler:
             Path(directory).mkdir(parents=True, exist_ok=True)
             logger.debug(f"📂 تم التأكد من وجود المجلد: {directory}")
     
-    async def save_upload(self, file: UploadFile) -> str:
-        """حفظ الملف المرفوع"""
+    async def save_upload(self, file: UploadFile, max_size: Optional[int] = None) -> SavedUpload:
+        """حفظ الملف المرفوع على دفعات مع حساب البصمة والحجم أثناء الكتابة
+
+        حد الطلب كاملاً يفرضه UploadLimitMiddleware أثناء الاستلام، وهنا حد كل ملف على حدة.
+        """
+        max_file_size = max_size or self.config["max_file_size"]
+        chunk_size = self.config["upload_chunk_size"]
+        file_path = None
+        
         try:
-            # التحقق من حجم الملف
-            if file.size and file.size > self.config["max_file_size"]:
-                raise ValueError(f"حجم الملف كبير جداً: {file.size} bytes")
+            # حجم الملف معروف بعد تحليل multipart
+            if file.size and file.size > max_file_size:
+                raise UploadTooLargeError(f"حجم الملف كبير جداً: {file.size} bytes")
             
             # إنشاء اسم ملف فريد
             file_extension = self._get_file_extension(file.filename)
             unique_filename = f"{uuid.uuid4()}{file_extension}"
             file_path = Path(self.config["upload_dir"]) / unique_filename
             
-            # حفظ الملف
+            # حفظ الملف دفعةً دفعة دون تحميله كاملاً في الذاكرة
+            digest = hashlib.sha256()
+            size = 0
             async with aiofiles.open(file_path, 'wb') as f:
-                content = await file.read()
-                await f.write(content)
+                while chunk := await file.read(chunk_size):
+                    size += len(chunk)
+                    if size > max_file_size:
+                        raise UploadTooLargeError(f"حجم الملف كبير جداً: أكثر من {max_file_size} bytes")
+                    digest.update(chunk)
+                    await f.write(chunk)
+            
+            # الملف محمي من المنظف حتى تنتهي مهمته
+            self.storage.add(str(file_path), size=size, pinned=True)
             
-            logger.info(f"📥 تم حفظ الملف: {file_path}")
-            return str(file_path)
+            logger.info(f"📥 تم حفظ الملف: {file_path} ({size} bytes)")
+            return SavedUpload(path=str(file_path), content_hash=digest.hexdigest(), size=size)
             
         except Exception as e:
             logger.error(f"❌ فشل في حفظ الملف: {e}")
+            if file_path and file_path.exists():
+                file_path.unlink()
             raise
     
-    async def validate_image(self, file_path: str) -> bool:
-        """التحقق من صحة الصورة"""
+    def list_archive(self, archive_path: str) -> List[str]:
+        """أسماء الصور داخل أرشيف zip - يرفع zipfile.BadZipFile إذا لم يكن أرشيفاً صالحاً"""
+        with zipfile.ZipFile(archive_path) as archive:
+            return [info.filename for info in archive.infolist() if self._is_archive_image(info)]
+    
+    async def extract_archive(self, archive_path: str) -> AsyncIterator[Tuple[str, Union[SavedUpload, Exception]]]:
+        """استخراج صور الأرشيف واحدة تلو الأخرى عند طلبها - الصورة التالية لا تُستخرج قبل الحاجة إليها"""
+        archive = await asyncio.to_thread(zipfile.ZipFile, archive_path)
         try:
-            with Image.open(file_path) as img:
-                # التحقق من صيغة الصورة
-                if img.format not in self.config["supported_formats"]:
-                    logger.warning(f"صيغة غير مدعومة: {img.format}")
-                    return False
-                
-                # التحقق من حجم الصورة
-                width, height = img.size
-                max_size = self.config["max_image_size"]
-                
-                if width > max_size or height > max_size:
-                    logger.warning(f"حجم الصورة كبير: {width}x{height}")
-                    # لا نرفض الصورة، بل سنقوم بتصغيرها في المعالج
-                
-                # التحقق من أن الصورة ليست فارغة
-                if width < 10 or height < 10:
-                    logger.warning(f"حجم الصورة صغير جداً: {width}x{height}")
-                    return False
-                
-                logger.info(f"✅ صورة صحيحة: {width}x{height}, {img.format}")
-                return True
+            for info in archive.infolist():
+                if not self._is_archive_image(info):
+                    continue
+                try:
+                    yield info.filename, await asyncio.to_thread(self._extract_member, archive, info)
+                except Exception as e:
+                    logger.warning(f"تعذر استخراج {info.filename}: {e}")
+                    yield info.filename, e
+        finally:
+            archive.close()
+    
+    @staticmethod
+    def _is_archive_image(info: zipfile.ZipInfo) -> bool:
+        """هل عنصر الأرشيف صورة (وليس مجلداً أو ملفاً مخفياً أو بيانات macOS)"""
+        name = info.filename
+        return (not info.is_dir()
+                and not name.startswith("__MACOSX/")
+                and not os.path.basename(name).startswith(".")
+                and Path(name).suffix.lower() in ARCHIVE_IMAGE_EXTENSIONS)
+    
+    def _extract_member(self, archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> SavedUpload:
+        """نسخ عنصر من الأرشيف إلى مجلد الرفع باسم جديد - الحجم يُتحقق منه أثناء القراءة لا من الترويسة فقط"""
+        max_file_size = self.config["max_file_size"]
+        if info.file_size > max_file_size:
+            raise UploadTooLargeError(f"حجم الملف كبير جداً: {info.file_size} bytes")
+        
+        file_path = Path(self.config["upload_dir"]) / f"{uuid.uuid4()}{self._get_file_extension(info.filename)}"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with archive.open(info) as source, open(file_path, "wb") as target:
+                while chunk := source.read(self.config["upload_chunk_size"]):
+                    size += len(chunk)
+                    if size > max_file_size:
+                        raise UploadTooLargeError(f"حجم الملف كبير جداً: أكثر من {max_file_size} bytes")
+                    digest.update(chunk)
+                    target.write(chunk)
+        except Exception:
+            file_path.unlink(missing_ok=True)
+            raise
+        
+        self.storage.add(str(file_path), size=size, pinned=True)
+        return SavedUpload(path=str(file_path), content_hash=digest.hexdigest(), size=size)
+    
+    async def validate_image(self, image: Union[str, ImageContext]) -> bool:
+        """التحقق من صحة الصورة من الترويسة فقط دون فك ترميزها"""
+        try:
+            context = image if isinstance(image, ImageContext) else ImageContext(image)
+            
+            # التحقق من صيغة الصورة
+            if context.format not in self.config["supported_formats"]:
+                logger.warning(f"صيغة غير مدعومة: {context.format}")
+                return False
+            
+            # التحقق من حجم الصورة
+            width, height = context.size
+            max_size = self.config["max_image_size"]
+            
+            if width > max_size or height > max_size:
+                logger.warning(f"حجم الصورة كبير: {width}x{height}")
+                # لا نرفض الصورة، بل سنقوم بمعالجتها في المعالج
+            
+            # التحقق من أن الصورة ليست فارغة
+            if width < 10 or height < 10:
+                logger.warning(f"حجم الصورة صغير جداً: {width}x{height}")
+                return False
+            
+            logger.info(f"✅ صورة صحيحة: {width}x{height}, {context.format}")
+            return True
                 
         except Exception as e:
             logger.error(f"❌ خطأ في التحقق من الصورة: {e}")
@@ -94,40 +190,29 @@ class FileHandler:
                 if os.path.exists(file_path):
                     os.remove(file_path)
                     logger.debug(f"🗑️ تم حذف الملف المؤقت: {file_path}")
+                self.storage.remove(file_path)
             except Exception as e:
                 logger.warning(f"تعذر حذف الملف {file_path}: {e}")
     
-    async def cleanup_old_files(self, max_age_hours: int = 24):
-        """تنظيف الملفات القديمة"""
-        import time
-        current_time = time.time()
-        max_age_seconds = max_age_hours * 3600
-        
-        directories = [
-            self.config["upload_dir"],
-            self.config["temp_dir"]
-        ]
-        
-        cleaned_count = 0
-        
-        for directory in directories:
-            try:
-                for file_path in Path(directory).iterdir():
-                    if file_path.is_file():
-                        file_age = current_time - file_path.stat().st_mtime
-                        if file_age > max_age_seconds:
-                            file_path.unlink()
-                            cleaned_count += 1
-                            logger.debug(f"🗑️ تم حذف ملف قديم: {file_path}")
-            except Exception as e:
-                logger.warning(f"خطأ في تنظيف المجلد {directory}: {e}")
+    def track_file(self, file_path: str, size: Optional[int] = None):
+        """تسجيل ملف كتبه مكون آخر (مثل نتائج المعالج) في فهرس التخزين"""
+        self.storage.add(file_path, size=size)
+    
+    async def cleanup_old_files(self, max_age_hours: Optional[float] = None) -> int:
+        """تنظيف الملفات القديمة وما يتجاوز حجم كل مجلد - من الفهرس دون مسح المجلدات"""
+        max_age_seconds = None if max_age_hours is None else max_age_hours * 3600
+        removed = await asyncio.to_thread(self.storage.evict, max_age_seconds=max_age_seconds)
         
-        if cleaned_count > 0:
-            logger.info(f"🧹 تم تنظيف {cleaned_count} ملف قديم")
+        if removed:
+            logger.info(f"🧹 تم تنظيف {len(removed)} ملف قديم")
+        return len(removed)
     
-    def get_file_info(self, file_path: str) -> Optional[dict]:
+    def get_file_info(self, image: Union[str, ImageContext]) -> Optional[dict]:
         """الحصول على معلومات الملف"""
         try:
+            context = image if isinstance(image, ImageContext) else ImageContext(image)
+            file_path = context.path
+            
             if not os.path.exists(file_path):
                 return None
             
@@ -141,17 +226,10 @@ class FileHandler:
                 "modified": stat.st_mtime
             }
             
-            # معلومات الصورة إذا كانت صورة
+            # معلومات الصورة إذا كانت صورة (من الترويسة أو من السياق المفكوك)
             try:
-                with Image.open(file_path) as img:
-                    info.update({
-                        "format": img.format,
-                        "mode": img.mode,
-                        "size": img.size,
-                        "width": img.width,
-                        "height": img.height
-                    })
-            except:
+                info.update(context.info())
+            except Exception:
                 pass  # ليس ملف صورة
             
             return info
@@ -171,11 +249,27 @@ class FileHandler:
         extension_map = {
             ".jpeg": ".jpg",
             ".png": ".png",
-            ".webp": ".webp"
+            ".webp": ".webp",
+            ".zip": ".zip"
         }
         
         return extension_map.get(extension, ".jpg")
     
+    def resolve_download(self, filename: str) -> Optional[tuple]:
+        """مسار ملف نتيجة للتحميل و stat الخاص به - يرفض أي مسار خارج مجلد النتائج"""
+        result_dir = Path(self.config["result_dir"]).resolve()
+        path = (result_dir / filename).resolve()
+        
+        if path.parent != result_dir:
+            logger.warning(f"⚠️ محاولة تحميل خارج مجلد النتائج: {filename}")
+            return None
+        
+        stat_result = stat_regular_file(str(path))
+        if stat_result is None:
+            return None
+        
+        return str(path), stat_result
+    
     async def create_download_url(self, file_path: str, base_url: str = "") -> str:
         """إنشاء رابط تحميل"""
         try:
@@ -186,32 +280,9 @@ class FileHandler:
             return ""
     
     def get_storage_stats(self) -> dict:
-        """إحصائيات التخزين"""
+        """إحصائيات التخزين من المجاميع الجارية في الفهرس - دون قراءة المجلدات"""
         try:
-            stats = {}
-            
-            directories = {
-                "uploads": self.config["upload_dir"],
-                "results": self.config["result_dir"],
-                "temp": self.config["temp_dir"]
-            }
-            
-            for name, directory in directories.items():
-                path = Path(directory)
-                if path.exists():
-                    files = list(path.iterdir())
-                    total_size = sum(f.stat().st_size for f in files if f.is_file())
-                    
-                    stats[name] = {
-                        "file_count": len([f for f in files if f.is_file()]),
-                        "total_size": total_size,
-                        "total_size_mb": round(total_size / (1024 * 1024), 2)
-                    }
-                else:
-                    stats[name] = {"file_count": 0, "total_size": 0, "total_size_mb": 0}
-            
-            return stats
-            
+            return self.storage.get_stats()
         except Exception as e:
             logger.error(f"خطأ في حساب إحصائيات التخزين: {e}")
             return {}
@@ -0,0 +1,221 @@
+"""
+استجابة تحميل الملفات - sendfile بدون نسخ، ETag، طلبات شرطية وطلبات نطاق (Range)
+"""
+
+import os
+import stat
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+
+CHUNK_SIZE = 256 * 1024
+
+
+class FileTruncatedError(OSError):
+    """الملف أقصر من الحجم المعلن في Content-Length أثناء إرساله"""
+
+
+def make_etag(stat_result: os.stat_result) -> str:
+    """ETag قوي - ملفات النتائج لا تُعدل بعد كتابتها، فالهوية والحجم ووقت التعديل تكفي"""
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """تحليل ترويسة Range لنطاق واحد - يرجع (البداية، النهاية) شاملة أو None للتجاهل
+
+    يرفع ValueError إذا كان النطاق غير قابل للتلبية.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        # وحدات غير معروفة أو نطاقات متعددة: نرسل الملف كاملاً
+        return None
+
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if not start_text:
+            # bytes=-N : آخر N بايت
+            suffix = int(end_text)
+            if suffix <= 0:
+                raise ValueError("نطاق فارغ")
+            return max(0, size - suffix), size - 1
+
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        if not start_text and not end_text:
+            return None
+        raise
+
+    if start >= size or start > end:
+        raise ValueError("نطاق خارج حدود الملف")
+    return start, min(end, size - 1)
+
+
+class SendfileResponse(Response):
+    """يرسل ملفاً عبر X-Accel-Redirect أو امتدادات pathsend/zerocopysend للخادم، أو على دفعات كحل أخير"""
+
+    def __init__(
+        self,
+        path: str,
+        stat_result: os.stat_result,
+        cache_control: str = "public, max-age=86400, immutable",
+        accel_redirect: Optional[str] = None
+    ):
+        self.path = path
+        self.stat_result = stat_result
+        self.accel_redirect = accel_redirect
+        self.status_code = 200
+        self.background = None
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.init_headers({
+            "accept-ranges": "bytes",
+            "cache-control": cache_control,
+            "etag": make_etag(stat_result),
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True)
+        })
+
+    def _not_modified(self, request_headers: Headers) -> bool:
+        """هل يملك العميل النسخة الحالية (If-None-Match / If-Modified-Since)"""
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            etag = self.headers["etag"]
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(self.stat_result.st_mtime) <= since
+
+        return False
+
+    def _requested_range(self, request_headers: Headers) -> Optional[Tuple[int, int]]:
+        """النطاق المطلوب مع احترام If-Range"""
+        range_header = request_headers.get("range")
+        if not range_header:
+            return None
+
+        if_range = request_headers.get("if-range")
+        if if_range and if_range.strip() not in (self.headers["etag"], self.headers["last-modified"]):
+            return None
+
+        return parse_range(range_header, self.stat_result.st_size)
+
+    def _refresh(self, stat_result: os.stat_result):
+        """اعتماد stat الملف المفتوح - قد يكون استُبدل بعد stat في الـ endpoint"""
+        self.stat_result = stat_result
+        self.headers["etag"] = make_etag(stat_result)
+        self.headers["last-modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+
+    async def _send_empty(self, send: Send, status: int):
+        """استجابة بلا جسم"""
+        await send({"type": "http.response.start", "status": status, "headers": self.raw_headers})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.accel_redirect:
+            await self._send_accel(scope, send)
+            return
+
+        try:
+            f = await anyio.open_file(self.path, "rb")
+        except FileNotFoundError:
+            # حُذف بين stat والفتح (المنظف)
+            self.headers["content-length"] = "0"
+            await self._send_empty(send, 404)
+            return
+
+        async with f:
+            self._refresh(os.fstat(f.wrapped.fileno()))
+            await self._send_file(scope, send, f)
+
+    async def _send_accel(self, scope: Scope, send: Send):
+        """الوكيل العكسي (nginx) يتولى sendfile والنطاقات بنفسه"""
+        if self._not_modified(Headers(scope=scope)):
+            self.status_code = 304
+            del self.headers["content-type"]
+            await self._send_empty(send, 304)
+            return
+
+        self.headers["x-accel-redirect"] = self.accel_redirect
+        await self._send_empty(send, 200)
+
+    async def _send_file(self, scope: Scope, send: Send, f):
+        """إرسال الملف المفتوح كاملاً أو النطاق المطلوب منه"""
+        request_headers = Headers(scope=scope)
+        send_body = scope["method"].upper() != "HEAD"
+        size = self.stat_result.st_size
+
+        if self._not_modified(request_headers):
+            self.status_code = 304
+            del self.headers["content-type"]
+            await self._send_empty(send, 304)
+            return
+
+        try:
+            byte_range = self._requested_range(request_headers)
+        except ValueError:
+            self.headers["content-range"] = f"bytes */{size}"
+            self.headers["content-length"] = "0"
+            await self._send_empty(send, 416)
+            return
+
+        if byte_range is None:
+            start, end = 0, size - 1
+            self.status_code = 200
+        else:
+            start, end = byte_range
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+        count = max(0, end - start + 1)
+        self.headers["content-length"] = str(count)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+        if not send_body or count == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if self.status_code == 200 and "http.response.pathsend" in extensions:
+            # الخادم يرسل الملف كاملاً من مساره دون المرور بذاكرة بايثون
+            await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+            return
+
+        if "http.response.zerocopysend" in extensions:
+            # الخادم يستدعي sendfile مباشرة من واصف الملف إلى المقبس
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": f.wrapped.fileno(),
+                "offset": start,
+                "count": count
+            })
+            return
+
+        # احتياطي للخوادم التي لا تدعم أي امتداد للإرسال المباشر (uvicorn) - النشر المعتاد خلف nginx
+        await f.seek(start)
+        remaining = count
+        while remaining > 0:
+            chunk = await f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                # Content-Length أُرسل: جسم أقصر منه استجابة تالفة، فالاتصال يُقطع بدلاً من إنهائها
+                raise FileTruncatedError(f"انتهى الملف قبل إرسال {remaining} bytes: {self.path}")
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+
+
+def stat_regular_file(path: str) -> Optional[os.stat_result]:
+    """stat للملفات العادية فقط"""
+    try:
+        stat_result = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return stat_result if stat.S_ISREG(stat_result.st_mode) else None
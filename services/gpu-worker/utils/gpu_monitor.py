@@ -7,29 +7,55 @@ import torch
 from typing import Dict, Optional
 from loguru import logger
 
-try:
-    import GPUtil
-    GPUTIL_AVAILABLE = True
-except ImportError:
-    GPUTIL_AVAILABLE = False
-    logger.warning("GPUtil غير متوفر - سيتم استخدام PyTorch فقط لمراقبة GPU")
+from .telemetry import TelemetrySampler, TelemetrySample
+
+
+def free_memory(device: str) -> Dict:
+    """الذاكرة الحرة بالبايت على جهاز معين وفي ذاكرة النظام"""
+    host_available = psutil.virtual_memory().available
+    
+    if not torch.cuda.is_available() or not device.startswith("cuda"):
+        return {"gpu_free": 0, "gpu_total": 0, "host_available": host_available}
+    
+    gpu_free, gpu_total = torch.cuda.mem_get_info(torch.device(device))
+    return {"gpu_free": gpu_free, "gpu_total": gpu_total, "host_available": host_available}
 
 
 class GPUMonitor:
-    """مراقب GPU والنظام"""
+    """مراقب GPU والنظام - يقرأ آخر عينة من جامع القياسات دون تشغيل عمليات لكل طلب"""
     
-    def __init__(self):
+    def __init__(self, telemetry: Optional[TelemetrySampler] = None):
         self.cuda_available = torch.cuda.is_available()
         self.device_count = torch.cuda.device_count() if self.cuda_available else 0
+        self.telemetry = telemetry or TelemetrySampler()
         
+        # خصائص الأجهزة ثابتة - تُقرأ مرة واحدة
+        self.device_properties = {}
         if self.cuda_available:
             logger.info(f"🎮 تم العثور على {self.device_count} GPU")
             for i in range(self.device_count):
-                gpu_name = torch.cuda.get_device_name(i)
-                logger.info(f"  GPU {i}: {gpu_name}")
+                props = torch.cuda.get_device_properties(i)
+                self.device_properties[i] = props
+                logger.info(f"  GPU {i}: {props.name}")
         else:
             logger.warning("⚠️ CUDA غير متوفر")
     
+    def start(self):
+        """تشغيل جامع القياسات في الخلفية"""
+        self.telemetry.start()
+    
+    def stop(self):
+        """إيقاف جامع القياسات"""
+        self.telemetry.stop()
+    
+    def _device_sample(self, device: int) -> Dict:
+        """قياسات جهاز واحد (برقمه في PyTorch) من آخر عينة"""
+        return next((gpu for gpu in self.telemetry.latest.gpus if gpu["index"] == device), {})
+    
+    def get_averages(self) -> Dict:
+        """المتوسطات المتحركة لاستخدام GPU والذاكرة"""
+        return self.telemetry.averages()
+    
     def get_gpu_status(self) -> Dict:
         """حالة GPU الأساسية"""
         if not self.cuda_available:
@@ -46,21 +72,14 @@ class GPUMonitor:
             device = torch.cuda.current_device()
             memory_allocated = torch.cuda.memory_allocated(device)
             memory_reserved = torch.cuda.memory_reserved(device)
-            memory_total = torch.cuda.get_device_properties(device).total_memory
+            memory_total = self.device_properties[device].total_memory
             
             # تحويل إلى GB
             memory_used_gb = memory_reserved / (1024**3)
             memory_total_gb = memory_total / (1024**3)
             
-            # محاولة الحصول على معلومات الاستخدام
-            utilization = 0.0
-            if GPUTIL_AVAILABLE:
-                try:
-                    gpus = GPUtil.getGPUs()
-                    if gpus and len(gpus) > device:
-                        utilization = gpus[device].load * 100
-                except:
-                    pass
+            # الاستخدام من آخر عينة
+            utilization = self._device_sample(device).get("utilization", 0.0)
             
             return {
                 "available": True,
@@ -91,7 +110,7 @@ class GPUMonitor:
             
             # معلومات إضافية من PyTorch
             device = torch.cuda.current_device()
-            props = torch.cuda.get_device_properties(device)
+            props = self.device_properties[device]
             
             detailed.update({
                 "device_name": props.name,
@@ -103,20 +122,14 @@ class GPUMonitor:
                 )
             })
             
-            # معلومات إضافية من GPUtil إذا كان متوفراً
-            if GPUTIL_AVAILABLE:
-                try:
-                    gpus = GPUtil.getGPUs()
-                    if gpus and len(gpus) > device:
-                        gpu = gpus[device]
-                        detailed.update({
-                            "temperature": gpu.temperature,
-                            "power_draw": getattr(gpu, 'powerDraw', None),
-                            "power_limit": getattr(gpu, 'powerLimit', None),
-                            "driver_version": getattr(gpu, 'driver', None)
-                        })
-                except Exception as e:
-                    logger.debug(f"تعذر الحصول على معلومات GPUtil: {e}")
+            # الحرارة والطاقة من آخر عينة، مع كل الأجهزة للمجمع متعدد GPU
+            sample = self._device_sample(device)
+            detailed.update({
+                "temperature": sample.get("temperature"),
+                "power_draw": sample.get("power_draw"),
+                "telemetry_source": self.telemetry.source,
+                "gpus": self.telemetry.latest.gpus
+            })
             
             return detailed
             
@@ -127,56 +140,42 @@ class GPUMonitor:
     def get_memory_usage(self) -> Dict:
         """استخدام ذاكرة النظام"""
         try:
-            memory = psutil.virtual_memory()
+            sample: TelemetrySample = self.telemetry.latest
             
             return {
-                "total": round(memory.total / (1024**3), 2),
-                "used": round(memory.used / (1024**3), 2),
-                "available": round(memory.available / (1024**3), 2),
-                "percent": memory.percent
+                "total": sample.memory_total_gb,
+                "used": sample.memory_used_gb,
+                "available": sample.memory_available_gb,
+                "percent": sample.memory_percent
             }
             
         except Exception as e:
             logger.error(f"خطأ في الحصول على استخدام الذاكرة: {e}")
             return {"error": str(e)}
     
+    def get_free_memory(self, device: str) -> Dict:
+        """الذاكرة الحرة بالبايت على جهاز معين وفي ذاكرة النظام - لتخطيط التنفيذ"""
+        return free_memory(device)
+    
     def get_gpu_utilization(self) -> float:
         """نسبة استخدام GPU"""
-        if not GPUTIL_AVAILABLE or not self.cuda_available:
+        if not self.cuda_available:
             return 0.0
         
-        try:
-            gpus = GPUtil.getGPUs()
-            if gpus:
-                device = torch.cuda.current_device()
-                if len(gpus) > device:
-                    return round(gpus[device].load * 100, 1)
-        except Exception as e:
-            logger.debug(f"تعذر الحصول على استخدام GPU: {e}")
-        
-        return 0.0
+        return round(self._device_sample(torch.cuda.current_device()).get("utilization", 0.0), 1)
     
     def get_gpu_temperature(self) -> Optional[float]:
         """درجة حرارة GPU"""
-        if not GPUTIL_AVAILABLE or not self.cuda_available:
+        if not self.cuda_available:
             return None
         
-        try:
-            gpus = GPUtil.getGPUs()
-            if gpus:
-                device = torch.cuda.current_device()
-                if len(gpus) > device:
-                    return gpus[device].temperature
-        except Exception as e:
-            logger.debug(f"تعذر الحصول على درجة حرارة GPU: {e}")
-        
-        return None
+        return self._device_sample(torch.cuda.current_device()).get("temperature")
     
     def get_system_stats(self) -> Dict:
         """إحصائيات النظام الشاملة"""
         try:
-            # معلومات CPU
-            cpu_percent = psutil.cpu_percent(interval=1)
+            # معلومات CPU (من آخر عينة بدلاً من الانتظار ثانية كاملة)
+            cpu_percent = self.telemetry.latest.cpu_percent
             cpu_count = psutil.cpu_count()
             
             # معلومات الذاكرة
@@ -200,7 +199,8 @@ class GPUMonitor:
                     "free_gb": round(disk.free / (1024**3), 2),
                     "usage_percent": round((disk.used / disk.total) * 100, 1)
                 },
-                "gpu": gpu_status
+                "gpu": gpu_status,
+                "averages": self.get_averages()
             }
             
         except Exception as e:
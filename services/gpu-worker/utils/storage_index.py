@@ -0,0 +1,308 @@
+"""
+فهرس التخزين ومنظفه - فهرس في الذاكرة مرتب بوقت التعديل للمجلدات المُدارة وحذف حسب العمر وحجم كل مجلد
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+from loguru import logger
+
+from core.config import get_storage_config
+from core.monitoring import set_storage_usage, record_storage_drift
+
+
+@dataclass
+class ManagedDirectory:
+    """مجلد مُدار: ملفاته وحدوده"""
+    name: str
+    path: str
+    max_age_seconds: float
+    max_bytes: int
+    # اسم الملف -> (وقت التعديل، الحجم)
+    entries: Dict[str, Tuple[float, int]] = field(default_factory=dict)
+    # (وقت التعديل، اسم الملف) - الإدخالات القديمة تُتجاهل عند إخراجها
+    heap: List[Tuple[float, str]] = field(default_factory=list)
+    # ملفات قيد الاستخدام (مدخلات مهام لم تنته بعد) لا تُحذف
+    pinned: Set[str] = field(default_factory=set)
+    total_bytes: int = 0
+
+
+class StorageIndex:
+    """فهرس الملفات المُدارة: يُبنى من القرص مرة واحدة ثم يُحدَّث مع كل كتابة وحذف"""
+
+    def __init__(self, config: Optional[dict] = None):
+        self.config = config or get_storage_config()
+        self.directories: Dict[str, ManagedDirectory] = {}
+        self._by_path: Dict[str, ManagedDirectory] = {}
+        self._lock = threading.Lock()
+
+        for name, directory in self.config["directories"].items():
+            managed = ManagedDirectory(
+                name=name,
+                path=os.path.abspath(directory["path"]),
+                max_age_seconds=directory["max_age_seconds"],
+                max_bytes=directory["max_bytes"]
+            )
+            self.directories[name] = managed
+            self._by_path[managed.path] = managed
+
+        self.evicted_total = 0
+        self.last_eviction: Optional[dict] = None
+        self.last_reconcile: Optional[dict] = None
+
+    def _locate(self, path: str) -> Tuple[Optional[ManagedDirectory], str]:
+        """المجلد المُدار الذي يحتوي الملف مباشرة"""
+        path = os.path.abspath(path)
+        return self._by_path.get(os.path.dirname(path)), os.path.basename(path)
+
+    @staticmethod
+    def _read_disk(directory: ManagedDirectory) -> Dict[str, Tuple[float, int]]:
+        """قراءة ملفات المجلد من القرص"""
+        entries = {}
+        try:
+            with os.scandir(directory.path) as it:
+                for entry in it:
+                    if entry.is_file(follow_symlinks=False):
+                        stat_result = entry.stat(follow_symlinks=False)
+                        entries[entry.name] = (stat_result.st_mtime, stat_result.st_size)
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def scan(self) -> Dict[str, dict]:
+        """بناء الفهرس من القرص (عند الإقلاع) أو مطابقته معه دورياً - يرجع الفرق لكل مجلد"""
+        drift = {}
+        for directory in self.directories.values():
+            scan_started = time.time()
+            entries = self._read_disk(directory)
+
+            with self._lock:
+                # الملفات المسجلة أثناء المسح قد لا تظهر فيه
+                for name, entry in directory.entries.items():
+                    if name not in entries and entry[0] >= scan_started:
+                        entries[name] = entry
+
+                missing = directory.entries.keys() - entries.keys()
+                untracked = entries.keys() - directory.entries.keys()
+                total_bytes = sum(size for _, size in entries.values())
+                drift[directory.name] = {
+                    "missing": len(missing),
+                    "untracked": len(untracked),
+                    "bytes": total_bytes - directory.total_bytes
+                }
+
+                directory.entries = entries
+                directory.pinned &= entries.keys()
+                directory.heap = [(mtime, name) for name, (mtime, _) in entries.items()]
+                heapq.heapify(directory.heap)
+                directory.total_bytes = total_bytes
+                self._publish(directory)
+
+        return drift
+
+    def reconcile(self) -> Dict[str, dict]:
+        """مطابقة المجموع الجاري مع القرص وتسجيل أي فرق"""
+        drift = self.scan()
+        for name, diff in drift.items():
+            files = diff["missing"] + diff["untracked"]
+            if files or diff["bytes"]:
+                record_storage_drift(name, files)
+                logger.warning(
+                    f"⚠️ فهرس {name} لم يطابق القرص: {diff['missing']} مفقود، "
+                    f"{diff['untracked']} غير مسجل، فرق {diff['bytes']} bytes - تم التصحيح"
+                )
+        self.last_reconcile = {"at": time.time(), "drift": drift}
+        return drift
+
+    @staticmethod
+    def _publish(directory: ManagedDirectory):
+        """تحديث مقاييس Prometheus للمجلد"""
+        set_storage_usage(directory.name, len(directory.entries), directory.total_bytes)
+
+    def add(self, path: str, size: Optional[int] = None, mtime: Optional[float] = None, pinned: bool = False):
+        """تسجيل ملف مكتوب أو مستبدل"""
+        directory, name = self._locate(path)
+        if directory is None:
+            return
+
+        if size is None:
+            size = os.stat(path).st_size
+        mtime = time.time() if mtime is None else mtime
+
+        with self._lock:
+            previous = directory.entries.get(name)
+            if previous:
+                directory.total_bytes -= previous[1]
+            directory.entries[name] = (mtime, size)
+            directory.total_bytes += size
+            heapq.heappush(directory.heap, (mtime, name))
+            if pinned:
+                directory.pinned.add(name)
+            self._compact(directory)
+            self._publish(directory)
+
+    def remove(self, path: str):
+        """إزالة ملف محذوف من الفهرس"""
+        directory, name = self._locate(path)
+        if directory is None:
+            return
+
+        with self._lock:
+            self._forget(directory, name)
+            self._publish(directory)
+
+    def pin(self, path: str):
+        """حماية ملف مسجل من المنظف ما دام قيد الاستخدام"""
+        directory, name = self._locate(path)
+        if directory is not None:
+            with self._lock:
+                if name in directory.entries:
+                    directory.pinned.add(name)
+
+    def unpin(self, path: str):
+        """السماح بحذف ملف لم يعد قيد الاستخدام"""
+        directory, name = self._locate(path)
+        if directory is not None:
+            with self._lock:
+                directory.pinned.discard(name)
+
+    def _forget(self, directory: ManagedDirectory, name: str):
+        """حذف الإدخال وتحديث المجموع - إدخال الكومة يُتجاهل لاحقاً"""
+        previous = directory.entries.pop(name, None)
+        if previous:
+            directory.total_bytes -= previous[1]
+        directory.pinned.discard(name)
+
+    @staticmethod
+    def _compact(directory: ManagedDirectory):
+        """إعادة بناء الكومة إذا تراكمت فيها إدخالات قديمة"""
+        if len(directory.heap) > 2 * len(directory.entries) + 64:
+            directory.heap = [(mtime, name) for name, (mtime, _) in directory.entries.items()]
+            heapq.heapify(directory.heap)
+
+    def _select_victims(self, directory: ManagedDirectory, now: float, max_age: float) -> List[str]:
+        """أقدم الملفات التي تجاوزت العمر أو تجعل المجلد فوق حده - الكلفة بعدد المحذوف"""
+        victims = []
+        held = []
+        cutoff = now - max_age if max_age > 0 else None
+
+        while directory.heap:
+            mtime, name = directory.heap[0]
+            current = directory.entries.get(name)
+            if current is None or current[0] != mtime:
+                heapq.heappop(directory.heap)
+                continue
+
+            too_old = cutoff is not None and mtime < cutoff
+            over_budget = directory.max_bytes > 0 and directory.total_bytes > directory.max_bytes
+            if not (too_old or over_budget):
+                break
+
+            heapq.heappop(directory.heap)
+            if name in directory.pinned:
+                held.append((mtime, name))
+                continue
+
+            victims.append(os.path.join(directory.path, name))
+            self._forget(directory, name)
+
+        for item in held:
+            heapq.heappush(directory.heap, item)
+        return victims
+
+    def evict(self, now: Optional[float] = None, max_age_seconds: Optional[float] = None) -> List[str]:
+        """حذف الملفات المنتهية من كل المجلدات - يُستدعى خارج حلقة الأحداث"""
+        now = time.time() if now is None else now
+        start = time.perf_counter()
+        removed = []
+
+        for directory in self.directories.values():
+            max_age = directory.max_age_seconds if max_age_seconds is None else max_age_seconds
+            with self._lock:
+                victims = self._select_victims(directory, now, max_age)
+                self._publish(directory)
+
+            for path in victims:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"تعذر حذف الملف {path}: {e}")
+                    continue
+                removed.append(path)
+
+        self.evicted_total += len(removed)
+        self.last_eviction = {
+            "at": now,
+            "removed": len(removed),
+            "duration": round(time.perf_counter() - start, 4)
+        }
+        return removed
+
+    def get_stats(self) -> Dict[str, dict]:
+        """عدد الملفات وحجمها لكل مجلد من الفهرس"""
+        with self._lock:
+            return {
+                name: {
+                    "path": directory.path,
+                    "file_count": len(directory.entries),
+                    "total_size": directory.total_bytes,
+                    "total_size_mb": round(directory.total_bytes / (1024 * 1024), 2),
+                    "max_bytes": directory.max_bytes,
+                    "pinned": len(directory.pinned)
+                }
+                for name, directory in self.directories.items()
+            }
+
+
+class StorageJanitor:
+    """مهمة خلفية تنظف المجلدات المُدارة كل CLEANUP_INTERVAL"""
+
+    def __init__(self, index: StorageIndex, interval: Optional[float] = None, reconcile_interval: Optional[float] = None):
+        self.index = index
+        self.interval = index.config["cleanup_interval"] if interval is None else interval
+        self.reconcile_interval = (index.config.get("reconcile_interval", 0)
+                                   if reconcile_interval is None else reconcile_interval)
+        self._task: Optional[asyncio.Task] = None
+        self._last_reconcile = time.monotonic()
+
+    async def start(self):
+        """بناء الفهرس من القرص ثم تشغيل الحلقة"""
+        if self._task:
+            return
+
+        await asyncio.to_thread(self.index.scan)
+        await self.run_once()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"🧹 تم تشغيل منظف التخزين كل {self.interval} ثانية")
+
+    async def stop(self):
+        """إيقاف الحلقة"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        """حلقة التنظيف مع مطابقة دورية للفهرس مع القرص"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if self.reconcile_interval and time.monotonic() - self._last_reconcile >= self.reconcile_interval:
+                    await asyncio.to_thread(self.index.reconcile)
+                    self._last_reconcile = time.monotonic()
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"❌ خطأ في منظف التخزين: {e}")
+
+    async def run_once(self) -> List[str]:
+        """جولة تنظيف واحدة خارج حلقة الأحداث"""
+        removed = await asyncio.to_thread(self.index.evict)
+        if removed:
+            logger.info(f"🧹 تم حذف {len(removed)} ملف ({self.index.last_eviction['duration']:.3f}s)")
+        return removed
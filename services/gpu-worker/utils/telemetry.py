@@ -0,0 +1,281 @@
+"""
+جامع قياسات النظام و GPU في الخلفية - القراءة من آخر عينة بدلاً من استدعاء nvidia-smi لكل طلب
+"""
+
+import time
+import threading
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import psutil
+import torch
+from loguru import logger
+
+from core.config import get_telemetry_config
+from core.monitoring import update_gpu_metrics
+
+# التهيئة (nvmlInit) تتم في TelemetrySampler.start وليس عند الاستيراد
+try:
+    import pynvml
+    NVML_AVAILABLE = True
+except ImportError:
+    NVML_AVAILABLE = False
+
+try:
+    import GPUtil
+    GPUTIL_AVAILABLE = True
+except ImportError:
+    GPUTIL_AVAILABLE = False
+
+
+GB = 1024 ** 3
+
+# القيم التي يُحسب لها متوسط متحرك
+AVERAGED_FIELDS = ("cpu_percent", "memory_percent", "gpu_utilization", "gpu_memory_percent")
+
+
+@dataclass
+class TelemetrySample:
+    """عينة واحدة من قياسات النظام و GPU"""
+    timestamp: float
+    cpu_percent: float
+    memory_percent: float
+    memory_used_gb: float
+    memory_total_gb: float
+    memory_available_gb: float
+    gpus: List[Dict] = field(default_factory=list)
+
+    @property
+    def gpu_utilization(self) -> float:
+        """متوسط استخدام كل الأجهزة"""
+        return sum(gpu["utilization"] for gpu in self.gpus) / len(self.gpus) if self.gpus else 0.0
+
+    @property
+    def gpu_memory_percent(self) -> float:
+        """نسبة ذاكرة GPU المستخدمة على كل الأجهزة"""
+        total = sum(gpu["memory_total_gb"] for gpu in self.gpus)
+        return sum(gpu["memory_used_gb"] for gpu in self.gpus) / total * 100 if total else 0.0
+
+    def to_dict(self) -> dict:
+        """تمثيل قابل للعرض"""
+        return asdict(self)
+
+
+def torch_device_uuids() -> List[str]:
+    """UUID كل جهاز بترتيب أرقام PyTorch - ترتيب NVML و nvidia-smi يختلف عنه مع CUDA_VISIBLE_DEVICES"""
+    if not torch.cuda.is_available():
+        return []
+    return [f"GPU-{torch.cuda.get_device_properties(index).uuid}" for index in range(torch.cuda.device_count())]
+
+
+def _nvml_handles(uuids: List[str]) -> List[Tuple[int, Any]]:
+    """مقابض NVML لكل جهاز مرئي لـ PyTorch مع رقمه في PyTorch"""
+    handles = []
+    for index, uuid in enumerate(uuids):
+        try:
+            handles.append((index, pynvml.nvmlDeviceGetHandleByUUID(uuid)))
+        except pynvml.NVMLError as e:
+            logger.debug(f"تعذر العثور على cuda:{index} في NVML: {e}")
+    return handles
+
+
+def _read_gpus_nvml(handles: List[Tuple[int, Any]]) -> List[Dict]:
+    """قراءة الأجهزة عبر NVML - استدعاءات مكتبة دون عمليات فرعية"""
+    gpus = []
+    for index, handle in handles:
+        memory = pynvml.nvmlDeviceGetMemoryInfo(handle)
+        utilization = pynvml.nvmlDeviceGetUtilizationRates(handle)
+
+        try:
+            temperature = pynvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU)
+        except pynvml.NVMLError:
+            temperature = None
+        try:
+            power_draw = pynvml.nvmlDeviceGetPowerUsage(handle) / 1000
+        except pynvml.NVMLError:
+            power_draw = None
+
+        gpus.append({
+            "index": index,
+            "utilization": float(utilization.gpu),
+            "memory_used_gb": round(memory.used / GB, 2),
+            "memory_total_gb": round(memory.total / GB, 2),
+            "temperature": temperature,
+            "power_draw": power_draw
+        })
+    return gpus
+
+
+def _read_gpus_gputil(uuids: List[str]) -> List[Dict]:
+    """قراءة الأجهزة عبر GPUtil (يشغّل nvidia-smi - مقبول في الخلفية فقط)"""
+    by_uuid = {gpu.uuid: gpu for gpu in GPUtil.getGPUs()}
+    return [
+        {
+            "index": index,
+            "utilization": round(gpu.load * 100, 1),
+            "memory_used_gb": round(gpu.memoryUsed / 1024, 2),
+            "memory_total_gb": round(gpu.memoryTotal / 1024, 2),
+            "temperature": gpu.temperature,
+            "power_draw": getattr(gpu, "powerDraw", None)
+        }
+        for index, gpu in ((index, by_uuid.get(uuid)) for index, uuid in enumerate(uuids))
+        if gpu is not None
+    ]
+
+
+def _read_gpus_torch() -> List[Dict]:
+    """ذاكرة الأجهزة فقط عبر PyTorch عندما لا تتوفر NVML أو GPUtil"""
+    gpus = []
+    for index in range(torch.cuda.device_count()):
+        free, total = torch.cuda.mem_get_info(index)
+        gpus.append({
+            "index": index,
+            "utilization": 0.0,
+            "memory_used_gb": round((total - free) / GB, 2),
+            "memory_total_gb": round(total / GB, 2),
+            "temperature": None,
+            "power_draw": None
+        })
+    return gpus
+
+
+class TelemetrySampler:
+    """خيط خلفي يأخذ عينة كل فترة ويحتفظ بآخر العينات في حلقة مع متوسطات متحركة"""
+
+    def __init__(self, config: Optional[dict] = None):
+        self.config = config or get_telemetry_config()
+        self.interval = self.config["interval"]
+        self.cuda_available = torch.cuda.is_available()
+        # NVML يصبح المصدر بعد تهيئته في start
+        self.source = "gputil" if GPUTIL_AVAILABLE else "torch"
+        self._uuids: List[str] = []
+        self._nvml_handles: List[Tuple[int, Any]] = []
+
+        self._samples: Deque[TelemetrySample] = deque(maxlen=max(1, self.config["history_size"]))
+        self._sums = {name: 0.0 for name in AVERAGED_FIELDS}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # القراءة الأولى لـ cpu_percent تبدأ نافذة القياس فقط
+        psutil.cpu_percent(interval=None)
+
+    def start(self):
+        """تشغيل خيط القياس"""
+        if self._thread is not None:
+            return
+
+        self._init_devices()
+        self.sample()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+        logger.info(f"📡 تم تشغيل جامع القياسات كل {self.interval} ثانية (المصدر: {self.source})")
+
+    def stop(self):
+        """إيقاف خيط القياس"""
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join(timeout=self.interval + 1)
+        self._thread = None
+        if self.source == "nvml":
+            try:
+                pynvml.nvmlShutdown()
+            except pynvml.NVMLError:
+                pass
+            self.source = "gputil" if GPUTIL_AVAILABLE else "torch"
+        logger.info("📡 تم إيقاف جامع القياسات")
+
+    def _init_devices(self):
+        """ربط أجهزة PyTorch بأجهزة NVML/GPUtil بالـ UUID وتهيئة NVML - الفشل يعني الرجوع إلى مصدر أبسط"""
+        if not self.cuda_available:
+            return
+
+        self._uuids = torch_device_uuids()
+        if not NVML_AVAILABLE:
+            return
+        try:
+            pynvml.nvmlInit()
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر تهيئة NVML، القياسات عبر {self.source}: {e}")
+            return
+
+        self._nvml_handles = _nvml_handles(self._uuids)
+        self.source = "nvml"
+
+    def _run(self):
+        """حلقة القياس"""
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.debug(f"تعذر أخذ عينة القياسات: {e}")
+
+    def _read_gpus(self) -> List[Dict]:
+        """قراءة الأجهزة من أفضل مصدر متوفر"""
+        if not self.cuda_available:
+            return []
+        try:
+            if self.source == "nvml":
+                return _read_gpus_nvml(self._nvml_handles)
+            if self.source == "gputil" and self._uuids:
+                return _read_gpus_gputil(self._uuids)
+        except Exception as e:
+            logger.debug(f"تعذر قراءة GPU عبر {self.source}: {e}")
+        return _read_gpus_torch()
+
+    def sample(self) -> TelemetrySample:
+        """أخذ عينة وإضافتها إلى الحلقة"""
+        memory = psutil.virtual_memory()
+        sample = TelemetrySample(
+            timestamp=time.time(),
+            # الاستخدام منذ العينة السابقة دون انتظار
+            cpu_percent=psutil.cpu_percent(interval=None),
+            memory_percent=memory.percent,
+            memory_used_gb=round(memory.used / GB, 2),
+            memory_total_gb=round(memory.total / GB, 2),
+            memory_available_gb=round(memory.available / GB, 2),
+            gpus=self._read_gpus()
+        )
+
+        with self._lock:
+            if len(self._samples) == self._samples.maxlen:
+                evicted = self._samples[0]
+                for name in AVERAGED_FIELDS:
+                    self._sums[name] -= getattr(evicted, name)
+            self._samples.append(sample)
+            for name in AVERAGED_FIELDS:
+                self._sums[name] += getattr(sample, name)
+
+        for gpu in sample.gpus:
+            update_gpu_metrics(f"cuda:{gpu['index']}", gpu["memory_used_gb"] * GB, gpu["utilization"])
+        return sample
+
+    @property
+    def latest(self) -> TelemetrySample:
+        """آخر عينة (تُؤخذ عينة فوراً إذا لم تبدأ الحلقة بعد)"""
+        with self._lock:
+            if self._samples:
+                return self._samples[-1]
+        return self.sample()
+
+    def averages(self) -> Dict[str, float]:
+        """المتوسطات المتحركة على كل العينات المحفوظة"""
+        with self._lock:
+            count = len(self._samples)
+            window = self._samples[-1].timestamp - self._samples[0].timestamp if count else 0.0
+            averages = {
+                f"{name}_avg": round(self._sums[name] / count, 2) if count else 0.0
+                for name in AVERAGED_FIELDS
+            }
+        return {**averages, "samples": count, "window_seconds": round(window, 1)}
+
+    def history(self, limit: Optional[int] = None) -> List[dict]:
+        """آخر العينات من الأقدم إلى الأحدث"""
+        with self._lock:
+            samples = list(self._samples)
+        if limit:
+            samples = samples[-limit:]
+        return [sample.to_dict() for sample in samples]
@@ -0,0 +1,58 @@
+"""
+حد حجم الطلب - رفض الرفع الكبير قبل أن يحلل Starlette جسم multipart ويحفظه في ملف مؤقت
+"""
+
+from typing import Callable, Optional
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+# هامش لحدود multipart وترويسات كل جزء وحقول النموذج فوق حجم الملفات نفسها
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadLimitMiddleware:
+    """Middleware بصيغة ASGI: يرفض بـ 413 من Content-Length قبل قراءة الجسم، أو عند تجاوز العداد أثناء الاستلام
+
+    FastAPI يحلل جسم multipart كاملاً (ويكتب الملفات في ملفات مؤقتة) قبل استدعاء الـ endpoint،
+    فالتحقق داخل save_upload يأتي بعد انتهاء النقل - هنا يتوقف الاستلام عند أول بايت زائد.
+    """
+
+    def __init__(self, app: ASGIApp, limit_for: Callable[[str], Optional[int]]):
+        self.app = app
+        # الحد بالبايت لكل مسار - None يعني بلا حد
+        self.limit_for = limit_for
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        limit = self.limit_for(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        length = Headers(scope=scope).get("content-length")
+        if length and length.isdigit() and int(length) > limit:
+            # رفض قبل استلام أي بايت من الجسم
+            response = JSONResponse({"detail": self._detail(limit)}, status_code=413, headers={"Connection": "close"})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI يعيد رفع HTTPException أثناء تحليل الجسم كما هي
+                    raise HTTPException(status_code=413, detail=self._detail(limit))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    def _detail(limit: int) -> str:
+        """رسالة الخطأ"""
+        return f"Request body too large: more than {limit} bytes"